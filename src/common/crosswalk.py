@@ -0,0 +1,243 @@
+"""
+County FIPS crosswalk: historical codes -> one canonical geography.
+
+County codes changed during the panel's span: Shannon County, SD became
+Oglala Lakota (46113 -> 46102), Wade Hampton Census Area, AK became Kusilvak
+(02270 -> 02158), Bedford city, VA was absorbed by Bedford County (51515 ->
+51019), and Alaska's census areas were split and renamed several times. Left
+alone, each change breaks a unit's series in two and the per-unit lags, the
+influence networks and the unit registry all see two half-length counties.
+
+data/reference/fips_crosswalk.csv lists the changes, one retired or
+superseded code per row:
+    OLD_FIPS, FIPS (canonical code), YEAR (of the change), KIND, NOTE
+KIND decides how rows are combined when the old and the canonical code both
+report in a period:
+- rename  the old code's rows simply continue the canonical series
+- merge   the old unit was absorbed: count columns (`additive`, e.g.
+          population, overdose_deaths) are summed over both rows; rates are
+          the population-weighted mean (county_population.csv), else the
+          canonical unit's own row
+- split   the canonical code is the unit the data keeps reporting (e.g. CDC
+          still publishes Valdez-Cordova after its 2019 split), so the
+          canonical unit's own row wins and the pieces only fill periods it
+          does not report
+Chains (A -> B -> C) are resolved, so every code maps straight to its final
+unit. Lookups go through a dense table indexed by the five-digit code, so
+canonicalising a whole panel is one array gather.
+
+preprocessing/prepare_data.py applies the crosswalk to every county input
+and writes the canonical registry to data/processed/county_units.csv:
+    UNIT_ID, FIPS, COUNTY_NAME, STATE_ABBREV, FIRST_YEAR, LAST_YEAR, OLD_FIPS
+UNIT_ID is the unit's position in FIPS order, a stable integer id for joins
+outside the pipeline. Inside it, county panels and geography.counties() key
+units by their integer canonical code through a dense lookup table
+(periods.UnitIndex), so per-unit joins are array gathers there as well.
+"""
+
+import os
+import functools
+import numpy as np
+import pandas as pd
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+REFERENCE = os.path.join(PROJECT_ROOT, "data", "reference")
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+
+CROSSWALK_PATH = os.path.join(REFERENCE, "fips_crosswalk.csv")
+COUNTY_UNITS_PATH = os.path.join(PROC, "county_units.csv")
+
+FIPS_RANGE = 100000
+KINDS = ("rename", "merge", "split")
+NAME_SUFFIXES = r"\s+(county|parish|borough|census area|municipality|city and borough)$"
+# words kept lower-case inside a name ("Prince of Wales-Hyder", "Lewis and Clark")
+MINOR_WORDS = {"and", "of", "the", "de", "la", "du"}
+SUFFIX_WORDS = ("County", "Census Area", "Borough", "Parish", "City", "city", "Municipality")
+
+
+def fips_code(values):
+    """Integer FIPS codes from ints, floats or (zero-padded) strings; -1 where not numeric."""
+    numeric = pd.to_numeric(pd.Series(np.asarray(values)), errors="coerce")
+    return numeric.fillna(-1).to_numpy().astype(np.int64)
+
+
+@functools.lru_cache(maxsize=None)
+def changes():
+    """The crosswalk rows with integer codes (empty when no reference file is bundled)."""
+    if not os.path.exists(CROSSWALK_PATH):
+        return pd.DataFrame({"OLD_FIPS": [], "FIPS": [], "YEAR": [], "KIND": [], "NOTE": []})
+    table = pd.read_csv(CROSSWALK_PATH, dtype={"OLD_FIPS": str, "FIPS": str})
+    unknown = sorted(set(table["KIND"]) - set(KINDS))
+    if unknown:
+        raise ValueError(f"{CROSSWALK_PATH}: unknown KIND {unknown}; expected one of {KINDS}")
+    return table.assign(OLD_FIPS=fips_code(table["OLD_FIPS"]), FIPS=fips_code(table["FIPS"]))
+
+
+@functools.lru_cache(maxsize=None)
+def tables():
+    """(canonical code per code, KIND code per retired code: -1 = unchanged, else index into KINDS)."""
+    table = changes()
+    canonical = np.arange(FIPS_RANGE, dtype=np.int64)
+    kind = np.full(FIPS_RANGE, -1, dtype=np.int8)
+    canonical[table["OLD_FIPS"].to_numpy()] = table["FIPS"].to_numpy()
+    kind[table["OLD_FIPS"].to_numpy()] = [KINDS.index(k) for k in table["KIND"]]
+    for _ in range(len(table) + 1):
+        step = canonical[canonical]
+        if np.array_equal(step, canonical):
+            break
+        canonical = step
+    else:
+        raise ValueError(f"{CROSSWALK_PATH} contains a cycle")
+    return canonical, kind
+
+
+def canonical_fips(values):
+    """Canonical integer code for every value (codes outside the table are returned unchanged)."""
+    codes = fips_code(values)
+    canonical, _ = tables()
+    ok = (codes >= 0) & (codes < FIPS_RANGE)
+    out = codes.copy()
+    out[ok] = canonical[codes[ok]]
+    return out
+
+
+def retired(values):
+    """True where a code is listed as an OLD_FIPS (it reports under another code)."""
+    codes = fips_code(values)
+    ok = (codes >= 0) & (codes < FIPS_RANGE)
+    out = np.zeros(len(codes), dtype=bool)
+    out[ok] = tables()[1][codes[ok]] >= 0
+    return out
+
+
+def name_key(names):
+    """Case-, punctuation- and suffix-insensitive name so 'De Kalb County' == 'DeKalb County'."""
+    key = names.astype(str).str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    key = key.str.strip().str.lower().str.replace(NAME_SUFFIXES, "", regex=True)
+    key = key.str.replace(r"^saint\b", "st", regex=True).str.replace(r"^sainte\b", "ste", regex=True)
+    return key.str.replace(r"[^a-z0-9]", "", regex=True)
+
+
+def _title_word(word, first):
+    if not word.isupper():
+        return word
+    lower = word.lower()
+    if not first and lower in MINOR_WORDS:
+        return lower
+    parts = [p.capitalize() for p in lower.split("-")]
+    parts = [p[:2] + p[2:].capitalize() if p.startswith("Mc") and len(p) > 2 else p for p in parts]
+    return "-".join(parts)
+
+
+def title_case(name):
+    """All-caps words title-cased; minor words lower-case, hyphenated and Mc- names kept ('McDowell')."""
+    words = str(name).split()
+    return " ".join(_title_word(w, i == 0) for i, w in enumerate(words))
+
+
+def display_name(name):
+    """A raw county name in the panel's style: `title_case`, plus ' County' when it names no unit type."""
+    proper = title_case(name)
+    if not any(s in proper for s in SUFFIX_WORDS):
+        proper = f"{proper} County"
+    return proper
+
+
+def canonicalize(df, keys, value_cols, weights=None, additive=()):
+    """
+    (frame, number of recoded rows): `df` with FIPS mapped to canonical codes,
+    one row per (FIPS, *keys), and every unit named (COUNTY_NAME, STATE_ABBREV)
+    after its latest report.
+
+    FIPS may be ints or strings and keeps its dtype. `weights` is an optional
+    population Series indexed by integer code, used to average the rates of
+    merged units; the `additive` value columns are summed instead.
+    """
+    original = fips_code(df["FIPS"])
+    canonical = canonical_fips(original)
+    recoded = int((canonical != original).sum())
+
+    own = canonical == original
+    kind = np.where(own, -1, tables()[1][np.clip(original, 0, FIPS_RANGE - 1)])
+    work = df.assign(_unit=canonical, _own=own, _merge=kind == KINDS.index("merge"))
+    group_keys = ["_unit"] + list(keys)
+    if recoded:
+        # splits / renames only fill periods the canonical unit does not report itself
+        has_own = work.groupby(group_keys)["_own"].transform("any").to_numpy()
+        work = work[own | work["_merge"].to_numpy() | ~has_own]
+    work = _collapse(work, group_keys, value_cols, weights, additive)
+
+    names = [c for c in ("COUNTY_NAME", "STATE_ABBREV") if c in work.columns]
+    if names:
+        latest = work.sort_values(list(keys), kind="stable").groupby("_unit")[names].last()
+        for col in names:
+            work[col] = latest[col].reindex(work["_unit"]).to_numpy()
+
+    fips = work["_unit"].to_numpy()
+    if df["FIPS"].dtype.kind not in "iuf":
+        fips = pd.Series(fips).astype(str).str.zfill(5).to_numpy()
+    out = work.assign(FIPS=fips).drop(columns=["_unit", "_own", "_merge"])
+    return out.reset_index(drop=True), recoded
+
+
+def _collapse(work, group_keys, value_cols, weights, additive=()):
+    """
+    One row per group: sums of the additive columns (NaN if no row reports
+    one); for the others population-weighted means where every row has a
+    weight, else the unit's own row.
+    """
+    size = work.groupby(group_keys)["_own"].transform("size").to_numpy()
+    if (size == 1).all():
+        return work
+    single, multi = work[size == 1], work[size > 1]
+
+    w = pd.Series(np.nan, index=multi.index)
+    if weights is not None and len(weights):
+        w = pd.Series(weights.reindex(fips_code(multi["FIPS"])).to_numpy(dtype=float), index=multi.index)
+    grouped = multi.assign(_w=w).groupby(group_keys)
+    complete = grouped["_w"].transform("count").to_numpy() == grouped["_w"].transform("size").to_numpy()
+    has_own = grouped["_own"].transform("any").to_numpy()
+    w = np.where(complete, w, np.where(has_own, multi["_own"].to_numpy(dtype=float), 1.0))
+
+    sums = {}
+    additive = set(additive)
+    for i, col in enumerate(value_cols):
+        values = pd.to_numeric(multi[col], errors="coerce").to_numpy(dtype=float)
+        if col in additive:
+            # counts of the absorbed unit belong to the merged unit whatever the weights
+            seen = ~np.isnan(values)
+            sums[f"_num{i}"] = np.where(seen, values, 0.0)
+            sums[f"_den{i}"] = seen.astype(float)
+            continue
+        seen = ~np.isnan(values) & (w > 0)
+        sums[f"_num{i}"] = np.where(seen, w * np.nan_to_num(values), 0.0)
+        sums[f"_den{i}"] = np.where(seen, w, 0.0)
+    sums = multi[group_keys].assign(**sums).groupby(group_keys).sum()
+    first = multi.sort_values("_own", ascending=False, kind="stable").groupby(group_keys).first()
+    sums = sums.reindex(first.index)
+    for i, col in enumerate(value_cols):
+        num, den = sums[f"_num{i}"], sums[f"_den{i}"]
+        first[col] = (num.where(den > 0) if col in additive else num / den.where(den > 0)).to_numpy()
+    first = first.reset_index()
+    return pd.concat([single, first[single.columns]], ignore_index=True)
+
+
+def unit_registry(df):
+    """The canonical county registry of a canonicalized panel: one row per unit with its dense UNIT_ID."""
+    canonical, _ = tables()
+    by_unit = df.assign(_code=fips_code(df["FIPS"])).sort_values(["_code", "YEAR"], kind="stable")
+    units = by_unit.groupby("_code").agg(
+        COUNTY_NAME=("COUNTY_NAME", "last"),
+        STATE_ABBREV=("STATE_ABBREV", "last"),
+        FIRST_YEAR=("YEAR", "min"),
+        LAST_YEAR=("YEAR", "max"),
+    ).reset_index()
+    old = changes()
+    old = old.assign(FIPS=canonical[old["OLD_FIPS"].to_numpy()]).sort_values("OLD_FIPS")
+    retired_codes = old.groupby("FIPS")["OLD_FIPS"].agg(
+        lambda codes: " ".join(f"{c:05d}" for c in codes))
+    units["OLD_FIPS"] = retired_codes.reindex(units["_code"]).fillna("").to_numpy()
+    units.insert(0, "UNIT_ID", np.arange(len(units)))
+    units.insert(1, "FIPS", units.pop("_code").map("{:05d}".format))
+    return units
@@ -0,0 +1,350 @@
+"""
+Shared feature store for the forecasting models.
+
+Builds every covariate once per level as a dense (units x periods x features)
+array, with the next-period rate as target, so model variants and
+hyperparameter searches slice rows out of it instead of rebuilding features
+per fit. Features at period t:
+- rate, rate_lag1, rate_lag2:  own rate at t, t-1, t-2 (lags fall back to the
+                               latest available rate)
+- momentum:                    relative change from t-1 to t
+- spatial_lag:                 mean rate of geographic neighbours (state
+                               adjacency; county adjacency or same-state peers),
+                               0 without observed neighbours
+- state_rate:                  the county's state rate (county level only)
+- exposure_rate:               influence-weighted mean rate of source units
+- exposure_high:               summed influence weight from sources above the
+                               threshold
+- {covariate}, {covariate}_lag1: other panel metrics at t and t-1 (gap-filled,
+                               see common/metric_panel.py), when requested
+
+`metric` selects the panel metric the "rate" features and the target refer to
+(default the dispensing rate); its influence edges are used when they were
+built with --metric, otherwise the dispensing-rate network. Covariate lags for
+every requested metric come from one MetricPanel.lagged call.
+
+The store can be saved to / loaded from an .npz file (outputs/features/),
+which records the SHA-256 of every input file it was built from; a cached
+store is only reused while those files are unchanged.
+`latest_features` computes only the requested columns for the newest period,
+for batch scoring with a saved model.
+"""
+
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from common.periods import DensePanel
+from common.metric_panel import (DEFAULT_METRIC, PANELS, THRESHOLD, MetricPanel, available_metrics, edges_file,
+                                 high_threshold, load_frame, metrics_path, suffix)
+from common.manifest import file_digest, relpath
+from common import crosswalk, geography
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+FEATURE_DIR = os.path.join(OUT, "features")
+
+COVARIATE_LAGS = (0, 1)
+FEATURES = ["rate", "rate_lag1", "rate_lag2", "momentum", "spatial_lag", "state_rate",
+            "exposure_rate", "exposure_high"]
+
+LEVELS = {
+    "state": {
+        "unit": "STATE_ABBREV",
+        "source": "source",
+        "target": "target",
+    },
+    "county": {
+        "unit": "FIPS",
+        "source": "source_fips",
+        "target": "target_fips",
+    },
+}
+
+
+def _weighted_mean(A, R):
+    """Row-weighted mean of A @ R over observed entries; NaN where no weight is observed."""
+    valid = ~np.isnan(R)
+    total = A @ np.where(valid, R, 0.0)
+    mass = A @ valid.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(mass > 0, total / mass, np.nan)
+
+
+def _lag(R, k):
+    out = np.full_like(R, np.nan)
+    out[:, k:] = R[:, :-k]
+    return out
+
+
+class FeatureStore:
+    def __init__(self, level, units, periods, periods_per_year, names, features, target,
+                 metric=DEFAULT_METRIC, covariates=(), threshold=THRESHOLD, inputs=None):
+        self.level = level
+        self.metric = metric
+        self.covariates = list(covariates)
+        self.threshold = float(threshold)
+        self.units = np.asarray(units)
+        self.periods = np.asarray(periods)
+        self.periods_per_year = int(periods_per_year)
+        self.names = list(names)
+        self.features = features
+        self.target = target
+        # {input file: sha256} the store was built from
+        self.inputs = dict(inputs or {})
+
+    @property
+    def unit_col(self):
+        return LEVELS[self.level]["unit"]
+
+    @property
+    def target_years(self):
+        """Calendar year of each period's target (period t + 1)."""
+        return (self.periods + 1) // self.periods_per_year
+
+    @property
+    def valid(self):
+        """(units x periods) rows with an observed rate and next-period target."""
+        return ~np.isnan(self.features[:, :, 0]) & ~np.isnan(self.target)
+
+    def rows(self, min_target_year=None, max_target_year=None):
+        """Unit and period indices of valid rows whose target year is in range."""
+        mask = self.valid
+        years = self.target_years[None, :]
+        if min_target_year is not None:
+            mask = mask & (years >= min_target_year)
+        if max_target_year is not None:
+            mask = mask & (years <= max_target_year)
+        return np.nonzero(mask)
+
+    def design(self, rows, columns=None):
+        """(X, y) for row indices from `rows`, optionally a subset of feature names."""
+        unit_idx, t_idx = rows
+        cols = slice(None) if columns is None else [self.names.index(c) for c in columns]
+        return self.features[unit_idx, t_idx][:, cols], self.target[unit_idx, t_idx]
+
+    @classmethod
+    def build(cls, level="state", threshold=None, metric=DEFAULT_METRIC, covariates=()):
+        inputs = load_inputs(level, metric, covariates)
+        threshold = inputs["threshold"] if threshold is None else threshold
+        columns = compute_features(inputs, threshold=threshold)
+        R = inputs["rates"]
+        target = np.full_like(R, np.nan)
+        target[:, :-1] = R[:, 1:]
+        features = np.stack(list(columns.values()), axis=-1)
+        dense = inputs["panel"]
+        return cls(level, dense.units, dense.periods, dense.periods_per_year, list(columns), features, target,
+                   metric, covariates, threshold, input_digests(level, metric))
+
+    def save(self, path=None):
+        path = path or default_path(self.level, self.metric)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, level=self.level, units=self.units, periods=self.periods,
+                            periods_per_year=self.periods_per_year, names=np.array(self.names),
+                            features=self.features, target=self.target, metric=self.metric,
+                            covariates=np.array(self.covariates, dtype=str), threshold=self.threshold,
+                            inputs=json.dumps(self.inputs, sort_keys=True))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as f:
+            extra = {}
+            if "metric" in f.files:
+                extra = {"metric": str(f["metric"]), "covariates": [str(c) for c in f["covariates"]],
+                         "threshold": float(f["threshold"])}
+            if "inputs" in f.files:
+                extra["inputs"] = json.loads(str(f["inputs"]))
+            return cls(str(f["level"]), f["units"], f["periods"], int(f["periods_per_year"]),
+                       [str(n) for n in f["names"]], f["features"], f["target"], **extra)
+
+
+def influence_path(level, metric=DEFAULT_METRIC):
+    """The metric's influence edges, or the dispensing-rate network's when they were not built."""
+    path = os.path.join(OUT, edges_file(level, metric))
+    if not os.path.exists(path) and metric != DEFAULT_METRIC:
+        path = os.path.join(OUT, edges_file(level))
+    return path
+
+
+def input_paths(level, metric=DEFAULT_METRIC):
+    """Every file `load_inputs` reads for a level: panels, metrics, influence edges and geography."""
+    levels = ["state"] if level == "state" else ["county", "state"]
+    paths = [os.path.join(PROC, PANELS[lvl]["rates"]) for lvl in levels] + [metrics_path(lvl) for lvl in levels]
+    paths += [influence_path(level, metric), geography.STATES_PATH]
+    if level == "county":
+        paths += [geography.COUNTIES_PATH, geography.COUNTY_ADJACENCY_PATH, crosswalk.COUNTY_UNITS_PATH]
+    return paths
+
+
+def input_digests(level, metric=DEFAULT_METRIC):
+    """{project-relative path: sha256} of the existing input files of a level."""
+    digests = {relpath(p): file_digest(p) for p in input_paths(level, metric)}
+    return {p: d["sha256"] for p, d in digests.items() if d is not None}
+
+
+def load_inputs(level, metric=DEFAULT_METRIC, covariates=()):
+    """
+    Rates of `metric`, influence matrix W[s, d], geographic adjacency, (county)
+    state rates and lagged covariate metrics for a level.
+    """
+    spec = LEVELS[level]
+    covariates = [c for c in dict.fromkeys(covariates) if c != metric]
+    panel = load_frame(level, [metric] + covariates)
+    metrics = MetricPanel.load(level, [metric] + covariates, df=panel)
+    dense = metrics.panel(metric)
+    units = dense.units
+
+    edges_path = influence_path(level, metric)
+    if edges_path != os.path.join(OUT, edges_file(level, metric)):
+        print(f"{edges_file(level, metric)} not found; using the {DEFAULT_METRIC} influence network")
+    if not os.path.exists(edges_path):
+        raise SystemExit(f"{edges_path} not found; build the {level} influence network first.")
+    edges = pd.read_csv(edges_path)
+    index = pd.Index(units)
+    src, dst = index.get_indexer(edges[spec["source"]]), index.get_indexer(edges[spec["target"]])
+    keep = (src >= 0) & (dst >= 0)
+    n = len(units)
+    W = sparse.csr_matrix((edges["weight"].to_numpy(dtype=float)[keep], (src[keep], dst[keep])), shape=(n, n))
+
+    inputs = {"panel": dense, "rates": dense.values, "influence": W, "threshold": high_threshold(metric, dense.values)}
+    if covariates:
+        inputs["covariates"] = metrics.lagged(covariates, lags=COVARIATE_LAGS)
+    if level == "state":
+        inputs["adjacency"] = geography.states().adjacency_for(units)
+    else:
+        inputs["adjacency"] = geography.counties().adjacency_for(units)
+        # each county's state row by array indexing, kept where the county has a panel row
+        present = DensePanel.from_frame(panel, "FIPS", DEFAULT_METRIC, units=units, periods=dense.periods).observed
+        if metric in available_metrics("state"):
+            state = DensePanel.from_frame(load_frame("state", [metric]), "STATE_ABBREV", metric)
+            rows = geography.state_rows(units, state.units)
+            state_rates = state.take_rows(rows, dense.periods)
+        else:
+            # county-only metric: the state value is the mean over its counties
+            rows = geography.state_rows(units, geography.states().units)
+            seen = ~np.isnan(dense.values)
+            # one spare last row collects counties of unknown state (row -1)
+            sums = np.zeros((len(geography.states().units) + 1, seen.shape[1]))
+            counts = np.zeros_like(sums)
+            np.add.at(sums, rows, np.where(seen, dense.values, 0.0))
+            np.add.at(counts, rows, seen)
+            with np.errstate(invalid="ignore"):
+                state_rates = (sums / counts)[rows]
+        inputs["state_rates"] = np.where(present, state_rates, np.nan)
+    return inputs
+
+
+def compute_features(inputs, names=None, window=None, threshold=None):
+    """
+    {name: (units x periods) array} for the requested features.
+
+    `window` restricts the computation to the last `window` periods; every
+    feature only looks back two periods, so window=3 gives the exact values for
+    the newest period without touching the rest of the panel.
+    """
+    R = inputs["rates"]
+    state_rates = inputs.get("state_rates")
+    cov_names, C = inputs.get("covariates", ([], None))
+    threshold = inputs.get("threshold", THRESHOLD) if threshold is None else threshold
+    if window is not None:
+        R = R[:, -window:]
+        state_rates = None if state_rates is None else state_rates[:, -window:]
+        C = None if C is None else C[:, -window:]
+    W, A = inputs["influence"], inputs["adjacency"]
+    wanted = None if names is None else set(names)
+
+    def need(*keys):
+        return wanted is None or bool(wanted.intersection(keys))
+
+    out = {"rate": R}
+    lag1 = _lag(R, 1)
+    lag1 = np.where(np.isnan(lag1), R, lag1)
+    if need("rate_lag1"):
+        out["rate_lag1"] = lag1
+    if need("rate_lag2"):
+        lag2 = _lag(R, 2)
+        out["rate_lag2"] = np.where(np.isnan(lag2), lag1, lag2)
+    if need("momentum"):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out["momentum"] = np.nan_to_num((R - lag1) / lag1, nan=0.0, posinf=0.0, neginf=0.0)
+    if need("spatial_lag", "state_rate"):
+        spatial = np.nan_to_num(_weighted_mean(A, R))
+        if need("spatial_lag"):
+            out["spatial_lag"] = spatial
+        if state_rates is not None and need("state_rate"):
+            out["state_rate"] = np.where(np.isnan(state_rates), spatial, state_rates)
+    if need("exposure_rate"):
+        out["exposure_rate"] = np.nan_to_num(_weighted_mean(W.T.tocsr(), R))
+    if need("exposure_high"):
+        out["exposure_high"] = np.asarray(W.T @ (np.nan_to_num(R) > threshold).astype(float))
+    for j, name in enumerate(cov_names):
+        if need(name):
+            out[name] = C[:, :, j]
+    order = FEATURES + list(cov_names) if names is None else list(names)
+    return {k: out[k] for k in order if k in out}
+
+
+def covariates_of(names):
+    """Panel metrics behind covariate feature names ("population_lag1" -> "population")."""
+    return list(dict.fromkeys(re.sub(r"_lag\d+$", "", n) for n in names if n not in FEATURES))
+
+
+def latest_features(level, names, period=None, threshold=None, metric=DEFAULT_METRIC):
+    """
+    (units, period label, target period label, X) for the newest period (or the
+    period with ordinal `period`), building only the requested columns over a
+    three-period window.
+    """
+    inputs = load_inputs(level, metric, covariates_of(names))
+    dense = inputs["panel"]
+    if period is None:
+        t = len(dense.periods) - 1
+    else:
+        hits = np.flatnonzero(dense.periods == period)
+        if not len(hits):
+            raise SystemExit(f"period {period} is not in the {level} panel")
+        t = int(hits[0])
+    inputs["rates"] = dense.values[:, :t + 1]
+    if "state_rates" in inputs:
+        inputs["state_rates"] = inputs["state_rates"][:, :t + 1]
+    if "covariates" in inputs:
+        cov_names, C = inputs["covariates"]
+        inputs["covariates"] = (cov_names, C[:, :t + 1])
+    columns = compute_features(inputs, names, window=3, threshold=threshold)
+    missing = [n for n in names if n not in columns]
+    if missing:
+        raise SystemExit(f"features {missing} are not available at the {level} level")
+    X = np.column_stack([columns[n][:, -1] for n in names])
+    base = dense.periods[t:t + 1]
+    return dense.units, dense.labels(base)[0], dense.labels(base + 1)[0], X
+
+
+def default_path(level, metric=None):
+    return os.path.join(FEATURE_DIR, f"{level}{suffix(metric)}_features.npz")
+
+
+def feature_store(level="state", cached=False, metric=DEFAULT_METRIC, covariates=()):
+    """
+    The level's store, loaded from its default .npz when `cached`, present,
+    built with the same covariates and from the current input files,
+    otherwise rebuilt and saved.
+    """
+    path = default_path(level, metric)
+    covariates = [c for c in dict.fromkeys(covariates) if c != metric]
+    if cached and os.path.exists(path):
+        store = FeatureStore.load(path)
+        if store.covariates != covariates:
+            print(f"{os.path.basename(path)} was built with other covariates; rebuilding")
+        elif store.inputs != input_digests(level, metric):
+            print(f"{os.path.basename(path)} is older than its inputs; rebuilding")
+        else:
+            return store
+    store = FeatureStore.build(level, metric=metric, covariates=covariates)
+    store.save(path)
+    return store
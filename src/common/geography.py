@@ -0,0 +1,357 @@
+"""
+Geography registry: state / county names, FIPS, centroids and adjacency.
+
+Everything is read once per process from the bundled reference files in
+data/reference/ and exposed as integer-indexed structures, so hot loops index
+arrays instead of scanning NEIGHBORS lists:
+- adjacency:   scipy CSR matrix A[i, j] = 1 if j borders i
+- k_hop(k):    CSR mask of units reachable in 1..k hops
+- hops:        dense shortest-path hop counts (inf when unreachable)
+- distances:   dense great-circle distances in km between centroids
+- within_km(r) / nearest(k): sparse spatial masks from a KD-tree over the
+  centroids, so candidate pairs cost O(n log n) rather than a dense n x n scan
+
+Reference files:
+- states.csv            STATE_ABBREV, STATE_NAME, STATE_FIPS, LAT, LON,
+                        PLOT_X, PLOT_Y (schematic map position), NEIGHBORS
+                        (space-separated, as used by the spatial models)
+- counties.csv          FIPS, COUNTY_NAME, STATE_ABBREV, LAT, LON (area
+                        centroids of the 2016 Census cartographic boundary
+                        counties)
+- county_adjacency.csv  FIPS, NEIGHBOR_FIPS: queen contiguity of the 2016
+                        Census cartographic boundary counties, plus the
+                        water-boundary pairs of the Census adjacency file
+- county_population.csv optional: FIPS, POPULATION (e.g. Census estimates; an
+                        optional YEAR column is averaged over)
+
+Without counties.csv the county registry is data/processed/county_units.csv
+(or the processed county panel; names and states only, no centroids); without
+county_adjacency.csv the county adjacency falls back (with a warning) to
+same-state peers.
+County codes in every reference file are mapped through the FIPS crosswalk
+(common/crosswalk.py), so the registry only holds canonical units. County
+keys are resolved by a direct lookup table on the integer code rather than by
+string hashing.
+"""
+
+import os
+import functools
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import shortest_path
+from scipy.spatial import cKDTree
+
+from common import crosswalk
+from common.periods import unit_indexer
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+REFERENCE = os.path.join(PROJECT_ROOT, "data", "reference")
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+
+STATES_PATH = os.path.join(REFERENCE, "states.csv")
+COUNTIES_PATH = os.path.join(REFERENCE, "counties.csv")
+COUNTY_ADJACENCY_PATH = os.path.join(REFERENCE, "county_adjacency.csv")
+COUNTY_POPULATION_PATH = os.path.join(REFERENCE, "county_population.csv")
+COUNTY_PANEL_PATH = os.path.join(PROC, "dispensing_county_year.csv")
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_matrix(lat, lon):
+    """Pairwise great-circle distances (km) between points given in degrees."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class Geography:
+    """
+    Units of one level (states or counties) with integer-indexed adjacency.
+
+    `units` fixes the integer index; `adjacency_for(...)` maps any other unit
+    order (e.g. a panel's) onto it. `normalize` turns caller keys into the
+    index keys `index_keys` (default the units; counties index their integer
+    FIPS, since keys may arrive as ints or unpadded strings).
+    """
+
+    def __init__(self, units, names, adjacency, lat=None, lon=None, state=None, fips=None,
+                 source="reference", normalize=None, index_keys=None):
+        self.units = np.asarray(units)
+        self.names = np.asarray(names)
+        self.fips = None if fips is None else np.asarray(fips)
+        self.adjacency = sparse.csr_matrix(adjacency, dtype=float)
+        self.lat = None if lat is None else np.asarray(lat, dtype=float)
+        self.lon = None if lon is None else np.asarray(lon, dtype=float)
+        self.state = None if state is None else np.asarray(state)
+        self.source = source
+        self.normalize = normalize
+        self._index = unit_indexer(self.units if index_keys is None else index_keys)
+        self._k_hop = {}
+        self._spatial = {}
+
+    def __len__(self):
+        return len(self.units)
+
+    def indexer(self, keys):
+        """Integer positions of `keys` (-1 for unknown units)."""
+        if self.normalize is not None:
+            keys = self.normalize(keys)
+        return self._index.get_indexer(keys)
+
+    def neighbors(self, key):
+        i = self.indexer([key])[0]
+        if i < 0:
+            return []
+        row = self.adjacency[i]
+        return self.units[row.indices].tolist()
+
+    def neighbor_lists(self):
+        """{unit: [neighbours]} in the adjacency's column order."""
+        A = self.adjacency
+        return {u: self.units[A.indices[A.indptr[i]:A.indptr[i + 1]]].tolist() for i, u in enumerate(self.units)}
+
+    def reindex(self, matrix, units):
+        """A unit x unit matrix of this level restricted / reordered to `units`; unknown units get empty rows."""
+        idx = self.indexer(units)
+        keep = np.flatnonzero(idx >= 0)
+        P = sparse.csr_matrix((np.ones(len(keep)), (keep, idx[keep])), shape=(len(units), len(self)))
+        return (P @ sparse.csr_matrix(matrix) @ P.T).tocsr()
+
+    def adjacency_for(self, units):
+        """Adjacency reindexed to an arbitrary unit order; unknown units get no neighbours."""
+        return self.reindex(self.adjacency, units)
+
+    def k_hop(self, k):
+        """CSR 0/1 mask of units within 1..k hops (self excluded), memoized per k."""
+        if k not in self._k_hop:
+            A = (self.adjacency + self.adjacency.T).astype(bool).astype(float)
+            reach = A.copy()
+            frontier = A.copy()
+            for _ in range(k - 1):
+                frontier = (frontier @ A).astype(bool).astype(float)
+                reach = (reach + frontier).astype(bool).astype(float)
+            reach = reach.tolil()
+            reach.setdiag(0)
+            reach = reach.tocsr()
+            reach.eliminate_zeros()
+            self._k_hop[k] = reach
+        return self._k_hop[k]
+
+    def neighborhood(self, key, k=1):
+        i = self.indexer([key])[0]
+        if i < 0:
+            return []
+        return self.units[self.k_hop(k)[i].indices].tolist()
+
+    @functools.cached_property
+    def hops(self):
+        """Shortest-path hop counts over the (symmetrised) adjacency; inf when unreachable."""
+        return shortest_path(self.adjacency, unweighted=True, directed=False)
+
+    @functools.cached_property
+    def located(self):
+        """Positions of units that have centroid coordinates."""
+        if self.lat is None:
+            return np.array([], dtype=int)
+        return np.flatnonzero(~np.isnan(self.lat) & ~np.isnan(self.lon))
+
+    @functools.cached_property
+    def tree(self):
+        """KD-tree over the located units' centroids (unit-sphere coordinates)."""
+        if len(self.located) == 0:
+            raise ValueError("no centroid coordinates for this level; bundle them in data/reference/")
+        return cKDTree(unit_vectors(self.lat[self.located], self.lon[self.located]))
+
+    def within_km(self, radius_km):
+        """CSR 0/1 mask of unit pairs whose centroids are at most radius_km apart (self excluded)."""
+        key = ("radius", float(radius_km))
+        if key not in self._spatial:
+            chord = 2.0 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2.0)
+            pairs = self.tree.query_pairs(chord, output_type="ndarray")
+            i, j = self.located[pairs[:, 0]], self.located[pairs[:, 1]]
+            n = len(self)
+            mask = sparse.csr_matrix((np.ones(2 * len(i)), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                                     shape=(n, n))
+            self._spatial[key] = mask
+        return self._spatial[key]
+
+    def nearest(self, k):
+        """CSR 0/1 mask M[i, j] = 1 if j is one of the k nearest other units to i."""
+        key = ("knn", int(k))
+        if key not in self._spatial:
+            located = self.located
+            k_eff = min(int(k), len(located) - 1)
+            n = len(self)
+            if k_eff < 1:
+                self._spatial[key] = sparse.csr_matrix((n, n))
+                return self._spatial[key]
+            _, nbr = self.tree.query(self.tree.data, k=k_eff + 1)
+            rows = np.repeat(located, k_eff)
+            cols = located[nbr[:, 1:]].ravel()
+            self._spatial[key] = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        return self._spatial[key]
+
+    @functools.cached_property
+    def distances(self):
+        """Great-circle distance matrix between centroids (km)."""
+        if self.lat is None or np.isnan(self.lat).all():
+            raise ValueError("no centroid coordinates for this level; bundle them in data/reference/")
+        return haversine_matrix(self.lat, self.lon)
+
+
+def unit_vectors(lat, lon):
+    """Centroids on the unit sphere, so Euclidean chord length is monotone in great-circle distance."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def fips_key(values):
+    """Five-digit zero-padded FIPS strings from ints, floats or strings."""
+    values = pd.Series(np.asarray(values))
+    numeric = pd.to_numeric(values, errors="coerce")
+    return numeric.fillna(-1).astype(int).astype(str).str.zfill(5).where(numeric.notna(), values.astype(str)).to_numpy()
+
+
+def _adjacency_from_pairs(units, src, dst):
+    index = pd.Index(units)
+    i, j = index.get_indexer(src), index.get_indexer(dst)
+    keep = (i >= 0) & (j >= 0) & (i != j)
+    n = len(units)
+    A = sparse.csr_matrix((np.ones(keep.sum()), (i[keep], j[keep])), shape=(n, n))
+    A.sum_duplicates()
+    A.data[:] = 1.0
+    return A
+
+
+def same_state_adjacency(state_of):
+    """0/1 matrix linking every unit to the other units of its state."""
+    codes = pd.factorize(pd.Series(state_of))[0]
+    n = len(codes)
+    G = sparse.csr_matrix((np.ones(n), (np.arange(n), codes)))
+    A = (G @ G.T).tolil()
+    A.setdiag(0)
+    A = A.tocsr()
+    A.eliminate_zeros()
+    return A
+
+
+@functools.lru_cache(maxsize=None)
+def states():
+    table = pd.read_csv(STATES_PATH, keep_default_na=False, na_values=[""])
+    units = table["STATE_ABBREV"].to_numpy()
+    nbrs = table["NEIGHBORS"].fillna("").str.split()
+    src = np.repeat(units, nbrs.str.len())
+    dst = np.concatenate([np.asarray(n, dtype=object) for n in nbrs]) if len(nbrs) else []
+    geo = Geography(units, table["STATE_NAME"], _adjacency_from_pairs(units, src, dst),
+                    table["LAT"], table["LON"], state=units, fips=table["STATE_FIPS"])
+    geo.positions = table[["PLOT_X", "PLOT_Y"]].to_numpy()
+    geo.listed_neighbors = dict(zip(units, nbrs))
+    return geo
+
+
+def canonical_key(values):
+    """Five-digit FIPS keys of the canonical (crosswalked) counties."""
+    return fips_key(crosswalk.canonical_fips(values))
+
+
+@functools.lru_cache(maxsize=None)
+def counties():
+    if os.path.exists(COUNTIES_PATH):
+        table = pd.read_csv(COUNTIES_PATH, dtype={"FIPS": str})
+        table = table[~crosswalk.retired(table["FIPS"])]
+        source = "reference"
+    else:
+        if os.path.exists(crosswalk.COUNTY_UNITS_PATH):
+            table = pd.read_csv(crosswalk.COUNTY_UNITS_PATH, dtype={"FIPS": str})
+        else:
+            panel = pd.read_csv(COUNTY_PANEL_PATH, dtype={"FIPS": str})
+            table = panel.drop_duplicates("FIPS", keep="last")
+        table = table[["FIPS", "COUNTY_NAME", "STATE_ABBREV"]].assign(LAT=np.nan, LON=np.nan)
+        source = "panel"
+    table = table.assign(FIPS=fips_key(table["FIPS"])).sort_values("FIPS").reset_index(drop=True)
+    units = table["FIPS"].to_numpy()
+
+    if os.path.exists(COUNTY_ADJACENCY_PATH):
+        pairs = pd.read_csv(COUNTY_ADJACENCY_PATH, dtype=str)
+        adjacency = _adjacency_from_pairs(units, canonical_key(pairs["FIPS"]), canonical_key(pairs["NEIGHBOR_FIPS"]))
+    else:
+        print(f"Warning: {os.path.basename(COUNTY_ADJACENCY_PATH)} not found; county adjacency falls back to "
+              "linking every county to all others in its state (not geographic neighbours)")
+        adjacency = same_state_adjacency(table["STATE_ABBREV"])
+        source += "+same_state"
+
+    return Geography(units, table["COUNTY_NAME"], adjacency, table["LAT"], table["LON"],
+                     state=table["STATE_ABBREV"], fips=units.astype(int), source=source,
+                     normalize=crosswalk.canonical_fips, index_keys=units.astype(int))
+
+
+def state_rows(fips, state_units):
+    """
+    Row of each county's state in `state_units` (-1 if absent), from the state
+    FIPS prefix of the county code - an array gather, no join on STATE_ABBREV.
+    """
+    geo = states()
+    table = np.full(100, -1, dtype=np.int64)
+    table[geo.fips.astype(int)] = pd.Index(np.asarray(state_units)).get_indexer(geo.units)
+    codes = crosswalk.fips_code(fips)
+    prefix = np.where(codes >= 0, codes // 1000, -1)
+    ok = (prefix >= 0) & (prefix < len(table))
+    out = np.full(len(codes), -1, dtype=np.int64)
+    out[ok] = table[prefix[ok]]
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def county_population():
+    """Population by five-digit FIPS key; empty when no reference file is bundled."""
+    if not os.path.exists(COUNTY_POPULATION_PATH):
+        return pd.Series(dtype=float)
+    table = pd.read_csv(COUNTY_POPULATION_PATH, dtype={"FIPS": str})
+    return table.groupby(fips_key(table["FIPS"]))["POPULATION"].mean().astype(float)
+
+
+@functools.lru_cache(maxsize=None)
+def state_neighbors():
+    """{state: [neighbouring states]} exactly as listed in the reference file."""
+    geo = states()
+    return {u: list(geo.listed_neighbors[u]) for u in geo.units}
+
+
+@functools.lru_cache(maxsize=None)
+def state_names():
+    geo = states()
+    return dict(zip(geo.units, geo.names))
+
+
+@functools.lru_cache(maxsize=None)
+def state_positions():
+    """Schematic (x, y) map positions used by the paper figures."""
+    geo = states()
+    return {u: (float(x), float(y)) for u, (x, y) in zip(geo.units, geo.positions)}
+
+
+def county_layout(fips, state_of, priority=None, spacing=0.006):
+    """
+    (x, y) per county for drawing: (lon, lat) centroids when counties.csv has
+    them for every county, otherwise a golden-angle spiral around the state's
+    schematic position, highest `priority` first (innermost).
+    """
+    geo = counties()
+    idx = geo.indexer(fips)
+    if len(idx) and (idx >= 0).all() and not np.isnan(geo.lat[idx]).any():
+        return np.column_stack([geo.lon[idx], geo.lat[idx]])
+    positions = state_positions()
+    state_of = pd.Series(np.asarray(state_of))
+    centre = np.array([positions.get(s, (0.5, 0.5)) for s in state_of])
+    order = np.arange(len(state_of)) if priority is None else np.argsort(-np.asarray(priority, dtype=float), kind="stable")
+    rank = np.empty(len(state_of), dtype=int)
+    rank[order] = state_of.iloc[order].groupby(state_of.iloc[order].to_numpy()).cumcount().to_numpy()
+    radius = spacing * np.sqrt(rank + 1)
+    angle = rank * np.pi * (3 - np.sqrt(5))
+    return centre + radius[:, None] * np.column_stack([np.cos(angle), np.sin(angle)])
@@ -0,0 +1,249 @@
+"""
+Stage-level timing and resource instrumentation.
+
+Wrap a pipeline step in `stage(...)` (or decorate it with `instrumented(...)`)
+to record, per stage:
+- wall time and CPU time
+- peak RSS of the process at the end of the stage
+- row / edge / node counts reported through `record.count(...)` (or
+  `current_stage().count(...)` inside a decorated function)
+
+Each finished stage is appended as one JSON line to outputs/stage_metrics.jsonl
+(override with EPI_METRICS=<path>, disable with EPI_METRICS=off). Stages nest;
+every line carries its parent stage and the run id (EPI_RUN_ID, default
+<timestamp>-<pid>) so one pipeline run can be grouped across scripts.
+
+Profiling is opt-in per run:
+    EPI_PROFILE=cprofile      -> outputs/profiles/<run>_<stage>.prof (pstats / snakeviz)
+    EPI_PROFILE=pyinstrument  -> outputs/profiles/<run>_<stage>.html (if installed)
+Only the outermost profiled stage is profiled, since profilers do not nest;
+EPI_PROFILE_STAGES=name1,name2 restricts profiling to the named stages.
+
+Summarise a metrics file:
+    python src/common/instrument.py [outputs/stage_metrics.jsonl] [--run <run_id>]
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+METRICS_PATH = os.path.join(OUT, "stage_metrics.jsonl")
+PROFILE_DIR = os.path.join(OUT, "profiles")
+
+RUN_ID = os.environ.get("EPI_RUN_ID") or f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+
+_active = []
+_profiling = [False]
+_listeners = []
+
+
+class StageRecord:
+    """Mutable record of one running stage; counts can be added while it runs."""
+
+    def __init__(self, name, parent, counts):
+        self.name = name
+        self.parent = parent
+        self.counts = dict(counts)
+        self.wall_s = None
+        self.cpu_s = None
+
+    def count(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = int(value)
+        return self
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def metrics_path():
+    path = os.environ.get("EPI_METRICS", METRICS_PATH)
+    return None if path.lower() in ("off", "0", "none", "") else path
+
+
+def subscribe(callback):
+    """Also pass every finished stage entry to `callback` (e.g. the run manifest); returns an unsubscribe function."""
+    _listeners.append(callback)
+    return lambda: _listeners.remove(callback)
+
+
+def emit(entry, path=None):
+    """Append one metrics entry as a JSON line."""
+    for callback in list(_listeners):
+        callback(entry)
+    path = path or metrics_path()
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def _profile_mode(name):
+    mode = os.environ.get("EPI_PROFILE", "").strip().lower()
+    if not mode or mode in ("0", "off") or _profiling[0]:
+        return None
+    only = os.environ.get("EPI_PROFILE_STAGES")
+    if only and name not in {s.strip() for s in only.split(",")}:
+        return None
+    return "pyinstrument" if mode == "pyinstrument" else "cprofile"
+
+
+def _start_profiler(mode):
+    if mode == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed; falling back to cProfile.")
+            mode = "cprofile"
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return mode, profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return mode, profiler
+
+
+def _dump_profile(mode, profiler, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{RUN_ID}_{name.replace('/', '_')}")
+    if mode == "pyinstrument":
+        profiler.stop()
+        path = stem + ".html"
+        with open(path, "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        path = stem + ".prof"
+        profiler.dump_stats(path)
+    return path
+
+
+@contextmanager
+def stage(name, **counts):
+    """
+    Time a block and emit its metrics when it exits (also on error).
+
+        with stage("county.edges", states=50) as rec:
+            ...
+            rec.count(edges=len(edges))
+    """
+    record = StageRecord(name, _active[-1].name if _active else None, counts)
+    mode = _profile_mode(name)
+    profiler = None
+    if mode:
+        mode, profiler = _start_profiler(mode)
+        _profiling[0] = True
+
+    _active.append(record)
+    started = datetime.now().isoformat(timespec="seconds")
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    status = "ok"
+    try:
+        yield record
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+        record.wall_s, record.cpu_s = wall, cpu
+        _active.pop()
+        entry = {
+            "run_id": RUN_ID,
+            "script": os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+            "stage": name,
+            "parent": record.parent,
+            "started": started,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "peak_rss_mb": peak_rss_mb(),
+            "counts": record.counts,
+            "status": status,
+        }
+        if profiler is not None:
+            entry["profile"] = _dump_profile(mode, profiler, name)
+            _profiling[0] = False
+        emit(entry)
+
+
+def current_stage():
+    """The innermost running stage, so decorated functions can report counts."""
+    return _active[-1] if _active else StageRecord(None, None, {})
+
+
+def instrumented(name=None, **counts):
+    """Decorator form of `stage`; the stage name defaults to module.function."""
+
+    def decorate(func):
+        label = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(label, **counts):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def load_metrics(path=None, run_id=None):
+    path = path or METRICS_PATH
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if run_id == "last" and entries:
+        run_id = entries[-1]["run_id"]
+    return [e for e in entries if run_id is None or e["run_id"] == run_id]
+
+
+def summarize(entries):
+    """Per-stage totals, slowest first, as a list of dicts."""
+    totals = {}
+    for e in entries:
+        row = totals.setdefault(e["stage"], {"stage": e["stage"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                             "peak_rss_mb": 0.0, "counts": {}})
+        row["calls"] += 1
+        row["wall_s"] += e["wall_s"]
+        row["cpu_s"] += e["cpu_s"]
+        row["peak_rss_mb"] = max(row["peak_rss_mb"], e.get("peak_rss_mb") or 0.0)
+        for key, value in e.get("counts", {}).items():
+            row["counts"][key] = row["counts"].get(key, 0) + value
+    return sorted(totals.values(), key=lambda r: r["wall_s"], reverse=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=METRICS_PATH)
+    parser.add_argument("--run", default=None, help="run id to summarise ('last' for the most recent)")
+    args = parser.parse_args(argv)
+
+    rows = summarize(load_metrics(args.path, args.run))
+    print(f"{'stage':<45} {'calls':>5} {'wall_s':>9} {'cpu_s':>9} {'rss_mb':>8}  counts")
+    for r in rows:
+        counts = ", ".join(f"{k}={v}" for k, v in r["counts"].items())
+        print(f"{r['stage']:<45} {r['calls']:>5} {r['wall_s']:>9.3f} {r['cpu_s']:>9.3f} {r['peak_rss_mb']:>8.1f}  {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Run manifests: what each pipeline step read, wrote and ran with.
+
+`python src/pipeline.py ...` writes outputs/manifests/<run_id>.json (the run id
+is the one in stage_metrics.jsonl, see instrument.py) with, per step:
+- command, options and the step's seed
+- sha256 / size of every project file it read (inputs) and wrote (outputs),
+  each input linked to the earlier step of the run that produced it
+- hashes of the project modules it imported (code)
+- its stage timings and counts
+and, per run, the run seed, Python / platform, package versions and git commit.
+Files are tracked with an audit hook on `open`, so anything read or written
+through open() under data/, outputs/, docs/ or models/ in the pipeline process
+is seen (files opened only by worker processes are not).
+
+Seeding: EPI_SEED (default 0) is the run seed. Each step gets
+derive_seed(command), which seeds `random` and NumPy's legacy global state
+before it runs; scripts draw their own generators from derive_seed(<name>) so
+the same seed gives the same output whether run directly or via the pipeline.
+
+With `pipeline.py --cached`, a step is skipped when an earlier manifest has
+the same command, options and seed, and its code, inputs and outputs all
+still hash the same. `pipeline.py replay <manifest>` re-runs a manifest's
+steps and checks the outputs against the recorded hashes.
+
+    python src/common/manifest.py list
+    python src/common/manifest.py show [<manifest>|last]
+    python src/common/manifest.py verify [<manifest>|last] [--inputs]
+    python src/common/manifest.py diff <manifest_a> <manifest_b>
+
+EPI_MANIFEST=off disables writing manifests.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import platform
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import instrument
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+SRC = os.path.join(PROJECT_ROOT, "src")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+MANIFEST_DIR = os.path.join(OUT, "manifests")
+
+TRACKED = ["data", "outputs", "docs", "models"]
+IGNORED = ["outputs/manifests", "outputs/profiles", "outputs/stage_metrics.jsonl"]
+PACKAGES = ["numpy", "pandas", "scipy", "scikit-learn", "networkx", "matplotlib", "joblib", "pillow",
+            "statsmodels", "duckdb"]
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+
+
+def enabled():
+    return os.environ.get("EPI_MANIFEST", "on").strip().lower() not in ("off", "0", "none", "")
+
+
+def run_seed():
+    return int(os.environ.get("EPI_SEED", "0"))
+
+
+def derive_seed(name, seed=None):
+    """A stable 32-bit seed for `name` under the run seed (independent streams per step / script)."""
+    seed = run_seed() if seed is None else seed
+    return int.from_bytes(hashlib.sha256(f"{seed}:{name}".encode()).digest()[:4], "little")
+
+
+def seed_everything(name, seed=None):
+    """Seed `random` and NumPy's global state for one step; returns the seed used."""
+    value = derive_seed(name, seed)
+    random.seed(value)
+    np.random.seed(value)
+    return value
+
+
+def relpath(path):
+    return os.path.relpath(os.path.abspath(path), PROJECT_ROOT).replace(os.sep, "/")
+
+
+def file_digest(path, chunk=1 << 20):
+    """{"sha256", "bytes"} of a file, or None if it does not exist."""
+    if not os.path.isfile(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return {"sha256": h.hexdigest(), "bytes": os.path.getsize(path)}
+
+
+def package_versions(names=PACKAGES):
+    from importlib import metadata
+    versions = {}
+    for name in names:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return versions
+
+
+def git_commit():
+    try:
+        head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True,
+                              timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "src"], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if head.returncode != 0:
+        return None
+    return {"commit": head.stdout.strip(), "src_dirty": bool(dirty.stdout.strip())}
+
+
+class FileTracker:
+    """Project files opened for reading / writing while active (one audit hook per process)."""
+
+    _installed = False
+    _current = None
+
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+
+    @classmethod
+    def _hook(cls, event, args):
+        tracker = cls._current
+        if tracker is None or event != "open":
+            return
+        path, mode, flags = args
+        if isinstance(path, int):
+            return
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        path = relpath(os.fspath(path))
+        if path.startswith("..") or path.split("/")[0] not in TRACKED:
+            return
+        if any(path == p or path.startswith(p + "/") for p in IGNORED):
+            return
+        writing = any(c in mode for c in "wax+") if mode is not None else bool(flags & WRITE_FLAGS)
+        (tracker.writes if writing else tracker.reads).add(path)
+
+    def __enter__(self):
+        if not FileTracker._installed:
+            sys.addaudithook(FileTracker._hook)
+            FileTracker._installed = True
+        FileTracker._current = self
+        return self
+
+    def __exit__(self, *exc):
+        FileTracker._current = None
+        return False
+
+
+def code_hashes():
+    """Hashes of every imported module under src/ (the code a step actually ran)."""
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(SRC + os.sep) and path.endswith(".py"):
+            files.add(os.path.abspath(path))
+    return {relpath(p): file_digest(p)["sha256"] for p in sorted(files)}
+
+
+def step_key(command, argv, no_plots, seed):
+    return {"command": command, "argv": list(argv), "no_plots": bool(no_plots), "seed": seed}
+
+
+class Manifest:
+    """One pipeline run; saved after every step so partial runs are kept."""
+
+    def __init__(self, data=None, path=None):
+        self.data = data or {
+            "run_id": instrument.RUN_ID,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "seed": run_seed(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "packages": package_versions(),
+            "git": git_commit(),
+            "steps": [],
+        }
+        self.path = path or os.path.join(MANIFEST_DIR, f"{self.data['run_id']}.json")
+
+    @property
+    def steps(self):
+        return self.data["steps"]
+
+    @classmethod
+    def load(cls, path):
+        path = resolve(path)
+        with open(path) as f:
+            return cls(json.load(f), path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.data, f, indent=1)
+        return self.path
+
+    def producer(self, path):
+        """Index of the latest step of this run that wrote `path`."""
+        for i in range(len(self.steps) - 1, -1, -1):
+            if path in self.steps[i]["outputs"]:
+                return i
+        return None
+
+    def record(self, command, argv, no_plots, seed, run):
+        """Run `run()` as one step, tracking its files, code and stages; re-raises its errors after saving."""
+        stages = []
+        unsubscribe = instrument.subscribe(lambda e: stages.append(
+            {k: e[k] for k in ("stage", "parent", "wall_s", "cpu_s", "peak_rss_mb", "counts", "status")}))
+        status = "ok"
+        t0 = time.perf_counter()
+        try:
+            with FileTracker() as files:
+                run()
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            unsubscribe()
+            outputs = {p: file_digest(os.path.join(PROJECT_ROOT, p)) for p in sorted(files.writes)}
+            inputs = {}
+            for p in sorted(files.reads - files.writes):
+                digest = file_digest(os.path.join(PROJECT_ROOT, p))
+                if digest is not None:
+                    inputs[p] = dict(digest, produced_by=self.producer(p))
+            self.steps.append(dict(step_key(command, argv, no_plots, seed),
+                                   status=status,
+                                   wall_s=round(time.perf_counter() - t0, 6),
+                                   code=code_hashes(),
+                                   inputs=inputs,
+                                   outputs={p: d for p, d in outputs.items() if d is not None},
+                                   stages=stages))
+            self.save()
+
+    def reuse(self, step):
+        """Record a step skipped by --cached, pointing at the manifest it came from."""
+        self.steps.append(dict(step, status="cached", wall_s=0.0, stages=[]))
+        self.save()
+
+
+def manifest_paths():
+    if not os.path.isdir(MANIFEST_DIR):
+        return []
+    paths = [os.path.join(MANIFEST_DIR, f) for f in os.listdir(MANIFEST_DIR) if f.endswith(".json")]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def resolve(path):
+    """A manifest path, run id, or 'last'."""
+    if path == "last":
+        paths = manifest_paths()
+        if not paths:
+            raise SystemExit(f"No manifests in {MANIFEST_DIR}")
+        return paths[-1]
+    if not os.path.exists(path):
+        candidate = os.path.join(MANIFEST_DIR, path if path.endswith(".json") else path + ".json")
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def check_files(recorded):
+    """{path: "ok" | "changed" | "missing"} for recorded {path: digest}."""
+    status = {}
+    for path, digest in recorded.items():
+        current = file_digest(os.path.join(PROJECT_ROOT, path))
+        status[path] = "missing" if current is None else "ok" if current["sha256"] == digest["sha256"] else "changed"
+    return status
+
+
+def still_valid(step):
+    """True when the step's code, inputs and outputs all hash as recorded."""
+    for path, sha in step["code"].items():
+        current = file_digest(os.path.join(PROJECT_ROOT, path))
+        if current is None or current["sha256"] != sha:
+            return False
+    return bool(step["outputs"]) and all(s == "ok" for s in check_files(step["inputs"]).values()) \
+        and all(s == "ok" for s in check_files(step["outputs"]).values())
+
+
+def find_cached(command, argv, no_plots, seed, exclude=None):
+    """The newest recorded, still-valid successful step with the same key, or None."""
+    key = step_key(command, argv, no_plots, seed)
+    for path in reversed(manifest_paths()):
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        try:
+            steps = Manifest.load(path).steps
+        except (OSError, ValueError):
+            continue
+        for step in reversed(steps):
+            if step["status"] == "ok" and all(step[k] == v for k, v in key.items()) and still_valid(step):
+                return dict(step, cached_from=os.path.basename(path))
+    return None
+
+
+def verify(manifest, inputs=False):
+    """Rows of (step, kind, path, status) for every recorded output (and input)."""
+    rows = []
+    for i, step in enumerate(manifest.steps):
+        kinds = [("output", step["outputs"])] + ([("input", step["inputs"])] if inputs else [])
+        for kind, recorded in kinds:
+            for path, status in check_files(recorded).items():
+                rows.append((i, step["command"], kind, path, status))
+    return rows
+
+
+def _sha(entry):
+    return entry["sha256"] if isinstance(entry, dict) else entry
+
+
+def diff(a, b):
+    """Human-readable differences between two manifests."""
+    lines = []
+    for field in ("seed", "python", "platform"):
+        if a.data.get(field) != b.data.get(field):
+            lines.append(f"{field}: {a.data.get(field)} -> {b.data.get(field)}")
+    pa, pb = a.data.get("packages", {}), b.data.get("packages", {})
+    for name in sorted(set(pa) | set(pb)):
+        if pa.get(name) != pb.get(name):
+            lines.append(f"package {name}: {pa.get(name)} -> {pb.get(name)}")
+    ga, gb = a.data.get("git") or {}, b.data.get("git") or {}
+    if ga.get("commit") != gb.get("commit"):
+        lines.append(f"git: {ga.get('commit')} -> {gb.get('commit')}")
+
+    steps_b = {s["command"]: s for s in b.steps}
+    for sa in a.steps:
+        sb = steps_b.pop(sa["command"], None)
+        name = sa["command"]
+        if sb is None:
+            lines.append(f"[{name}] only in {a.data['run_id']}")
+            continue
+        for field in ("argv", "no_plots", "seed", "status"):
+            if sa[field] != sb[field]:
+                lines.append(f"[{name}] {field}: {sa[field]} -> {sb[field]}")
+        for kind in ("code", "inputs", "outputs"):
+            fa, fb = sa[kind], sb[kind]
+            for path in sorted(set(fa) | set(fb)):
+                ha, hb = _sha(fa.get(path)), _sha(fb.get(path))
+                if ha != hb:
+                    change = "added" if ha is None else "removed" if hb is None else "changed"
+                    lines.append(f"[{name}] {kind} {change}: {path}")
+        if sa["wall_s"] and sb["wall_s"]:
+            lines.append(f"[{name}] wall {sa['wall_s']:.2f}s -> {sb['wall_s']:.2f}s "
+                         f"({sb['wall_s'] / sa['wall_s']:.2f}x)")
+        stages_a = {s["stage"]: s for s in sa["stages"]}
+        for s in sb["stages"]:
+            prev = stages_a.get(s["stage"])
+            if prev and prev["counts"] != s["counts"]:
+                lines.append(f"[{name}] {s['stage']} counts: {prev['counts']} -> {s['counts']}")
+    for name in steps_b:
+        lines.append(f"[{name}] only in {b.data['run_id']}")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("list")
+    show = sub.add_parser("show")
+    show.add_argument("manifest", nargs="?", default="last")
+    check = sub.add_parser("verify")
+    check.add_argument("manifest", nargs="?", default="last")
+    check.add_argument("--inputs", action="store_true", help="also check the recorded inputs")
+    compare = sub.add_parser("diff")
+    compare.add_argument("a")
+    compare.add_argument("b")
+    args = parser.parse_args(argv)
+
+    if args.action == "list":
+        for path in manifest_paths():
+            m = Manifest.load(path)
+            commands = ", ".join(s["command"] + ("*" if s["status"] == "cached" else "") for s in m.steps)
+            print(f"{m.data['run_id']:<28} seed={m.data['seed']:<6} {commands}")
+        return
+
+    if args.action == "diff":
+        lines = diff(Manifest.load(args.a), Manifest.load(args.b))
+        print("\n".join(lines) if lines else "No differences.")
+        return
+
+    manifest = Manifest.load(args.manifest)
+    if args.action == "show":
+        d = manifest.data
+        print(f"run {d['run_id']} ({d['created']}), seed {d['seed']}, Python {d['python']}, {d['platform']}")
+        print("packages: " + ", ".join(f"{k} {v}" for k, v in d["packages"].items()))
+        for i, s in enumerate(manifest.steps):
+            options = " ".join(s["argv"]) + (" --no-plots" if s["no_plots"] else "")
+            print(f"\n[{i}] {s['command']} {options}  seed={s['seed']}  {s['status']}  {s['wall_s']:.2f}s")
+            for path, digest in s["inputs"].items():
+                origin = f"  <- step {digest['produced_by']}" if digest["produced_by"] is not None else ""
+                print(f"    in   {path}  {digest['sha256'][:12]}{origin}")
+            for path, digest in s["outputs"].items():
+                print(f"    out  {path}  {digest['sha256'][:12]}")
+        return
+
+    rows = verify(manifest, args.inputs)
+    bad = [r for r in rows if r[4] != "ok"]
+    for step, command, kind, path, status in bad:
+        print(f"[{step}] {command:<18} {kind:<6} {status:<8} {path}")
+    print(f"{len(rows) - len(bad)} of {len(rows)} recorded files match {manifest.path}")
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
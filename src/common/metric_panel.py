@@ -0,0 +1,193 @@
+"""
+Multi-metric panels: several per-unit series on one (units x periods x metrics) array.
+
+The dispensing rate (opioid_dispensing_rate, from dispensing_{level}_year.csv)
+is always metric 0. Further metrics - overdose deaths, population, MME per
+capita, ... - come from data/processed/metrics_{level}_year.csv, which
+preprocessing/prepare_data.py assembles from every CSV in data/raw/metrics/
+(see there for the accepted layouts). Metrics are aligned to the dispensing
+panel's units and periods.
+
+Every script that used to read the rate column takes a metric name instead
+(`--metric`, default opioid_dispensing_rate); outputs for another metric get a
+`_{metric}` suffix so the default files are unchanged. `MetricPanel.lagged`
+builds lagged copies of any subset of metrics in one pass over the 3-d array,
+for cross-metric regression features.
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from common.periods import DensePanel, infer_granularity, period_columns, period_ordinal, unit_indexer
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+
+DEFAULT_METRIC = "opioid_dispensing_rate"
+THRESHOLD = 87.35
+# first-high year of a unit that is never high: later than every period
+NEVER = np.iinfo(np.int32).max
+# high cut-off for metrics without a fixed one: this quantile of all observed values
+HIGH_QUANTILE = 0.75
+# metrics that are counts rather than rates: they add up when units are combined
+ADDITIVE_METRIC = r"(^|_)(population|deaths|count|counts|cases|events|prescriptions)$"
+
+PANELS = {
+    "state": {"rates": "dispensing_state_year.csv", "metrics": "metrics_state_year.csv", "unit": "STATE_ABBREV"},
+    "county": {"rates": "dispensing_county_year.csv", "metrics": "metrics_county_year.csv", "unit": "FIPS"},
+}
+EDGE_FILES = {"state": "influence_edges", "county": "county_influence_edges"}
+
+
+def suffix(metric):
+    """'' for the dispensing rate, '_{metric}' otherwise (output file names)."""
+    return "" if metric in (None, DEFAULT_METRIC) else f"_{metric}"
+
+
+def edges_file(level, metric=None):
+    return f"{EDGE_FILES[level]}{suffix(metric)}.csv"
+
+
+def high_threshold(metric, values):
+    """The fixed dispensing threshold, or the HIGH_QUANTILE of another metric's observed values."""
+    if metric in (None, DEFAULT_METRIC):
+        return THRESHOLD
+    values = np.asarray(values, dtype=float)
+    return float(np.nanquantile(values, HIGH_QUANTILE)) if np.isfinite(values).any() else np.inf
+
+
+def is_additive(metric):
+    """True for count metrics (population, overdose_deaths, ..._count), which are summed rather than averaged."""
+    return re.search(ADDITIVE_METRIC, str(metric).lower()) is not None
+
+
+def metrics_path(level):
+    return os.path.join(PROC, PANELS[level]["metrics"])
+
+
+def available_metrics(level):
+    """Metric names for a level: the dispensing rate plus the columns of its metrics file."""
+    names = [DEFAULT_METRIC]
+    path = metrics_path(level)
+    if os.path.exists(path):
+        keys = {PANELS[level]["unit"], "STATE_ABBREV", "YEAR", "QUARTER", "MONTH"}
+        names += [c for c in pd.read_csv(path, nrows=0).columns if c not in keys and c != DEFAULT_METRIC]
+    return names
+
+
+def load_frame(level, metrics=()):
+    """The level's dispensing panel with the requested extra metric columns merged in (NaN where absent)."""
+    spec = PANELS[level]
+    df = pd.read_csv(os.path.join(PROC, spec["rates"]))
+    extra = [m for m in dict.fromkeys(metrics) if m != DEFAULT_METRIC]
+    if not extra:
+        return df
+    known = available_metrics(level)
+    missing = [m for m in extra if m not in known]
+    if missing:
+        raise SystemExit(f"metric(s) {missing} not in {metrics_path(level)}; available: {known}")
+    keys = [spec["unit"]] + period_columns(df)
+    values = pd.read_csv(metrics_path(level), usecols=lambda c: c in set(keys) | set(extra))
+    values = values.drop_duplicates(keys, keep="last")
+    # scatter the metrics onto a dense array and gather them back per row instead of a keyed merge
+    taken = np.full((len(df), len(extra)), np.nan)
+    if len(values):
+        taken = MetricPanel.from_frame(values, spec["unit"], extra, infer_granularity(df)).take(df, spec["unit"])
+    return df.drop(columns=[m for m in extra if m in df.columns]).assign(**dict(zip(extra, taken.T)))
+
+
+class MetricPanel:
+    """A (units x periods x metrics) array over a contiguous period range; NaN where unobserved."""
+
+    def __init__(self, units, periods, metrics, values, granularity="year"):
+        self.units = np.asarray(units)
+        self.periods = np.asarray(periods)
+        self.metrics = list(metrics)
+        self.values = values
+        self.granularity = granularity
+
+    @classmethod
+    def from_frame(cls, df, unit_col, metrics, granularity=None, units=None, periods=None):
+        """Scatter every metric column into the array at once (one index computation for all metrics)."""
+        granularity = granularity or infer_granularity(df)
+        ordinals = period_ordinal(df, granularity)
+        if units is None:
+            units = np.sort(df[unit_col].dropna().unique())
+        if periods is None:
+            periods = np.arange(ordinals.min(), ordinals.max() + 1)
+        units, periods = np.asarray(units), np.asarray(periods)
+
+        rows = unit_indexer(units).get_indexer(df[unit_col])
+        cols = ordinals - periods[0]
+        keep = (rows >= 0) & (cols >= 0) & (cols < len(periods))
+        values = np.full((len(units), len(periods), len(metrics)), np.nan)
+        values[rows[keep], cols[keep]] = df[list(metrics)].to_numpy(dtype=float)[keep]
+        return cls(units, periods, metrics, values, granularity)
+
+    @classmethod
+    def load(cls, level, metrics=(DEFAULT_METRIC,), df=None):
+        """
+        The level's panel for the requested metrics, on the dispensing panel's
+        units and periods (`df`: an already loaded `load_frame` result).
+        """
+        df = load_frame(level, metrics) if df is None else df
+        rates = df.dropna(subset=[DEFAULT_METRIC])
+        unit_col = PANELS[level]["unit"]
+        grid = DensePanel.from_frame(rates, unit_col)
+        return cls.from_frame(df, unit_col, list(dict.fromkeys(metrics)), units=grid.units, periods=grid.periods)
+
+    def index(self, metric):
+        if metric not in self.metrics:
+            raise KeyError(f"metric {metric!r} not in panel ({self.metrics})")
+        return self.metrics.index(metric)
+
+    def panel(self, metric):
+        """One metric as a DensePanel (a view, not a copy)."""
+        return DensePanel(self.units, self.periods, self.values[:, :, self.index(metric)], self.granularity)
+
+    def take(self, df, unit_col, array=None):
+        """Rows of a (units x periods x k) array (default the panel values) for each (unit, period) row of `df`."""
+        array = self.values if array is None else array
+        rows = unit_indexer(self.units).get_indexer(df[unit_col])
+        cols = period_ordinal(df, self.granularity) - self.periods[0]
+        ok = (rows >= 0) & (cols >= 0) & (cols < len(self.periods))
+        out = np.full((len(df), array.shape[2]), np.nan)
+        out[ok] = array[rows[ok], cols[ok]]
+        return out
+
+    def lagged(self, metrics=None, lags=(0, 1), fill=True):
+        """
+        (names, units x periods x len(lags) * len(metrics)) lagged copies of the
+        metrics, names "{metric}" for lag 0 and "{metric}_lag{k}" otherwise.
+
+        With `fill`, gaps are carried forward per unit, then filled with the
+        period's cross-unit mean (0 if nothing is observed), so the features can
+        go straight into linear models.
+        """
+        metrics = self.metrics if metrics is None else list(metrics)
+        V = self.values[:, :, [self.index(m) for m in metrics]]
+        if fill:
+            V = forward_fill(V)
+            counts = (~np.isnan(V)).sum(axis=0)
+            period_mean = np.nansum(V, axis=0) / np.maximum(counts, 1)
+            V = np.where(np.isnan(V), period_mean[None], V)
+        T = V.shape[1]
+        out = np.full(V.shape[:2] + (len(lags), len(metrics)), np.nan)
+        for j, k in enumerate(lags):
+            out[:, k:, j] = V[:, :T - k]
+            if fill and k > 0:
+                out[:, :k, j] = V[:, :1]
+        names = [m if k == 0 else f"{m}_lag{k}" for k in lags for m in metrics]
+        return names, out.reshape(V.shape[0], T, -1)
+
+
+def forward_fill(V):
+    """Carry the last observed value forward along axis 1 of a (units x periods [x metrics]) array."""
+    observed = ~np.isnan(V)
+    idx = np.where(observed, np.arange(V.shape[1]).reshape((1, -1) + (1,) * (V.ndim - 2)), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    # leading gaps point at column 0, which is itself unobserved, so they stay NaN
+    return np.take_along_axis(V, idx, axis=1)
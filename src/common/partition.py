@@ -0,0 +1,65 @@
+"""
+Partitioned frames: sort once, slice per state (and per year) without masking.
+
+`df[df["STATE_ABBREV"] == state]` inside a loop over states scans every row for
+every state, i.e. O(states x rows), and copies every column each time.
+`Partitioned` stable-sorts the frame once by its partition key (optionally by a
+second key within each partition) and keeps row offsets, so
+- part[state]            is a contiguous iloc slice (O(1) lookup)
+- part.get(state, year)  is found by searchsorted inside the state's block
+- part.groups()          iterates (key, slice) in first-appearance order
+
+Rows keep their original relative order within a partition unless a `within`
+key is given, so `.head(k)` on a slice matches the masked frame.
+"""
+
+import pandas as pd
+import numpy as np
+
+
+class Partitioned:
+    def __init__(self, df, key="STATE_ABBREV", within=None):
+        codes, uniques = pd.factorize(df[key])
+        if within is None:
+            order = np.argsort(codes, kind="stable")
+        else:
+            order = np.lexsort((df[within].to_numpy(), codes))
+        self.frame = df.iloc[order]
+        self.key = key
+        self.within = within
+        self._keys = list(uniques)
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        self._offsets = {k: (int(bounds[i]), int(bounds[i + 1])) for i, k in enumerate(uniques)}
+        self._within_values = None if within is None else self.frame[within].to_numpy()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def keys(self):
+        """Partition keys in order of first appearance (like `df[key].unique()`)."""
+        return list(self._keys)
+
+    def bounds(self, key, value=None):
+        """(start, stop) row offsets of a partition, or of `within == value` inside it."""
+        start, stop = self._offsets.get(key, (0, 0))
+        if value is None:
+            return start, stop
+        if self._within_values is None:
+            raise ValueError("no `within` key to slice by")
+        block = self._within_values[start:stop]
+        return start + int(np.searchsorted(block, value, "left")), start + int(np.searchsorted(block, value, "right"))
+
+    def get(self, key, value=None):
+        """Rows of one partition (empty frame for an unknown key)."""
+        start, stop = self.bounds(key, value)
+        return self.frame.iloc[start:stop]
+
+    def groups(self):
+        for key in self._keys:
+            yield key, self.get(key)
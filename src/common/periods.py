@@ -0,0 +1,247 @@
+"""
+Time-granularity helpers and dense period-indexed panels.
+
+Every panel row is keyed by an integer period ordinal so that "next period" is
+always +1, whatever the granularity:
+- year:    YEAR
+- quarter: YEAR * 4 + (QUARTER - 1)
+- month:   YEAR * 12 + (MONTH - 1)
+
+Annual panels keep plain YEAR values as their ordinals, so existing outputs are
+unchanged; quarterly / monthly panels only need an extra QUARTER or MONTH column.
+
+Panel rows are found by array indexing too: integer unit keys (county FIPS)
+go through a `UnitIndex` lookup table rather than a hash index.
+"""
+
+import pandas as pd
+import numpy as np
+
+PERIODS_PER_YEAR = {"year": 1, "quarter": 4, "month": 12}
+SUBPERIOD_COLUMNS = {"quarter": "QUARTER", "month": "MONTH"}
+# largest key span a UnitIndex table covers (five-digit FIPS need 100000)
+MAX_TABLE_SIZE = 1 << 20
+
+
+class UnitIndex:
+    """
+    `pd.Index.get_indexer` for non-negative integer unit keys by direct table
+    lookup: table[key] is the key's row (-1 if absent), so mapping every panel
+    row to its unit is one gather instead of a hash probe per row.
+    """
+
+    def __init__(self, units):
+        units = np.asarray(units, dtype=np.int64)
+        self.table = np.full(int(units.max()) + 1 if len(units) else 0, -1, dtype=np.int64)
+        self.table[units] = np.arange(len(units))
+
+    @classmethod
+    def from_table(cls, table):
+        """An index over an existing lookup table (e.g. a shared, read-only one) without copying it."""
+        index = cls.__new__(cls)
+        index.table = table
+        return index
+
+    def __len__(self):
+        return int((self.table >= 0).sum())
+
+    def get_indexer(self, keys):
+        keys = np.asarray(keys)
+        if keys.dtype.kind == "O" and pd.api.types.infer_dtype(keys) in ("integer", "integer-na", "floating",
+                                                                         "mixed-integer-float"):
+            keys = pd.to_numeric(pd.Series(keys), errors="coerce").to_numpy(dtype=float)
+        if keys.dtype.kind == "f":
+            whole = np.isfinite(keys) & (keys == np.round(keys))
+            keys = np.where(whole, keys, -1).astype(np.int64)
+        elif keys.dtype.kind not in "iu":
+            # strings / objects never equal an integer key, as with pd.Index
+            return np.full(len(keys), -1, dtype=np.int64)
+        out = np.full(len(keys), -1, dtype=np.int64)
+        ok = (keys >= 0) & (keys < len(self.table))
+        out[ok] = self.table[keys[ok]]
+        return out
+
+
+def unit_indexer(units):
+    """A UnitIndex for unique, non-negative integer units of modest range, else a pd.Index."""
+    units = np.asarray(units)
+    if (units.dtype.kind in "iu" and len(units) and units.min() >= 0 and units.max() < MAX_TABLE_SIZE
+            and len(np.unique(units)) == len(units)):
+        return UnitIndex(units)
+    return pd.Index(units)
+
+
+def infer_granularity(df):
+    """Finest granularity whose key column is present in the frame."""
+    if "MONTH" in df.columns:
+        return "month"
+    if "QUARTER" in df.columns:
+        return "quarter"
+    return "year"
+
+
+def period_columns(df, granularity=None):
+    """Key columns identifying a period: ["YEAR"] plus QUARTER / MONTH when sub-annual."""
+    granularity = granularity or infer_granularity(df)
+    if granularity == "year":
+        return ["YEAR"]
+    return ["YEAR", SUBPERIOD_COLUMNS[granularity]]
+
+
+def period_ordinal(df, granularity=None):
+    """Integer period ordinal for every row."""
+    granularity = granularity or infer_granularity(df)
+    year = df["YEAR"].to_numpy(dtype=int)
+    if granularity == "year":
+        return year
+    sub = df[SUBPERIOD_COLUMNS[granularity]].to_numpy(dtype=int)
+    return year * PERIODS_PER_YEAR[granularity] + (sub - 1)
+
+
+def period_year(ordinals, granularity):
+    return np.asarray(ordinals) // PERIODS_PER_YEAR[granularity]
+
+
+def period_label(ordinals, granularity):
+    """Human-readable periods: 2010, '2010Q1' or '2010-01'."""
+    ordinals = np.asarray(ordinals)
+    if granularity == "year":
+        return ordinals
+    year, sub = np.divmod(ordinals, PERIODS_PER_YEAR[granularity])
+    if granularity == "quarter":
+        return np.array([f"{y}Q{s + 1}" for y, s in zip(year, sub)])
+    return np.array([f"{y}-{s + 1:02d}" for y, s in zip(year, sub)])
+
+
+class DensePanel:
+    """
+    A (units x periods) value matrix over a contiguous period range.
+
+    Missing observations are NaN, so gaps never shift a unit's series the way a
+    row-wise groupby().shift() does.
+    """
+
+    def __init__(self, units, periods, values, granularity="year"):
+        self.units = np.asarray(units)
+        self.periods = np.asarray(periods)
+        self.values = values
+        self.granularity = granularity
+        self._unit_index = unit_indexer(self.units)
+
+    @classmethod
+    def from_frame(cls, df, unit_col, value_col="opioid_dispensing_rate", granularity=None, units=None, periods=None):
+        granularity = granularity or infer_granularity(df)
+        ordinals = period_ordinal(df, granularity)
+        if units is None:
+            units = np.sort(df[unit_col].dropna().unique())
+        if periods is None:
+            periods = np.arange(ordinals.min(), ordinals.max() + 1)
+        units = np.asarray(units)
+        periods = np.asarray(periods)
+
+        rows = unit_indexer(units).get_indexer(df[unit_col])
+        cols = ordinals - periods[0]
+        keep = (rows >= 0) & (cols >= 0) & (cols < len(periods))
+        values = np.full((len(units), len(periods)), np.nan)
+        values[rows[keep], cols[keep]] = df[value_col].to_numpy(dtype=float)[keep]
+        return cls(units, periods, values, granularity)
+
+    @property
+    def observed(self):
+        return ~np.isnan(self.values)
+
+    @property
+    def periods_per_year(self):
+        return PERIODS_PER_YEAR[self.granularity]
+
+    def labels(self, ordinals=None):
+        return period_label(self.periods if ordinals is None else ordinals, self.granularity)
+
+    def row_index(self, unit_keys):
+        return self._unit_index.get_indexer(unit_keys)
+
+    def lookup(self, unit_keys, ordinals, offset=0):
+        """Value at (unit, ordinal + offset) for each pair; NaN outside the panel."""
+        return self.lookup_rows(self.row_index(unit_keys), ordinals, offset)
+
+    def lookup_rows(self, rows, ordinals, offset=0):
+        """`lookup` for already resolved row positions (-1 for unknown units)."""
+        rows = np.asarray(rows)
+        cols = np.asarray(ordinals) + offset - self.periods[0]
+        ok = (rows >= 0) & (cols >= 0) & (cols < len(self.periods))
+        out = np.full(len(rows), np.nan)
+        out[ok] = self.values[rows[ok], cols[ok]]
+        return out
+
+    def take_rows(self, rows, periods):
+        """(len(rows) x len(periods)) values for row positions and period ordinals; NaN outside the panel."""
+        rows, periods = np.asarray(rows), np.asarray(periods)
+        cols = periods - self.periods[0]
+        ok_rows = rows >= 0
+        ok_cols = (cols >= 0) & (cols < len(self.periods))
+        out = np.full((len(rows), len(periods)), np.nan)
+        out[np.ix_(ok_rows, ok_cols)] = self.values[np.ix_(rows[ok_rows], cols[ok_cols])]
+        return out
+
+    def with_values(self, values):
+        return DensePanel(self.units, self.periods, values, self.granularity)
+
+    def to_frame(self, unit_col, value_col="opioid_dispensing_rate"):
+        rows, cols = np.nonzero(self.observed)
+        return pd.DataFrame({
+            unit_col: self.units[rows],
+            "PERIOD": self.labels(self.periods[cols]),
+            value_col: self.values[rows, cols],
+        })
+
+
+def next_period_values(df, unit_col, value_col="opioid_dispensing_rate", granularity=None):
+    """Each row's value one period later (NaN when that period is unobserved)."""
+    panel = DensePanel.from_frame(df, unit_col, value_col, granularity)
+    return panel.lookup(df[unit_col], period_ordinal(df, panel.granularity), offset=1)
+
+
+def first_true(mask):
+    """Column index of the first True per row, -1 when a row never is."""
+    hit = mask.any(axis=1)
+    return np.where(hit, mask.argmax(axis=1), -1)
+
+
+def transition_weights(high, observed, periods_per_year=1, allowed=None):
+    """
+    Decayed influence weights W[s, d] from every (t -> t+1) transition at once.
+
+    A source s is high in t, a target d goes low -> high between t and t+1, both
+    observed in t and t+1, and each event is weighted 1 / (1 + years since s first
+    went high). `allowed` optionally masks permissible (s, d) pairs.
+    """
+    decay, new = transition_terms(high, observed, periods_per_year)
+    W = decay @ new.T.astype(float)
+    np.fill_diagonal(W, 0.0)
+    if allowed is not None:
+        W = np.where(allowed, W, 0.0)
+    return W
+
+
+def transition_terms(high, observed, periods_per_year):
+    """Per-unit, per-transition source decay weights and target low -> high flags."""
+    both = observed[:, :-1] & observed[:, 1:]
+    cur = high[:, :-1] & both
+    new = high[:, 1:] & ~high[:, :-1] & both
+
+    adopt = first_true(high & observed)
+    steps = np.arange(high.shape[1] - 1)
+    elapsed = np.maximum(0, steps[None, :] - adopt[:, None]) / periods_per_year
+    decay = np.where(cur, 1.0 / (1.0 + elapsed), 0.0)
+    return decay, new
+
+
+def pair_transition_weights(high, observed, src, dst, periods_per_year=1):
+    """
+    `transition_weights` evaluated only for the candidate pairs (src[i], dst[i]),
+    so a sparse spatial mask costs O(pairs x periods) instead of O(n^2 x periods).
+    """
+    decay, new = transition_terms(high, observed, periods_per_year)
+    src, dst = np.asarray(src, dtype=int), np.asarray(dst, dtype=int)
+    weights = np.einsum("ij,ij->i", decay[src], new[dst].astype(float))
+    return np.where(src == dst, 0.0, weights)
@@ -0,0 +1,375 @@
+"""
+Shared panels for multi-process workers: publish once, attach zero-copy.
+
+A process pool that receives panels through its arguments pickles them to
+every worker, and one that re-reads the CSVs re-parses them per worker.
+Instead, the parent publishes the arrays once and hands workers a small
+picklable `Handle`; each worker maps the same memory read-only.
+
+- `SharedArrays` holds named numpy arrays (numeric, bool or fixed-width
+  string dtypes) plus a small dict of plain Python metadata. Backends:
+    shm   one multiprocessing.shared_memory segment, arrays packed at 64-byte
+          offsets (default)
+    mmap  a temporary directory of .npy files opened with mmap_mode="r", for
+          hosts with a small /dev/shm (e.g. Docker's 64 MB default) or
+          workers that are not children of the publisher
+- `SharedPanel` publishes one level's panel: the (units x periods) matrix of
+  a metric, the geographic adjacency as CSR arrays and the id dictionaries
+  (unit keys, period ordinals, and for counties the dense FIPS -> row lookup
+  table of common/crosswalk.py). Workers get a DensePanel, a csr_matrix and
+  `row_index` built on the shared buffers without copying.
+
+Lifecycle: the publisher owns the memory. Use it as a context manager (or
+call `close()`), which unlinks the segment / removes the directory; an atexit
+hook does the same if the publisher dies with it still open. Workers call
+`attach(handle)`, which maps a store at most once per process and closes it
+at exit. Segments and directories are named epi_<pid>_...; the resource
+tracker reclaims the segments of a killed publisher, and `python
+src/common/shared_panel.py cleanup` removes anything else it left behind
+(`list` shows them).
+
+    with SharedPanel.publish("county") as shared:
+        with ProcessPoolExecutor(initializer=init, initargs=(shared.handle,)) as pool:
+            ...
+
+    def init(handle):
+        global PANEL
+        PANEL = SharedPanel.attach(handle)
+"""
+
+import os
+import sys
+import glob
+import atexit
+import shutil
+import tempfile
+import itertools
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.periods import DensePanel, UnitIndex, unit_indexer
+
+PREFIX = "epi_"
+ALIGN = 64
+SHM_DIR = "/dev/shm"
+BACKENDS = ("shm", "mmap")
+
+_serial = itertools.count()
+_attached = {}
+
+
+@dataclass(frozen=True)
+class Handle:
+    """What a worker needs to attach: backend, segment name or directory, array layout and metadata."""
+    backend: str
+    location: str
+    layout: dict
+    meta: dict = field(default_factory=dict)
+
+
+def _padded(nbytes):
+    return -(-nbytes // ALIGN) * ALIGN
+
+
+def _check(name, array):
+    if array.dtype.hasobject:
+        raise TypeError(f"{name!r}: object arrays cannot be shared; use a numeric or fixed-width string dtype")
+
+
+class SharedArrays:
+    """Named read-only arrays in shared memory; see the module docstring for backends and lifecycle."""
+
+    def __init__(self, handle, arrays, owner=False, shm=None):
+        self.handle = handle
+        self.arrays = arrays
+        self.meta = handle.meta
+        self.owner = owner
+        self._shm = shm
+        self._pid = os.getpid()
+        self._closed = False
+        if owner:
+            atexit.register(self.close)
+
+    @classmethod
+    def publish(cls, arrays, meta=None, backend="shm"):
+        """Copy `arrays` ({name: array}) into shared memory once; the returned store owns it."""
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}; expected one of {BACKENDS}")
+        arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+        for name, a in arrays.items():
+            _check(name, a)
+        tag = f"{PREFIX}{os.getpid()}_{next(_serial)}_{os.urandom(3).hex()}"
+
+        if backend == "mmap":
+            location = tempfile.mkdtemp(prefix=tag + "_")
+            layout = {}
+            for i, (name, a) in enumerate(arrays.items()):
+                layout[name] = (f"{i}.npy", a.shape, a.dtype.str)
+                np.save(os.path.join(location, f"{i}.npy"), a)
+            handle = Handle(backend, location, layout, dict(meta or {}))
+            return cls(handle, _open_mmap(handle), owner=True)
+
+        layout, offset = {}, 0
+        for name, a in arrays.items():
+            layout[name] = (offset, a.shape, a.dtype.str)
+            offset += _padded(a.nbytes)
+        shm = shared_memory.SharedMemory(name=tag, create=True, size=max(offset, 1))
+        for name, a in arrays.items():
+            start = layout[name][0]
+            np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=start)[...] = a
+        handle = Handle(backend, shm.name, layout, dict(meta or {}))
+        return cls(handle, _views(shm, handle), owner=True, shm=shm)
+
+    @classmethod
+    def open(cls, handle):
+        """Map a published store in this process (read-only, zero-copy)."""
+        if handle.backend == "mmap":
+            return cls(handle, _open_mmap(handle))
+        shm = _attach_segment(handle.location)
+        return cls(handle, _views(shm, handle), shm=shm)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def nbytes(self):
+        return int(sum(a.nbytes for a in self.arrays.values()))
+
+    def close(self):
+        """Drop the mapping; the owner also unlinks the segment / removes the directory."""
+        if self._closed or os.getpid() != self._pid:
+            # forked children inherit the object but never own the memory
+            return
+        self._closed = True
+        self.arrays = {}
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # views are still referenced somewhere; the mapping goes with the process
+                pass
+            if self.owner:
+                try:
+                    self._shm.unlink()
+                except FileNotFoundError:
+                    pass
+        elif self.owner and self.handle.backend == "mmap":
+            shutil.rmtree(self.handle.location, ignore_errors=True)
+        if self.owner:
+            atexit.unregister(self.close)
+
+
+def _views(shm, handle):
+    views = {}
+    for name, (offset, shape, dtype) in handle.layout.items():
+        view = np.ndarray(tuple(shape), np.dtype(dtype), buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        views[name] = view
+    return views
+
+
+def _open_mmap(handle):
+    views = {}
+    for name, (file, shape, dtype) in handle.layout.items():
+        path = os.path.join(handle.location, file)
+        # np.load cannot memory-map empty arrays
+        views[name] = np.load(path, mmap_mode="r") if np.prod(shape) else np.load(path)
+    return views
+
+
+def _attach_segment(name):
+    try:
+        # Python 3.13+: attaching processes must not register the segment with their resource tracker
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # older Pythons register it; pool workers share the publisher's tracker, so that is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach(handle):
+    """The store behind `handle`, mapped at most once per process and closed at exit."""
+    key = (handle.backend, handle.location)
+    store = _attached.get(key)
+    if store is None or store._closed:
+        store = _attached[key] = SharedArrays.open(handle)
+    return store
+
+
+@atexit.register
+def _close_attached():
+    for store in list(_attached.values()):
+        store.close()
+    _attached.clear()
+
+
+class SharedPanel:
+    """
+    One level's panel, adjacency and unit ids on shared buffers.
+
+    Arrays: rates (units x periods, NaN = unobserved), periods, units,
+    adj_data / adj_indices / adj_indptr (CSR), and unit_table (integer keys
+    only: row per key, -1 if absent). `extra` arrays published alongside are
+    available under their own names.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.level = store.meta.get("level")
+        self.metric = store.meta.get("metric")
+        self.granularity = store.meta.get("granularity", "year")
+
+    @classmethod
+    def publish(cls, level, metric=None, backend="shm", extra=None):
+        from common import geography
+        from common.metric_panel import DEFAULT_METRIC, MetricPanel
+
+        metric = metric or DEFAULT_METRIC
+        dense = MetricPanel.load(level, [metric]).panel(metric)
+        geo = geography.states() if level == "state" else geography.counties()
+        return cls.from_dense(dense, geo.adjacency_for(dense.units), backend=backend, extra=extra,
+                              meta={"level": level, "metric": metric})
+
+    @classmethod
+    def from_dense(cls, dense, adjacency, backend="shm", extra=None, meta=None):
+        """Publish an in-memory DensePanel and its (units x units) adjacency."""
+        adjacency = sparse.csr_matrix(adjacency, dtype=float)
+        units = np.asarray(dense.units)
+        if units.dtype.hasobject:
+            units = units.astype(str)
+        arrays = {
+            "rates": np.asarray(dense.values, dtype=float),
+            "periods": np.asarray(dense.periods),
+            "units": units,
+            "adj_data": adjacency.data,
+            "adj_indices": adjacency.indices,
+            "adj_indptr": adjacency.indptr,
+        }
+        index = unit_indexer(units)
+        if isinstance(index, UnitIndex):
+            arrays["unit_table"] = index.table
+        arrays.update(extra or {})
+        meta = dict(meta or {}, granularity=dense.granularity)
+        return cls(SharedArrays.publish(arrays, meta, backend))
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(attach(handle))
+
+    @property
+    def handle(self):
+        return self.store.handle
+
+    def __getitem__(self, name):
+        return self.store[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.store.close()
+
+    @property
+    def units(self):
+        return self.store["units"]
+
+    @property
+    def periods(self):
+        return self.store["periods"]
+
+    @property
+    def rates(self):
+        return self.store["rates"]
+
+    @property
+    def panel(self):
+        """A DensePanel over the shared rate matrix (no copy)."""
+        return DensePanel(self.units, self.periods, self.rates, self.granularity)
+
+    @property
+    def adjacency(self):
+        """The CSR adjacency over the shared index / data buffers (no copy)."""
+        n = len(self.units)
+        return sparse.csr_matrix((self["adj_data"], self["adj_indices"], self["adj_indptr"]), shape=(n, n), copy=False)
+
+    def row_index(self, keys):
+        """Rows of unit keys (-1 for unknown units); a table gather for integer units."""
+        if "unit_table" in self.store:
+            return UnitIndex.from_table(self["unit_table"]).get_indexer(keys)
+        return unit_indexer(self.units).get_indexer(keys)
+
+
+def _owner_pid(path):
+    try:
+        return int(os.path.basename(path)[len(PREFIX):].split("_")[0])
+    except ValueError:
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def leftovers():
+    """(path, owner pid, alive) for every epi_ segment and mmap directory on this host."""
+    paths = glob.glob(os.path.join(SHM_DIR, PREFIX + "*")) + glob.glob(os.path.join(tempfile.gettempdir(), PREFIX + "*"))
+    return [(p, pid, pid is not None and _alive(pid)) for p in sorted(paths) for pid in [_owner_pid(p)]]
+
+
+def cleanup():
+    """Remove segments / directories whose publishing process no longer exists; returns their paths."""
+    removed = []
+    for path, pid, alive in leftovers():
+        if pid is None or alive:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["list", "cleanup"])
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        entries = leftovers()
+        for path, pid, alive in entries:
+            print(f"{path}  pid={pid}  {'running' if alive else 'stale'}")
+        if not entries:
+            print("No shared panels.")
+    else:
+        removed = cleanup()
+        print(f"Removed {len(removed)} stale shared panel(s).")
+        for path in removed:
+            print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,34 @@
+"""
+County influence edges within each state.
+
+Edge modes (--mode):
+- state:  every ordered pair of counties in the state (default)
+- radius: only pairs whose centroids are within --radius_km of each other
+- knn:    only sources among the target's --k nearest counties (nearest
+          counties across a state line are dropped, since networks are per state)
+
+The spatial modes draw candidate pairs from a KD-tree over the county centroids
+in data/reference/counties.csv and score only those pairs, instead of building
+the dense n x n weight matrix per state.
+
+--metric picks the panel metric whose transitions above its within-state 75th
+percentile define the edges (default the dispensing rate; see
+common/metric_panel.py). Other metrics write county_influence_edges_{metric}.csv.
+"""
+
 import os
+import sys
+import argparse
 import pandas as pd
 import numpy as np
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.partition import Partitioned
+from common.periods import DensePanel, transition_weights, pair_transition_weights
+from common import geography
+from common.instrument import instrumented, stage, current_stage
+from common.metric_panel import DEFAULT_METRIC, load_frame, edges_file
+
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 DATA = os.path.join(PROJECT_ROOT, "data")
@@ -9,65 +36,73 @@ PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 os.makedirs(OUT, exist_ok=True)
 
-def main():
-    print("Building Intra-State County Networks...")
+MODES = ("state", "radius", "knn")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build intra-state county influence edges")
+    parser.add_argument("--mode", choices=MODES, default="state", help="candidate source -> target pairs")
+    parser.add_argument("--radius_km", type=float, default=100.0, help="centroid distance cap for --mode radius")
+    parser.add_argument("--k", type=int, default=8, help="nearest counties per target for --mode knn")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, help="panel metric whose high transitions define edges")
+    return parser.parse_args(argv)
+
+
+def spatial_mask(mode, radius_km=100.0, k=8):
+    """National CSR mask M[s, d] of permissible source -> target county pairs."""
+    geo = geography.counties()
+    if len(geo.located) == 0:
+        raise SystemExit(f"--mode {mode} needs county centroids (LAT, LON) in {geography.COUNTIES_PATH}")
+    if mode == "radius":
+        return geo, geo.within_km(radius_km)
+    return geo, geo.nearest(k).T.tocsr()
+
+
+@instrumented("county.build_intra_state_networks")
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"Building Intra-State County Networks ({args.metric})...")
     
-    df = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+    df = load_frame("county", [args.metric])
     
     all_edges = []
     
-    states = df["STATE_ABBREV"].unique()
+    by_state = Partitioned(df, "STATE_ABBREV")
+    states = by_state.keys()
     print(f"Processing {len(states)} states individually...")
+
+    mask = None
+    if args.mode != "state":
+        geo, mask = spatial_mask(args.mode, args.radius_km, args.k)
+        print(f"Restricting edges to {args.mode} pairs ({mask.nnz} candidate pairs nationally)")
     
-    for state in states:
-        state_df = df[df["STATE_ABBREV"] == state].copy()
-        
-        if state_df.empty:
-            continue
-            
-        local_threshold = state_df["opioid_dispensing_rate"].quantile(0.75)
-        
-        state_df["is_high"] = (state_df["opioid_dispensing_rate"] > local_threshold).astype(int)
+    with stage("county.intra_state_edges", states=len(states)) as rec:
+        for state, state_df in by_state.groups():
+            local_threshold = state_df[args.metric].quantile(0.75)
         
-        local_adoption = state_df[state_df["is_high"] == 1].groupby("FIPS")["YEAR"].min().to_dict()
+            dense = DensePanel.from_frame(state_df, "FIPS", args.metric)
+            observed = dense.observed
+            high = observed & (np.nan_to_num(dense.values) > local_threshold)
         
-        years = sorted(state_df["YEAR"].unique())
-        
-        edge_counts = {}
-        
-        for t in years[:-1]:
-            cur_data = state_df[state_df["YEAR"] == t].set_index("FIPS")["is_high"]
-            nxt_data = state_df[state_df["YEAR"] == t+1].set_index("FIPS")["is_high"]
-            
-            common = cur_data.index.intersection(nxt_data.index)
-            cur = cur_data.loc[common]
-            nxt = nxt_data.loc[common]
-            
-            sources = cur[cur == 1].index.tolist()
-            targets = nxt[(nxt == 1) & (cur == 0)].index.tolist()
-            
-            if not sources or not targets:
-                continue
-                
-            for s in sources:
-                for d in targets:
-                    if s == d: continue
-                    
-                    s_adopt = local_adoption.get(s, t)
-                    time_diff = max(0, t - s_adopt)
-                    weight = 1.0 / (1.0 + time_diff)
-                    
-                    edge_counts[(s, d)] = edge_counts.get((s, d), 0.0) + weight
+            if mask is None:
+                W = transition_weights(high, observed, dense.periods_per_year)
+                src_idx, dst_idx = np.nonzero(W)
+                weights = W[src_idx, dst_idx]
+            else:
+                src_idx, dst_idx = geo.reindex(mask, dense.units).nonzero()
+                weights = pair_transition_weights(high, observed, src_idx, dst_idx, dense.periods_per_year)
+                keep = weights != 0
+                src_idx, dst_idx, weights = src_idx[keep], dst_idx[keep], weights[keep]
         
-        for (s, d), w in edge_counts.items():
-            all_edges.append({
+            all_edges.append(pd.DataFrame({
                 "STATE_ABBREV": state,
-                "source_fips": s,
-                "target_fips": d,
-                "weight": w
-            })
+                "source_fips": dense.units[src_idx],
+                "target_fips": dense.units[dst_idx],
+                "weight": weights
+            }))
             
-    edges_df = pd.DataFrame(all_edges)
+        edges_df = pd.concat(all_edges, ignore_index=True)
+        rec.count(edges=len(edges_df))
     
     fips_map = df[["FIPS", "COUNTY_NAME"]].drop_duplicates().set_index("FIPS")["COUNTY_NAME"].to_dict()
     edges_df["source_name"] = edges_df["source_fips"].map(fips_map)
@@ -75,8 +110,9 @@ def main():
     
     edges_df = edges_df.sort_values(["STATE_ABBREV", "weight"], ascending=[True, False])
     
-    out_path = os.path.join(OUT, "county_influence_edges.csv")
+    out_path = os.path.join(OUT, edges_file("county", args.metric))
     edges_df.to_csv(out_path, index=False)
+    current_stage().count(rows=len(df), edges=len(edges_df), candidates=mask.nnz if mask is not None else 0)
     print(f"Saved {len(edges_df)} edges to {out_path}")
 
 if __name__ == "__main__":
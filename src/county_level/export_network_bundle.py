@@ -0,0 +1,194 @@
+"""
+Export the county influence networks as a compact JSON bundle for the
+interactive viewer (docs/network.html), replacing one matplotlib PNG per state.
+The bundle in docs/network/ is committed with the viewer; this stage is not
+part of the default pipeline, rerun it to refresh the bundle.
+
+Level of detail: within each state, every edge gets a level
+- 0: the strongest outgoing edge of its source, or weight >= the --lod_quantiles[0]
+     quantile of the state's weights
+- 1: among the --top_k strongest edges of either endpoint, or weight >= the
+     --lod_quantiles[1] quantile
+- 2: every other edge (dropped unless --keep_all)
+so the viewer can draw level 0 at national scale and add detail on demand.
+Positions are county centroids when data/reference/counties.csv is bundled,
+otherwise a spiral around the state's map position with the strongest
+influencers innermost (common/geography.py).
+
+Files are columnar (one array per field, floats rounded) and split per state,
+so the viewer fetches the national overview once and a state only when opened.
+
+Outputs (docs/network/ by default):
+- index.json:          states with counts, bounding boxes and file names
+- national.json:       every county node plus level-0 edges (high_year is NEVER,
+                       from index.json "never", for counties never high)
+- states/{STATE}.json: a state's nodes and all kept edges with their level
+"""
+
+import os
+import sys
+import json
+import argparse
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+from common.partition import Partitioned
+from common import geography
+from common.metric_panel import NEVER, THRESHOLD
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+BUNDLE_DIR = os.path.join(PROJECT_ROOT, "docs", "network")
+
+
+def edge_levels(edges, top_k=5, quantiles=(0.9, 0.5)):
+    """Level-of-detail (0, 1, 2) for every edge, ranked within its state."""
+    state = edges["STATE_ABBREV"]
+    weight = edges["weight"]
+    out_rank = edges.assign(w=-weight).sort_values(["source_fips", "w"], kind="stable") \
+        .groupby("source_fips").cumcount().reindex(edges.index).to_numpy()
+    in_rank = edges.assign(w=-weight).sort_values(["target_fips", "w"], kind="stable") \
+        .groupby("target_fips").cumcount().reindex(edges.index).to_numpy()
+    strong = weight.to_numpy() >= weight.groupby(state).transform("quantile", quantiles[0]).to_numpy()
+    medium = weight.to_numpy() >= weight.groupby(state).transform("quantile", quantiles[1]).to_numpy()
+
+    level = np.full(len(edges), 2, dtype=np.int8)
+    level[(np.minimum(out_rank, in_rank) < top_k) | medium] = 1
+    level[(out_rank == 0) | strong] = 0
+    return level
+
+
+def load_nodes(rankings, edges):
+    """One row per county in the rankings or the edges, with name, state, score, rank and first high year."""
+    endpoints = pd.concat([
+        edges[["source_fips", "source_name", "STATE_ABBREV"]].set_axis(["FIPS", "COUNTY_NAME", "STATE_ABBREV"], axis=1),
+        edges[["target_fips", "target_name", "STATE_ABBREV"]].set_axis(["FIPS", "COUNTY_NAME", "STATE_ABBREV"], axis=1),
+    ])
+    nodes = pd.concat([rankings[["FIPS", "COUNTY_NAME", "STATE_ABBREV", "influence_score"]], endpoints]) \
+        .drop_duplicates("FIPS", keep="first")
+    nodes["influence_score"] = nodes["influence_score"].fillna(0.0)
+    nodes = nodes.sort_values(["STATE_ABBREV", "influence_score", "FIPS"], ascending=[True, False, True],
+                              kind="stable").reset_index(drop=True)
+    nodes["rank"] = nodes.groupby("STATE_ABBREV").cumcount() + 1
+
+    panel = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+    high = panel[panel["opioid_dispensing_rate"] > THRESHOLD].groupby("FIPS")["YEAR"].min()
+    nodes["high_year"] = high.reindex(nodes["FIPS"]).fillna(NEVER).astype(int).to_numpy()
+
+    xy = geography.county_layout(nodes["FIPS"].to_numpy(), nodes["STATE_ABBREV"].to_numpy(),
+                                 priority=nodes["influence_score"].to_numpy())
+    nodes["x"], nodes["y"] = xy[:, 0], xy[:, 1]
+    return nodes
+
+
+def columns(frame, fields, digits=4):
+    """{field: list} with floats rounded and missing values as null, the bundle's columnar layout."""
+    out = {}
+    for field in fields:
+        values = frame[field]
+        if values.dtype.kind == "f":
+            values = values.round(digits)
+        out[field] = values.astype(object).where(values.notna(), None).tolist()
+    return out
+
+
+def write_json(path, payload):
+    with open(path, "w") as f:
+        json.dump(payload, f, separators=(",", ":"), allow_nan=False)
+    return os.path.getsize(path)
+
+
+def export(edges, nodes, out_dir, top_k=5, quantiles=(0.9, 0.5), keep_all=False):
+    os.makedirs(os.path.join(out_dir, "states"), exist_ok=True)
+    edges = edges.assign(level=edge_levels(edges, top_k, quantiles))
+    if not keep_all:
+        edges = edges[edges["level"] < 2]
+
+    # edges refer to nodes by position in the (national or state) node arrays
+    node_index = pd.Index(nodes["FIPS"])
+    edges = edges.assign(s=node_index.get_indexer(edges["source_fips"]), t=node_index.get_indexer(edges["target_fips"]))
+    node_fields = ["FIPS", "COUNTY_NAME", "x", "y", "influence_score", "rank", "high_year"]
+
+    total = 0
+    states = []
+    nodes_by_state = Partitioned(nodes, "STATE_ABBREV")
+    edges_by_state = Partitioned(edges, "STATE_ABBREV")
+    for state in nodes_by_state.keys():
+        state_nodes = nodes_by_state[state]
+        state_edges = edges_by_state[state]
+        start = nodes_by_state.bounds(state)[0]
+        local = state_edges.assign(s=state_edges["s"] - start, t=state_edges["t"] - start)
+        local = local[local["s"].between(0, len(state_nodes) - 1) & local["t"].between(0, len(state_nodes) - 1)]
+        file = f"states/{state}.json"
+        total += write_json(os.path.join(out_dir, file), {
+            "state": state,
+            "nodes": columns(state_nodes, node_fields),
+            "edges": columns(local, ["s", "t", "weight", "level"]),
+        })
+        states.append({
+            "state": state,
+            "file": file,
+            "offset": start,
+            "counties": len(state_nodes),
+            "edges": len(state_edges),
+            "top": state_nodes["COUNTY_NAME"].iloc[0] if len(state_nodes) else None,
+            "bbox": [round(float(v), 4) for v in (state_nodes["x"].min(), state_nodes["y"].min(),
+                                                  state_nodes["x"].max(), state_nodes["y"].max())],
+        })
+
+    overview = edges[edges["level"] == 0]
+    total += write_json(os.path.join(out_dir, "national.json"), {
+        "nodes": columns(nodes, ["STATE_ABBREV", "x", "y", "influence_score", "high_year"]),
+        "edges": columns(overview, ["s", "t", "weight"]),
+    })
+    total += write_json(os.path.join(out_dir, "index.json"), {
+        "threshold": THRESHOLD,
+        "never": NEVER,
+        "positions": "centroid" if geography.counties().source.startswith("reference") else "schematic",
+        "top_k": top_k,
+        "lod_quantiles": list(quantiles),
+        "levels": sorted(edges["level"].unique().tolist()),
+        "states": states,
+    })
+    return states, len(edges), len(overview), total
+
+
+@instrumented("county.export_network_bundle")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=BUNDLE_DIR, help="bundle directory (default docs/network/)")
+    parser.add_argument("--top_k", type=int, default=5, help="edges kept per node at level 1")
+    parser.add_argument("--lod_quantiles", default="0.9,0.5",
+                        help="within-state weight quantiles for levels 0 and 1")
+    parser.add_argument("--keep_all", action="store_true", help="also export level-2 edges")
+    args = parser.parse_args(argv)
+
+    edges_path = os.path.join(OUT, "county_influence_edges.csv")
+    ranks_path = os.path.join(OUT, "county_influence_rankings.csv")
+    if not os.path.exists(edges_path) or not os.path.exists(ranks_path):
+        raise SystemExit("Missing county_influence_edges.csv / county_influence_rankings.csv; "
+                         "run build_intra_state_networks.py and rank_county_influencers.py first.")
+    quantiles = tuple(float(q) for q in args.lod_quantiles.split(","))
+
+    with stage("county.bundle_load") as rec:
+        edges = pd.read_csv(edges_path)
+        nodes = load_nodes(pd.read_csv(ranks_path), edges)
+        rec.count(nodes=len(nodes), edges=len(edges))
+
+    with stage("county.bundle_export") as rec:
+        states, kept, overview, size = export(edges, nodes, args.out, args.top_k, quantiles, args.keep_all)
+        rec.count(states=len(states), edges=kept, bytes=size)
+
+    print(f"Exported {len(nodes)} counties in {len(states)} states: {kept} of {len(edges)} edges kept "
+          f"({overview} in the national overview), {size / 1e6:.2f} MB")
+    print(f"Bundle written to {args.out}; open docs/network.html through a local web server, e.g.")
+    print("  python -m http.server --directory docs 8000")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
 import os
+import sys
 import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, current_stage
+from common import geography
+from common.metric_panel import THRESHOLD
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -8,6 +15,7 @@ PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 os.makedirs(OUT, exist_ok=True)
 
+@instrumented("county.find_superspreaders")
 def main():
     county_path = os.path.join(PROC, "dispensing_county_year.csv")
     state_adopt_path = os.path.join(PROC, "adoption_year.csv")
@@ -18,15 +26,15 @@ def main():
     df_county = pd.read_csv(county_path)
     df_state_adopt = pd.read_csv(state_adopt_path)
 
-    THRESHOLD = 87.35
-
     high_counties = df_county[df_county["opioid_dispensing_rate"] > THRESHOLD].copy()
     
     county_adopt = high_counties.groupby(["FIPS", "COUNTY_NAME", "STATE_ABBREV"], as_index=False)["YEAR"].min()
     county_adopt = county_adopt.rename(columns={"YEAR": "county_adoption_year"})
 
-    merged = county_adopt.merge(df_state_adopt[["STATE_ABBREV", "adoption_year"]], on="STATE_ABBREV", how="left")
-    merged = merged.rename(columns={"adoption_year": "state_adoption_year"})
+    # each county's state row from its FIPS prefix, an array gather instead of a merge on STATE_ABBREV
+    rows = geography.state_rows(county_adopt["FIPS"], df_state_adopt["STATE_ABBREV"])
+    adoption = np.append(df_state_adopt["adoption_year"].to_numpy(dtype=float), np.nan)
+    merged = county_adopt.assign(state_adoption_year=adoption[rows])
 
     superspreaders = merged[merged["county_adoption_year"] < merged["state_adoption_year"]].copy()
     superspreaders["years_early"] = superspreaders["state_adoption_year"] - superspreaders["county_adoption_year"]
@@ -35,6 +43,7 @@ def main():
 
     out_path = os.path.join(OUT, "county_superspreaders.csv")
     superspreaders.to_csv(out_path, index=False)
+    current_stage().count(rows=len(df_county), superspreaders=len(superspreaders))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Lead-lag detection of counties against their state and neighbouring counties.
+
+Generalises find_superspreaders.py (first year above 87.35 vs the state's
+adoption year) to the full rate trajectories: for every county the
+cross-correlation of year-over-year rate changes with a reference series is
+computed at lags -max_lag..max_lag, and the lag with the strongest correlation
+is its lead time (positive = the county moves first).
+
+References:
+- state: the state's own dispensing rate
+- peers: the mean of the county's geographic neighbours (row-normalised
+         county adjacency from common/geography.py, across state lines)
+
+Three interchangeable engines produce the same correlations:
+- direct: NaN-aware Pearson over the overlapping periods, all counties per lag at once
+- fft:    the same overlap sums as FFT cross-correlations of the masked series
+          (all lags in one batch of FFTs, for long monthly panels)
+- stream: running sufficient statistics updated one period at a time, so a newly
+          appended year costs O(counties x lags) instead of a full recompute
+
+Outputs:
+- outputs/county_lead_lag.csv
+"""
+
+import os
+import sys
+import argparse
+import warnings
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.periods import DensePanel
+from common import geography
+from common.instrument import instrumented, stage
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+MAX_LAG = 3
+MIN_OVERLAP = 5
+
+
+def _pearson_from_sums(n, sx, sy, sxx, syy, sxy, min_overlap):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        corr = cov / np.sqrt(var_x * var_y)
+    return np.where((n >= min_overlap) & (var_x > 0) & (var_y > 0), corr, np.nan)
+
+
+def _pair_sums(x, y):
+    """Sufficient statistics over the pairs where both values are observed (summed on the last axis)."""
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    x = np.where(mask, x, 0.0)
+    y = np.where(mask, y, 0.0)
+    return (mask.sum(axis=-1), x.sum(axis=-1), y.sum(axis=-1),
+            (x * x).sum(axis=-1), (y * y).sum(axis=-1), (x * y).sum(axis=-1))
+
+
+def lagged_corr(X, Y, max_lag=MAX_LAG, min_overlap=MIN_OVERLAP):
+    """
+    corr(X[:, t], Y[:, t + k]) per row for k = -max_lag..max_lag.
+
+    Positive k means X leads Y by k periods. Returns (lags, corr[units, lags]).
+    """
+    T = X.shape[1]
+    lags = np.arange(-max_lag, max_lag + 1)
+    corr = np.full((X.shape[0], len(lags)), np.nan)
+    for j, k in enumerate(lags):
+        if k >= 0:
+            x, y = X[:, :T - k], Y[:, k:]
+        else:
+            x, y = X[:, -k:], Y[:, :T + k]
+        corr[:, j] = _pearson_from_sums(*_pair_sums(x, y), min_overlap)
+    return lags, corr
+
+
+def lagged_corr_fft(X, Y, max_lag=MAX_LAG, min_overlap=MIN_OVERLAP):
+    """
+    The same correlations as `lagged_corr`, from FFT cross-correlations.
+
+    Every per-lag overlap sum (n, sum x, sum y, sum x^2, sum y^2, sum xy over
+    the pairs observed in both series) is a cross-correlation of a masked
+    series with a mask or another masked series, so all lags cost one batch
+    of FFTs. Rows are centred first, which leaves the correlations unchanged
+    and keeps the sums small.
+    """
+    T = X.shape[1]
+    mx, my = ~np.isnan(X), ~np.isnan(Y)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        x = np.where(mx, X - np.nan_to_num(np.nanmean(X, axis=1, keepdims=True)), 0.0)
+        y = np.where(my, Y - np.nan_to_num(np.nanmean(Y, axis=1, keepdims=True)), 0.0)
+
+    n_fft = 1 << int(np.ceil(np.log2(2 * T)))
+    fx = np.fft.rfft(np.stack([mx.astype(float), x, x * x]), n_fft)
+    fy = np.fft.rfft(np.stack([my.astype(float), y, y * y]), n_fft)
+    # sum_t a[t] b[t + k] for (a, b) = (mx, my), (x, my), (mx, y), (x^2, my), (mx, y^2), (x, y)
+    pairs = [(0, 0), (1, 0), (0, 1), (2, 0), (0, 2), (1, 1)]
+    cross = np.fft.irfft(np.stack([np.conj(fx[a]) * fy[b] for a, b in pairs]), n_fft)
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    n, sx, sy, sxx, syy, sxy = cross[:, :, lags % n_fft]
+    return lags, _pearson_from_sums(np.rint(n), sx, sy, sxx, syy, sxy, min_overlap)
+
+
+def init_stream(n_units, max_lag=MAX_LAG):
+    """Empty streaming state: last max_lag + 1 values per unit plus running sums per lag."""
+    n_lags = 2 * max_lag + 1
+    return {
+        "max_lag": max_lag,
+        "lags": np.arange(-max_lag, max_lag + 1),
+        "x_hist": np.full((n_units, max_lag + 1), np.nan),
+        "y_hist": np.full((n_units, max_lag + 1), np.nan),
+        "sums": [np.zeros((n_units, n_lags)) for _ in range(6)],
+        "periods": 0,
+    }
+
+
+def append_period(stream, x, y):
+    """
+    Fold one new period (x_t, y_t for every unit) into the running statistics.
+
+    For lag k >= 0 the new pair is (x_{t-k}, y_t); for k < 0 it is (x_t, y_{t+k}).
+    """
+    for key, v in (("x_hist", x), ("y_hist", y)):
+        hist = stream[key]
+        hist[:, 1:] = hist[:, :-1]
+        hist[:, 0] = v
+
+    lags = stream["lags"]
+    x_col = np.where(lags >= 0, lags, 0)
+    y_col = np.where(lags >= 0, 0, -lags)
+    xv = stream["x_hist"][:, x_col]
+    yv = stream["y_hist"][:, y_col]
+
+    mask = ~np.isnan(xv) & ~np.isnan(yv)
+    xv = np.where(mask, xv, 0.0)
+    yv = np.where(mask, yv, 0.0)
+    for total, inc in zip(stream["sums"], (mask, xv, yv, xv * xv, yv * yv, xv * yv)):
+        total += inc
+    stream["periods"] += 1
+    return stream
+
+
+def stream_corr(stream, min_overlap=MIN_OVERLAP):
+    return stream["lags"], _pearson_from_sums(*stream["sums"], min_overlap)
+
+
+def lagged_corr_stream(X, Y, max_lag=MAX_LAG, min_overlap=MIN_OVERLAP):
+    stream = init_stream(X.shape[0], max_lag)
+    for t in range(X.shape[1]):
+        append_period(stream, X[:, t], Y[:, t])
+    return stream_corr(stream, min_overlap)
+
+
+ENGINES = {"direct": lagged_corr, "fft": lagged_corr_fft, "stream": lagged_corr_stream}
+
+
+def summarize_lead(lags, corr, prefix):
+    """Best lag, correlation there, and a lead score that is only positive when the county leads."""
+    filled = np.where(np.isnan(corr), -np.inf, corr)
+    best = filled.argmax(axis=1)
+    has_any = np.isfinite(filled.max(axis=1))
+    best_lag = np.where(has_any, lags[best], np.nan)
+    best_corr = np.where(has_any, corr[np.arange(len(corr)), best], np.nan)
+    zero = corr[:, np.searchsorted(lags, 0)]
+    return pd.DataFrame({
+        f"{prefix}_lead_years": best_lag,
+        f"{prefix}_corr": best_corr,
+        f"{prefix}_corr_lag0": zero,
+        f"{prefix}_lead_score": np.where(best_lag > 0, best_corr, 0.0),
+    })
+
+
+def build_series(df_county, df_state):
+    """Dense (county x period) matrices for the county, its state and its neighbouring counties."""
+    county = DensePanel.from_frame(df_county, "FIPS")
+    years = county.periods
+    meta = (df_county.drop_duplicates("FIPS", keep="last")
+            .set_index("FIPS")[["COUNTY_NAME", "STATE_ABBREV"]].reindex(county.units))
+    meta.index.name = "FIPS"
+
+    state = DensePanel.from_frame(df_state, "STATE_ABBREV", periods=years)
+    rows = state.row_index(meta["STATE_ABBREV"])
+    S = np.where((rows >= 0)[:, None], state.values[rows], np.nan)
+
+    # row-normalised neighbour average, renormalised over the neighbours observed in each period
+    C = county.values
+    valid = ~np.isnan(C)
+    A = geography.counties().adjacency_for(county.units)
+    degree = np.asarray(A.sum(axis=1)).ravel()
+    W = sparse.diags(1.0 / np.where(degree > 0, degree, 1.0)) @ A
+    total = W @ np.where(valid, C, 0.0)
+    mass = W @ valid.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        P = np.where(mass > 0, total / mass, np.nan)
+    return meta, years, C, S, P
+
+
+@instrumented("county.lead_lag")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max_lag", type=int, default=MAX_LAG)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="direct")
+    parser.add_argument("--levels", action="store_true", help="correlate rate levels instead of year-over-year changes")
+    args = parser.parse_args(argv)
+
+    county_path = os.path.join(PROC, "dispensing_county_year.csv")
+    state_path = os.path.join(PROC, "dispensing_state_year.csv")
+    if not os.path.exists(county_path) or not os.path.exists(state_path):
+        print("Missing data files.")
+        return
+
+    print("Loading county and state panels...")
+    meta, years, C, S, P = build_series(pd.read_csv(county_path), pd.read_csv(state_path))
+    if not args.levels:
+        C, S, P = np.diff(C, axis=1), np.diff(S, axis=1), np.diff(P, axis=1)
+
+    engine = ENGINES[args.engine]
+    print(f"Computing lead-lag ({args.engine}) for {len(meta)} counties x {C.shape[1]} periods, lags +/-{args.max_lag}...")
+    with stage(f"county.lead_lag_{args.engine}", counties=len(meta), periods=C.shape[1]):
+        lags, corr_state = engine(C, S, args.max_lag)
+        _, corr_peer = engine(C, P, args.max_lag)
+
+    result = pd.concat([
+        meta.reset_index(),
+        summarize_lead(lags, corr_state, "state"),
+        summarize_lead(lags, corr_peer, "peer"),
+    ], axis=1)
+    result["lead_score"] = result[["state_lead_score", "peer_lead_score"]].mean(axis=1)
+    result = result.sort_values(["lead_score", "state_lead_years"], ascending=[False, False])
+
+    out_path = os.path.join(OUT, "county_lead_lag.csv")
+    result.to_csv(out_path, index=False)
+
+    print("-" * 50)
+    print(f"Counties leading their state: {(result['state_lead_years'] > 0).sum()}")
+    print(f"Counties leading their peers: {(result['peer_lead_years'] > 0).sum()}")
+    print("\nTop 10 leading counties:")
+    print(result.head(10)[["FIPS", "COUNTY_NAME", "STATE_ABBREV", "state_lead_years", "state_corr",
+                           "peer_lead_years", "peer_corr", "lead_score"]].to_string(index=False))
+    print("-" * 50)
+    print(f"Saved lead-lag rankings to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
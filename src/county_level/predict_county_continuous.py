@@ -1,9 +1,14 @@
 import os
-import pandas as pd
+import sys
+import argparse
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import geography
+from common.periods import DensePanel, next_period_values, period_columns, period_ordinal
+from common.instrument import instrumented, stage
+from common.manifest import derive_seed
+from common.metric_panel import DEFAULT_METRIC, MetricPanel, available_metrics, load_frame, suffix
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -11,7 +16,19 @@ DATA = os.path.join(PROJECT_ROOT, "data")
 PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 
-def main():
+@instrumented("county.predict_county_continuous")
+def main(argv=None):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-plots", dest="plots", action="store_false")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, help="panel metric to forecast")
+    parser.add_argument("--covariates", default="", help="comma-separated other metrics used as predictors at t")
+    args = parser.parse_args(argv)
+    metric = args.metric
+    covariates = [c.strip() for c in args.covariates.split(",") if c.strip() and c.strip() != metric]
+
     print("Loading Data...")
     county_path = os.path.join(PROC, "dispensing_county_year.csv")
     state_path = os.path.join(PROC, "dispensing_state_year.csv")
@@ -20,22 +37,29 @@ def main():
         print("Missing data files.")
         return
 
-    df_county = pd.read_csv(county_path)
-    df_state = pd.read_csv(state_path)
-    
-    df_state = df_state[["YEAR", "STATE_ABBREV", "opioid_dispensing_rate"]].rename(
-        columns={"opioid_dispensing_rate": "state_rate"}
-    )
-    
-    df = df_county.merge(df_state, on=["YEAR", "STATE_ABBREV"], how="left")
+    df_county = load_frame("county", [metric] + covariates)
+    keys = period_columns(df_county) + ["STATE_ABBREV"]
+    if metric in available_metrics("state"):
+        df_state = load_frame("state", [metric])
+    else:
+        # county-only metric: the state value is the mean over its counties
+        df_state = df_county.groupby(keys, as_index=False)[metric].mean()
+
+    state = DensePanel.from_frame(df_state, "STATE_ABBREV", metric)
+    rows = geography.state_rows(df_county["FIPS"], state.units)
+    df = df_county.assign(state_rate=state.lookup_rows(rows, period_ordinal(df_county, state.granularity)))
     
-    df = df.sort_values(["FIPS", "YEAR"])
+    df = df.sort_values(["FIPS"] + period_columns(df))
     
-    df["target_next_year"] = df.groupby("FIPS")["opioid_dispensing_rate"].shift(-1)
+    df["target_next_year"] = next_period_values(df, "FIPS", metric)
     
-    df_model = df.dropna(subset=["target_next_year", "opioid_dispensing_rate", "state_rate"])
+    df_model = df.dropna(subset=["target_next_year", metric, "state_rate"])
+    if covariates:
+        panel = MetricPanel.from_frame(df, "FIPS", covariates)
+        _, filled = panel.lagged(covariates, lags=(0,))
+        df_model = df_model.assign(**dict(zip(covariates, panel.take(df_model, "FIPS", filled).T)))
     
-    X = df_model[["opioid_dispensing_rate", "state_rate"]]
+    X = df_model[[metric, "state_rate"] + covariates]
     y = df_model["target_next_year"]
     
     train_mask = df_model["YEAR"] <= 2016
@@ -47,13 +71,16 @@ def main():
     print(f"Training Samples: {len(X_train)}")
     print(f"Testing Samples: {len(X_test)}")
     
-    model = LinearRegression()
-    model.fit(X_train, y_train)
+    with stage("county.predict_county_continuous.fit", rows=len(X_train)):
+        model = LinearRegression()
+        model.fit(X_train, y_train)
     
     print("\nModel Coefficients:")
     print(f"Intercept: {model.intercept_:.2f}")
     print(f"County Rate (t) Coeff: {model.coef_[0]:.3f}")
     print(f"State Rate (t) Coeff: {model.coef_[1]:.3f}")
+    for name, coef in zip(covariates, model.coef_[2:]):
+        print(f"{name} (t) Coeff: {coef:.3f}")
     
     y_pred = model.predict(X_test)
     r2 = r2_score(y_test, y_pred)
@@ -66,23 +93,29 @@ def main():
     results["predicted_rate"] = y_pred
     results["error"] = results["target_next_year"] - results["predicted_rate"]
     
-    res_path = os.path.join(OUT, "county_prediction_results.csv")
+    res_path = os.path.join(OUT, f"county_prediction_results{suffix(metric)}.csv")
     results.to_csv(res_path, index=False)
     print(f"Saved predictions to {res_path}")
     
-    plt.figure(figsize=(10, 6))
-    if len(y_test) > 5000:
-        indices = np.random.choice(len(y_test), 5000, replace=False)
-        plt.scatter(y_test.iloc[indices], y_pred[indices], alpha=0.1, s=10)
-    else:
-        plt.scatter(y_test, y_pred, alpha=0.1, s=10)
+    if not args.plots:
+        return
+
+    import matplotlib.pyplot as plt
+    with stage("county.predict_county_continuous.plot", points=len(y_test)):
+        plt.figure(figsize=(10, 6))
+        if len(y_test) > 5000:
+            rng = np.random.default_rng(derive_seed("county.predict_county_continuous.plot"))
+            indices = rng.choice(len(y_test), 5000, replace=False)
+            plt.scatter(y_test.iloc[indices], y_pred[indices], alpha=0.1, s=10)
+        else:
+            plt.scatter(y_test, y_pred, alpha=0.1, s=10)
         
-    plt.plot([0, y_test.max()], [0, y_test.max()], 'r--')
-    plt.xlabel("Actual Rate (t+1)")
-    plt.ylabel("Predicted Rate (t+1)")
-    plt.title(f"County Level Prediction (R2={r2:.2f})")
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUT, "county_prediction_scatter.png"))
+        plt.plot([0, y_test.max()], [0, y_test.max()], 'r--')
+        plt.xlabel("Actual Rate (t+1)")
+        plt.ylabel("Predicted Rate (t+1)")
+        plt.title(f"County Level Prediction (R2={r2:.2f})")
+        plt.tight_layout()
+        plt.savefig(os.path.join(OUT, f"county_prediction_scatter{suffix(metric)}.png"))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,13 @@
 import os
+import sys
+import argparse
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import geography
+from common.periods import DensePanel, next_period_values, period_columns, period_ordinal
+from common.instrument import instrumented, stage
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -11,7 +15,15 @@ DATA = os.path.join(PROJECT_ROOT, "data")
 PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 
-def main():
+@instrumented("county.predict_ga_county")
+def main(argv=None):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-plots", dest="plots", action="store_false")
+    args = parser.parse_args(argv)
+
     print("Loading Data for Georgia (GA) Prediction...")
     county_path = os.path.join(PROC, "dispensing_county_year.csv")
     state_path = os.path.join(PROC, "dispensing_state_year.csv")
@@ -32,14 +44,12 @@ def main():
 
     print(f"Processing {len(df_county)} records for Georgia counties...")
 
-    df_state = df_state[["YEAR", "STATE_ABBREV", "opioid_dispensing_rate"]].rename(
-        columns={"opioid_dispensing_rate": "state_rate"}
-    )
+    state = DensePanel.from_frame(df_state, "STATE_ABBREV")
+    df = df_county.assign(state_rate=state.lookup_rows(geography.state_rows(df_county["FIPS"], state.units),
+                                                       period_ordinal(df_county, state.granularity)))
     
-    df = df_county.merge(df_state, on=["YEAR", "STATE_ABBREV"], how="left")
-    
-    df = df.sort_values(["FIPS", "YEAR"])
-    df["target_next_year"] = df.groupby("FIPS")["opioid_dispensing_rate"].shift(-1)
+    df = df.sort_values(["FIPS"] + period_columns(df))
+    df["target_next_year"] = next_period_values(df, "FIPS")
     
     df_model = df.dropna(subset=["target_next_year", "opioid_dispensing_rate", "state_rate"])
     
@@ -55,8 +65,9 @@ def main():
     print(f"Training Samples: {len(X_train)}")
     print(f"Testing Samples: {len(X_test)}")
     
-    model = LinearRegression()
-    model.fit(X_train, y_train)
+    with stage("county.predict_ga_county.fit", rows=len(X_train)):
+        model = LinearRegression()
+        model.fit(X_train, y_train)
     
     print("\nModel Coefficients (GA Only):")
     print(f"Intercept: {model.intercept_:.2f}")
@@ -78,14 +89,19 @@ def main():
     results.to_csv(res_path, index=False)
     print(f"Saved GA predictions to {res_path}")
     
-    plt.figure(figsize=(10, 6))
-    plt.scatter(y_test, y_pred, alpha=0.5, color='purple')
-    plt.plot([0, y_test.max()], [0, y_test.max()], 'r--')
-    plt.xlabel("Actual Rate (t+1)")
-    plt.ylabel("Predicted Rate (t+1)")
-    plt.title(f"Georgia County Prediction (R2={r2:.2f})")
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUT, "ga_county_prediction_scatter.png"))
+    if not args.plots:
+        return
+
+    import matplotlib.pyplot as plt
+    with stage("county.predict_ga_county.plot", points=len(y_test)):
+        plt.figure(figsize=(10, 6))
+        plt.scatter(y_test, y_pred, alpha=0.5, color='purple')
+        plt.plot([0, y_test.max()], [0, y_test.max()], 'r--')
+        plt.xlabel("Actual Rate (t+1)")
+        plt.ylabel("Predicted Rate (t+1)")
+        plt.title(f"Georgia County Prediction (R2={r2:.2f})")
+        plt.tight_layout()
+        plt.savefig(os.path.join(OUT, "ga_county_prediction_scatter.png"))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,32 +1,45 @@
 import os
+import sys
+import argparse
 import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 
-def main():
+@instrumented("county.rank_county_influencers")
+def main(argv=None):
+    import networkx as nx
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-plots", dest="plots", action="store_false")
+    args = parser.parse_args(argv)
+
     edges_path = os.path.join(OUT, "county_influence_edges.csv")
     if not os.path.exists(edges_path):
         return
 
     df = pd.read_csv(edges_path)
     
-    G = nx.DiGraph()
-    for _, row in df.iterrows():
-        G.add_edge(row['source_fips'], row['target_fips'], weight=row['weight'])
+    with stage("county.rank_graph_build", edges=len(df)) as rec:
+        G = nx.DiGraph()
+        for _, row in df.iterrows():
+            G.add_edge(row['source_fips'], row['target_fips'], weight=row['weight'])
+        rec.count(nodes=G.number_of_nodes())
         
     out_degree = {}
     for node in G.nodes():
         weight_sum = sum(data['weight'] for _, _, data in G.out_edges(node, data=True))
         out_degree[node] = weight_sum
         
-    try:
-        eigen = nx.eigenvector_centrality(G, weight='weight', max_iter=1000)
-    except:
-        eigen = nx.eigenvector_centrality(G, max_iter=1000)
+    with stage("county.eigenvector_centrality", nodes=G.number_of_nodes(), edges=G.number_of_edges()):
+        try:
+            eigen = nx.eigenvector_centrality(G, weight='weight', max_iter=1000)
+        except:
+            eigen = nx.eigenvector_centrality(G, max_iter=1000)
         
     fips_meta = df[["source_fips", "source_name", "STATE_ABBREV"]].drop_duplicates("source_fips").set_index("source_fips")
     target_meta = df[["target_fips", "target_name", "STATE_ABBREV"]].drop_duplicates("target_fips").set_index("target_fips")
@@ -50,6 +63,10 @@ def main():
     
     ranking.to_csv(os.path.join(OUT, "county_influence_rankings.csv"), index=False)
     
+    if not args.plots:
+        return
+
+    import matplotlib.pyplot as plt
     top10 = ranking.head(10).sort_values("influence_score", ascending=True)
     
     plt.figure(figsize=(10, 6))
@@ -7,10 +7,14 @@ Outputs:
 """
 
 import os
+import sys
+import argparse
 import pandas as pd
 import numpy as np
-import networkx as nx
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage, current_stage
+from common.partition import Partitioned
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -19,10 +23,10 @@ NETWORKS_DIR = os.path.join(OUT, "state_networks")
 os.makedirs(NETWORKS_DIR, exist_ok=True)
 
 
-def plot_state_network(state, edges_df, rankings_df):
-    state_edges = edges_df[edges_df["STATE_ABBREV"] == state]
-    state_ranks = rankings_df[rankings_df["STATE_ABBREV"] == state]
-    
+def plot_state_network(state, state_edges, state_ranks):
+    import networkx as nx
+    import matplotlib.pyplot as plt
+
     if state_edges.empty:
         return None
     
@@ -48,10 +52,11 @@ def plot_state_network(state, edges_df, rankings_df):
     
     fig, ax = plt.subplots(figsize=(14, 10))
     
-    if len(G.nodes()) > 50:
-        pos = nx.spring_layout(G, k=2, iterations=50, seed=42)
-    else:
-        pos = nx.spring_layout(G, k=3, iterations=100, seed=42)
+    with stage("county.spring_layout", nodes=G.number_of_nodes(), edges=G.number_of_edges()):
+        if len(G.nodes()) > 50:
+            pos = nx.spring_layout(G, k=2, iterations=50, seed=42)
+        else:
+            pos = nx.spring_layout(G, k=3, iterations=100, seed=42)
     
     edge_weights = [G[u][v]["weight"] for u, v in G.edges()]
     max_weight = max(edge_weights) if edge_weights else 1
@@ -86,7 +91,13 @@ def plot_state_network(state, edges_df, rankings_df):
     return fig
 
 
-def main():
+@instrumented("county.visualize_state_networks")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-plots", dest="plots", action="store_false",
+                        help="only write county_top10_by_state.csv")
+    args = parser.parse_args(argv)
+
     print("=" * 60)
     print("GENERATING STATE-LEVEL COUNTY NETWORK VISUALIZATIONS")
     print("=" * 60)
@@ -100,36 +111,47 @@ def main():
     
     edges_df = pd.read_csv(edges_path)
     rankings_df = pd.read_csv(ranks_path)
+    edges_by_state = Partitioned(edges_df, "STATE_ABBREV")
+    ranks_by_state = Partitioned(rankings_df, "STATE_ABBREV")
     
     states = sorted(edges_df["STATE_ABBREV"].unique())
     print(f"\nProcessing {len(states)} states...\n")
     
     top10_all = []
+    if args.plots:
+        import matplotlib.pyplot as plt
     
     for state in states:
-        state_ranks = rankings_df[rankings_df["STATE_ABBREV"] == state].head(10).copy()
+        all_ranks = ranks_by_state[state]
+        state_ranks = all_ranks.head(10).copy()
         state_ranks["rank_in_state"] = range(1, len(state_ranks) + 1)
         top10_all.append(state_ranks)
         
-        fig = plot_state_network(state, edges_df, rankings_df)
+        if not args.plots:
+            continue
+
+        fig = plot_state_network(state, edges_by_state[state], all_ranks)
         if fig:
             fig_path = os.path.join(NETWORKS_DIR, f"{state}_network.png")
-            fig.savefig(fig_path, dpi=150, bbox_inches='tight')
+            with stage("county.network_savefig"):
+                fig.savefig(fig_path, dpi=150, bbox_inches='tight')
             plt.close(fig)
             
-            n_counties = len(rankings_df[rankings_df["STATE_ABBREV"] == state])
+            n_counties = len(all_ranks)
             print(f"  {state}: Saved network ({n_counties} counties)")
     
     top10_df = pd.concat(top10_all, ignore_index=True)
     top10_df = top10_df[["STATE_ABBREV", "rank_in_state", "FIPS", "COUNTY_NAME", "influence_score", "eigenvector_centrality"]]
     top10_path = os.path.join(OUT, "county_top10_by_state.csv")
     top10_df.to_csv(top10_path, index=False)
+    current_stage().count(states=len(states), edges=len(edges_df))
     
     print(f"\n" + "=" * 60)
     print("COMPLETE!")
     print("=" * 60)
     print(f"\nOutputs:")
-    print(f"  - {len(states)} network graphs in: outputs/state_networks/")
+    if args.plots:
+        print(f"  - {len(states)} network graphs in: outputs/state_networks/")
     print(f"  - Top 10 rankings: {top10_path}")
     
     print(f"\n{'='*60}")
@@ -139,7 +161,7 @@ def main():
     print("-" * 50)
     
     for state in states:
-        state_ranks = rankings_df[rankings_df["STATE_ABBREV"] == state]
+        state_ranks = ranks_by_state[state]
         if not state_ranks.empty:
             top = state_ranks.iloc[0]
             print(f"{state:<8} {top['COUNTY_NAME'][:28]:<30} {top['influence_score']:>10.2f}")
@@ -0,0 +1,219 @@
+"""
+Model zoo for next-period rate forecasts on the shared feature store.
+
+Models (sklearn):
+- linear: LinearRegression on rate + spatial lag (the existing two-feature model)
+- ridge / lasso: standardised linear models on every feature
+- hgb: HistGradientBoostingRegressor
+- rf:  RandomForestRegressor
+
+Features are built once into a FeatureStore (common/features.py) and reused by
+every candidate. Hyperparameters are chosen on the last --val_years target
+years before --split_year, with all (model, params) candidates fitted in
+parallel (joblib). Each model's best candidate is then refitted on every
+target year <= --split_year and scored on the later years.
+
+Outputs:
+- outputs/{level}_model_zoo_search.csv:      every candidate's validation RMSE
+- outputs/{level}_model_zoo_scores.csv:      best candidate per model, test metrics
+- outputs/{level}_model_zoo_predictions.csv: test-period predictions per model
+- outputs/models/{level}_{model}.json:        with --save, each refitted model
+                                              (see persistence.py / predict.py)
+--metric forecasts another panel metric and --covariates adds other metrics
+at t and t-1 as features (common/metric_panel.py); output names then carry a
+_{metric} suffix after the level.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import itertools
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.features import feature_store
+from common.metric_panel import DEFAULT_METRIC, suffix
+from common.instrument import instrumented, stage
+from common.manifest import derive_seed
+from persistence import save_model
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+BASELINE_FEATURES = ["rate", "spatial_lag"]
+
+# model -> (hyperparameter grid, feature subset or None for all)
+ZOO = {
+    "linear": ({}, BASELINE_FEATURES),
+    "ridge": ({"alpha": [0.1, 1.0, 10.0, 100.0]}, None),
+    "lasso": ({"alpha": [0.01, 0.1, 1.0]}, None),
+    "hgb": ({"learning_rate": [0.05, 0.1], "max_leaf_nodes": [15, 31], "l2_regularization": [0.0, 1.0]}, None),
+    "rf": ({"min_samples_leaf": [1, 5], "max_features": [1.0, 0.5]}, None),
+}
+
+
+def make_model(name, params, seed=0):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LinearRegression, Ridge, Lasso
+    from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+    if name == "linear":
+        return LinearRegression(**params)
+    if name == "ridge":
+        return make_pipeline(StandardScaler(), Ridge(**params))
+    if name == "lasso":
+        return make_pipeline(StandardScaler(), Lasso(max_iter=10000, **params))
+    if name == "hgb":
+        return HistGradientBoostingRegressor(random_state=seed, **params)
+    if name == "rf":
+        return RandomForestRegressor(n_estimators=200, random_state=seed, n_jobs=1, **params)
+    raise ValueError(f"unknown model {name!r}")
+
+
+def candidates(models):
+    for name in models:
+        grid, columns = ZOO[name]
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            yield name, dict(zip(keys, values)), columns
+
+
+def columns_of(store, columns):
+    return list(range(len(store.names))) if columns is None else [store.names.index(c) for c in columns]
+
+
+def fit_and_score(name, params, X_train, y_train, X_eval, y_eval, seed=0):
+    """Fit one candidate; returns (RMSE on the evaluation rows, predictions, fit seconds, model)."""
+    started = time.perf_counter()
+    model = make_model(name, params, seed).fit(X_train, y_train)
+    elapsed = time.perf_counter() - started
+    pred = model.predict(X_eval)
+    return float(np.sqrt(np.mean((pred - y_eval) ** 2))), pred, elapsed, model
+
+
+def _evaluate(name, params, cols, X_train, y_train, X_eval, y_eval, seed, keep_model=False):
+    rmse, pred, elapsed, model = fit_and_score(name, params, X_train[:, cols], y_train, X_eval[:, cols], y_eval, seed)
+    return (rmse, pred, elapsed, model) if keep_model else (rmse, pred, elapsed)
+
+
+def search(store, models, split_year, val_years=2, jobs=-1, seed=0):
+    """Validation RMSE of every candidate, fitted in parallel on one shared design matrix."""
+    from joblib import Parallel, delayed
+
+    val_start = split_year - val_years + 1
+    X_tr, y_tr = store.design(store.rows(max_target_year=val_start - 1))
+    X_val, y_val = store.design(store.rows(min_target_year=val_start, max_target_year=split_year))
+    cands = list(candidates(models))
+    results = Parallel(n_jobs=jobs)(
+        delayed(_evaluate)(name, params, columns_of(store, columns), X_tr, y_tr, X_val, y_val, seed)
+        for name, params, columns in cands
+    )
+    return pd.DataFrame([
+        {"model": name, "params": json.dumps(params, sort_keys=True), "val_rmse": rmse, "fit_s": elapsed}
+        for (name, params, _), (rmse, _, elapsed) in zip(cands, results)
+    ])
+
+
+def refit_best(store, searched, split_year, jobs=-1, seed=0):
+    """Refit each model's best candidate on all training years and score it on the test years."""
+    from joblib import Parallel, delayed
+
+    best = searched.sort_values(["model", "val_rmse"]).groupby("model", sort=False).head(1)
+    X_tr, y_tr = store.design(store.rows(max_target_year=split_year))
+    test_rows = store.rows(min_target_year=split_year + 1)
+    X_te, y_te = store.design(test_rows)
+
+    fits = Parallel(n_jobs=jobs)(
+        delayed(_evaluate)(row.model, json.loads(row.params), columns_of(store, ZOO[row.model][1]),
+                           X_tr, y_tr, X_te, y_te, seed, keep_model=True)
+        for row in best.itertuples()
+    )
+    scores, preds, fitted = [], {}, {}
+    ss_tot = float(np.sum((y_te - y_te.mean()) ** 2)) if len(y_te) else 0.0
+    for row, (rmse, pred, elapsed, model) in zip(best.itertuples(), fits):
+        scores.append({
+            "model": row.model,
+            "params": row.params,
+            "val_rmse": row.val_rmse,
+            "test_rmse": rmse,
+            "test_mae": float(np.mean(np.abs(pred - y_te))) if len(y_te) else np.nan,
+            "test_r2": 1 - float(np.sum((pred - y_te) ** 2)) / ss_tot if ss_tot > 0 else np.nan,
+            "fit_s": elapsed,
+        })
+        preds[row.model] = pred
+        fitted[row.model] = model
+    return pd.DataFrame(scores).sort_values("test_rmse"), test_rows, y_te, preds, fitted
+
+
+@instrumented("modeling.model_zoo")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--models", default=",".join(ZOO), help=f"comma-separated subset of {','.join(ZOO)}")
+    parser.add_argument("--split_year", type=int, default=2016, help="last training target year")
+    parser.add_argument("--val_years", type=int, default=2, help="target years before the split used for tuning")
+    parser.add_argument("--jobs", type=int, default=-1, help="parallel fits (joblib n_jobs)")
+    parser.add_argument("--cached", action="store_true", help="reuse outputs/features/{level}_features.npz while its inputs are unchanged")
+    parser.add_argument("--seed", type=int, default=derive_seed("models"),
+                        help="default: this step's seed derived from the run seed (EPI_SEED)")
+    parser.add_argument("--save", action="store_true", help="persist each refitted model to outputs/models/")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, help="panel metric to forecast")
+    parser.add_argument("--covariates", default="", help="comma-separated other metrics added as features")
+    args = parser.parse_args(argv)
+    covariates = [c.strip() for c in args.covariates.split(",") if c.strip()]
+    tag = f"{args.level}{suffix(args.metric)}"
+
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    unknown = set(models) - set(ZOO)
+    if unknown:
+        raise SystemExit(f"unknown model(s) {sorted(unknown)}; choose from {list(ZOO)}")
+
+    with stage(f"{args.level}.feature_store") as rec:
+        store = feature_store(args.level, cached=args.cached, metric=args.metric, covariates=covariates)
+        rec.count(units=len(store.units), periods=len(store.periods), features=len(store.names))
+    print(f"Feature store: {len(store.units)} units x {len(store.periods)} periods x {len(store.names)} features "
+          f"({', '.join(store.names)})")
+
+    with stage(f"{args.level}.model_search") as rec:
+        searched = search(store, models, args.split_year, args.val_years, args.jobs, args.seed)
+        rec.count(candidates=len(searched))
+    print(f"Searched {len(searched)} candidates in {rec.wall_s:.1f}s")
+
+    with stage(f"{args.level}.model_refit", models=len(models)):
+        scores, test_rows, y_test, preds, fitted = refit_best(store, searched, args.split_year, args.jobs, args.seed)
+
+    unit_idx, t_idx = test_rows
+    predictions = pd.DataFrame({
+        store.unit_col: store.units[unit_idx],
+        "YEAR": store.target_years[t_idx],
+        "actual_rate": y_test,
+    })
+    for name, pred in preds.items():
+        predictions[name] = pred
+
+    searched.to_csv(os.path.join(OUT, f"{tag}_model_zoo_search.csv"), index=False)
+    scores.to_csv(os.path.join(OUT, f"{tag}_model_zoo_scores.csv"), index=False)
+    predictions.to_csv(os.path.join(OUT, f"{tag}_model_zoo_predictions.csv"), index=False)
+
+    print("\n" + "=" * 50)
+    print(f"MODEL ZOO ({args.level} {args.metric}, test targets > {args.split_year}, {len(y_test)} rows)")
+    print("=" * 50)
+    print(scores.drop(columns="fit_s").round(3).to_string(index=False))
+    print(f"\nSaved search, scores and predictions to {OUT}")
+
+    if args.save:
+        for row in scores.itertuples():
+            path = save_model(fitted[row.model], row.model, args.level, ZOO[row.model][1] or store.names,
+                              trained_through=args.split_year, metric=store.metric, threshold=store.threshold,
+                              metrics={"val_rmse": row.val_rmse, "test_rmse": row.test_rmse, "test_r2": row.test_r2})
+            print(f"  saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Saved forecasting models: coefficients plus feature spec in a small JSON file.
+
+Linear models (LinearRegression, and StandardScaler + Ridge / Lasso pipelines,
+with the scaling folded into the coefficients) are stored entirely as JSON:
+
+    {"name": "ridge", "level": "state", "kind": "linear",
+     "features": ["rate", ...], "intercept": ..., "coef": [...],
+     "trained_through": 2016, "threshold": 87.35, ...}
+
+Tree ensembles cannot be reduced to coefficients; their estimator is written
+next to the JSON as a .joblib file that the spec points to ("kind": "sklearn").
+
+Models live in outputs/models/{level}_{name}.json ({level}_{metric}_{name}.json
+for a metric other than the dispensing rate; see common/metric_panel.py).
+"""
+
+import os
+import json
+from datetime import datetime
+import numpy as np
+
+from common.metric_panel import DEFAULT_METRIC, THRESHOLD, suffix
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+MODEL_DIR = os.path.join(PROJECT_ROOT, "outputs", "models")
+
+
+def linear_terms(model):
+    """(intercept, coef) on the raw feature scale, or None if the model is not linear."""
+    scaler = None
+    steps = getattr(model, "steps", None)
+    if steps is not None:
+        if len(steps) != 2 or not hasattr(steps[0][1], "scale_"):
+            return None
+        scaler, model = steps[0][1], steps[1][1]
+    coef = getattr(model, "coef_", None)
+    if coef is None or np.ndim(coef) != 1:
+        return None
+    coef = np.asarray(coef, dtype=float)
+    intercept = float(model.intercept_)
+    if scaler is not None:
+        # StandardScaler already sets scale_ = 1 for constant features
+        coef = coef / scaler.scale_
+        intercept -= float(coef @ scaler.mean_)
+    return intercept, coef
+
+
+def model_path(level, name, model_dir=None, metric=None):
+    return os.path.join(model_dir or MODEL_DIR, f"{level}{suffix(metric)}_{name}.json")
+
+
+def save_model(model, name, level, features, trained_through=None, metrics=None, model_dir=None,
+               metric=DEFAULT_METRIC, threshold=THRESHOLD):
+    """Write a fitted model and its feature spec; returns the JSON path."""
+    path = model_path(level, name, model_dir, metric)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    spec = {
+        "name": name,
+        "level": level,
+        "metric": metric,
+        "features": list(features),
+        "trained_through": trained_through,
+        "threshold": threshold,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "metrics": metrics or {},
+    }
+    terms = linear_terms(model)
+    if terms is not None:
+        spec.update(kind="linear", intercept=terms[0], coef=terms[1].tolist())
+    else:
+        import joblib
+
+        artifact = os.path.splitext(os.path.basename(path))[0] + ".joblib"
+        joblib.dump(model, os.path.join(os.path.dirname(path), artifact))
+        spec.update(kind="sklearn", artifact=artifact)
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=2)
+    return path
+
+
+class SavedModel:
+    """A loaded model: `features` names the columns `predict(X)` expects, in order."""
+
+    def __init__(self, spec, estimator=None):
+        self.spec = spec
+        self.estimator = estimator
+
+    @property
+    def name(self):
+        return self.spec["name"]
+
+    @property
+    def level(self):
+        return self.spec["level"]
+
+    @property
+    def metric(self):
+        return self.spec.get("metric", DEFAULT_METRIC)
+
+    @property
+    def features(self):
+        return self.spec["features"]
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=float)
+        if self.spec["kind"] == "linear":
+            return self.spec["intercept"] + X @ np.asarray(self.spec["coef"])
+        return self.estimator.predict(X)
+
+
+def load_model(path):
+    with open(path) as f:
+        spec = json.load(f)
+    estimator = None
+    if spec["kind"] == "sklearn":
+        import joblib
+
+        estimator = joblib.load(os.path.join(os.path.dirname(path), spec["artifact"]))
+    return SavedModel(spec, estimator)
+
+
+def saved_models(level=None, model_dir=None):
+    """JSON paths of every saved model (optionally of one level), sorted."""
+    model_dir = model_dir or MODEL_DIR
+    if not os.path.isdir(model_dir):
+        return []
+    prefix = f"{level}_" if level else ""
+    return sorted(os.path.join(model_dir, f) for f in os.listdir(model_dir)
+                  if f.endswith(".json") and f.startswith(prefix))
@@ -0,0 +1,91 @@
+"""
+Batch scoring with saved models: next-period forecasts without retraining.
+
+Loads models saved by `model_zoo.py --save` (outputs/models/), builds only the
+features they need for the newest period of the panel (or --period), and scores
+every state / county in one vectorised predict call per model.
+
+Outputs:
+- outputs/{level}_batch_scores.csv: unit, base and target period, metric,
+                                    model, predicted value and predicted high flag
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.features import LEVELS, latest_features
+from common.instrument import instrumented, stage
+from persistence import load_model, saved_models
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+
+def score(models, level, period=None):
+    """One frame of forecasts for every model; features are built once per metric for their union."""
+    frames = []
+    for metric in dict.fromkeys(m.metric for m in models):
+        group = [m for m in models if m.metric == metric]
+        names = list(dict.fromkeys(f for m in group for f in m.features))
+        units, base, target, X = latest_features(level, names, period, metric=metric)
+        # the store only has targets for rows with an observed rate
+        observed = ~np.isnan(X[:, names.index("rate")]) if "rate" in names else np.ones(len(units), dtype=bool)
+        for model in group:
+            cols = [names.index(f) for f in model.features]
+            pred = model.predict(X[observed][:, cols])
+            frames.append(pd.DataFrame({
+                LEVELS[level]["unit"]: units[observed],
+                "PERIOD": base,
+                "TARGET_PERIOD": target,
+                "metric": metric,
+                "model": model.name,
+                "trained_through": model.spec.get("trained_through"),
+                "predicted_rate": pred,
+                "predicted_high": (pred > model.spec["threshold"]).astype(int),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+@instrumented("modeling.predict")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--model", nargs="*", default=None,
+                        help="saved model JSON files (default: every outputs/models/{level}_*.json)")
+    parser.add_argument("--period", type=int, default=None,
+                        help="period ordinal to score from (default: the newest in the panel)")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    paths = args.model or saved_models(args.level)
+    if not paths:
+        raise SystemExit(f"no saved {args.level} models; run model_zoo.py --level {args.level} --save first.")
+    models = [load_model(p) for p in paths]
+    wrong = [m.name for m in models if m.level != args.level]
+    if wrong:
+        raise SystemExit(f"models {wrong} were trained at another level than {args.level}")
+
+    with stage(f"{args.level}.batch_predict", models=len(models)) as rec:
+        scores = score(models, args.level, args.period)
+        rec.count(rows=len(scores))
+
+    out = args.out or os.path.join(OUT, f"{args.level}_batch_scores.csv")
+    scores.to_csv(out, index=False)
+
+    summary = scores.groupby(["metric", "model"]).agg(units=("predicted_rate", "size"),
+                                          mean_rate=("predicted_rate", "mean"),
+                                          high=("predicted_high", "sum"))
+    print(f"Scored {scores['PERIOD'].iloc[0]} -> {scores['TARGET_PERIOD'].iloc[0]} "
+          f"with {len(models)} saved model(s) in {rec.wall_s:.2f}s")
+    print(summary.round(2).to_string())
+    print(f"\nSaved batch scores to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Hierarchical forecast reconciliation: county forecasts that add up to states.
+
+The state (predict_continuous.py) and county (predict_county_continuous.py)
+regressions are fitted independently, so a state's forecast rarely equals the
+population-weighted mean of its counties' forecasts. Writing the hierarchy as
+y = S b, with b the m county rates and
+
+    S = [A; I],  A[s, c] = population share of county c in state s (sparse),
+
+each method maps the stacked base forecasts yhat = [states; counties] of every
+target year to coherent ones:
+- bottom_up: counties unchanged, states = A @ counties
+- top_down:  states unchanged, counties scaled by state / (A @ counties)
+             (forecast proportions)
+- mint:      ytilde = yhat - W C' (C W C')^-1 C yhat, with C = [I, -A] the
+             constraint matrix and W the diagonal base-error variances (the
+             WLS / diagonal MinT estimator). C W C' is only states x states
+             and sparse, so all years are solved together as one
+             block-diagonal sparse LU; no dense (n + m)^2 covariance is formed.
+
+Variances are the spread of each series' year-to-year changes up to
+--split_year. Population shares come from data/reference/county_population.csv
+(see common/geography.py); without it every county of a state gets an equal
+share, which misstates every state aggregate - main() warns, and both outputs
+record the shares used in a `weights` column (population / equal). A county or state without a base forecast in some year is filled from
+the other level with a huge variance, so MinT effectively imputes it.
+
+Outputs:
+- outputs/reconciled_forecasts.csv:   level, unit, target YEAR, actual, base
+                                      and reconciled forecast per method, weights
+- outputs/reconciliation_scores.csv:  RMSE / MAE per level and method, the
+                                      largest state-vs-counties gap, weights
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.periods import DensePanel
+from common import geography
+from common.instrument import instrumented, stage
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+METHODS = ["bottom_up", "top_down", "mint"]
+# variance multiplier for filled-in base forecasts
+UNKNOWN = 1e6
+
+
+def summing_weights(states, fips, state_of, population=None):
+    """
+    Sparse (states x counties) matrix of within-state population shares.
+
+    Counties without a population get the mean population of their state's
+    known counties, or equal shares when none is known.
+    """
+    rows = pd.Index(states).get_indexer(state_of)
+    keep = rows >= 0
+    pop = np.ones(len(fips))
+    source = "equal"
+    if population is not None and len(population):
+        known = population.reindex(geography.fips_key(fips)).to_numpy()
+        by_state = pd.Series(known).groupby(rows).transform("mean").to_numpy()
+        pop = np.where(np.isnan(known), by_state, known)
+        pop = np.where(np.isnan(pop), 1.0, pop)
+        source = "population"
+    A = sparse.csr_matrix((pop[keep], (rows[keep], np.flatnonzero(keep))), shape=(len(states), len(fips)))
+    totals = np.asarray(A.sum(axis=1)).ravel()
+    A = sparse.diags(1.0 / np.where(totals > 0, totals, 1.0)) @ A
+    return A.tocsr(), source
+
+
+def change_variances(panel, last_year):
+    """Per-unit variance of period-to-period changes up to `last_year` (level median as fallback)."""
+    R = panel.values[:, panel.periods // panel.periods_per_year <= last_year]
+    diffs = np.diff(R, axis=1)
+    enough = (~np.isnan(diffs)).sum(axis=1) >= 2
+    var = np.full(len(R), np.nan)
+    var[enough] = np.nanvar(diffs[enough], axis=1, ddof=1)
+    fallback = np.nanmedian(var) if enough.any() else 1.0
+    var = np.where(np.isnan(var) | (var <= 0), fallback, var)
+    return var
+
+
+def load_base_forecasts():
+    """Dense (unit x target year) base forecasts and actuals for both levels, plus the county hierarchy."""
+    state_path = os.path.join(OUT, "continuous_prediction_results.csv")
+    county_path = os.path.join(OUT, "county_prediction_results.csv")
+    for path in (state_path, county_path):
+        if not os.path.exists(path):
+            raise SystemExit(f"{path} not found; run predict-states and predict-counties first.")
+    state = pd.read_csv(state_path)
+    county = pd.read_csv(county_path)
+    # state results are keyed by target year, county results by base year
+    county = county.assign(YEAR=county["YEAR"] + 1)
+
+    county_panel = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+    hierarchy = county_panel.drop_duplicates("FIPS", keep="last").sort_values("FIPS")
+    fips = hierarchy["FIPS"].to_numpy()
+    state_of = hierarchy["STATE_ABBREV"].to_numpy()
+    states = np.array(sorted(set(state_of)))
+    years = np.array(sorted(set(state["YEAR"]) | set(county["YEAR"])))
+
+    def dense(df, unit_col, units, value_col):
+        return DensePanel.from_frame(df, unit_col, value_col, "year", units=units, periods=years).values
+
+    return {
+        "states": states, "fips": fips, "state_of": state_of, "years": years,
+        "state_base": dense(state, "STATE_ABBREV", states, "Predicted_Rate"),
+        "state_actual": dense(state, "STATE_ABBREV", states, "Actual_Rate"),
+        "county_base": dense(county, "FIPS", fips, "predicted_rate"),
+        "county_actual": dense(county, "FIPS", fips, "target_next_year"),
+        "state_panel": DensePanel.from_frame(pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv")),
+                                             "STATE_ABBREV", units=states),
+        "county_panel": DensePanel.from_frame(county_panel, "FIPS", units=fips),
+    }
+
+
+def fill_missing(A, state_base, county_base, county_state):
+    """Fill gaps in either level from the other; returns filled arrays and their masks."""
+    county_missing = np.isnan(county_base)
+    state_missing = np.isnan(state_base)
+    column_mean = np.nanmean(np.where(county_missing, np.nan, county_base), axis=0)
+    from_state = state_base[county_state]
+    county = np.where(county_missing, np.where(np.isnan(from_state), column_mean, from_state), county_base)
+    state = np.where(state_missing, A @ county, state_base)
+    return state, county, state_missing, county_missing
+
+
+def bottom_up(A, county):
+    return A @ county, county
+
+
+def top_down(A, state, county, county_state):
+    aggregate = A @ county
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(aggregate != 0, state / aggregate, 1.0)
+    return state, county * ratio[county_state]
+
+
+def mint(A, state, county, state_var, county_var):
+    """
+    Diagonal-W MinT for every period at once.
+
+    `state_var` / `county_var` are per-entry variances shaped like the
+    forecasts. The multipliers solve (C W_t C') lam_t = C yhat_t for all t in
+    one block-diagonal sparse system.
+    """
+    T = state.shape[1]
+    # period-major stacking: entry (unit, t) -> t * n_units + unit
+    ys, yc = state.T.ravel(), county.T.ravel()
+    vs, vc = state_var.T.ravel(), county_var.T.ravel()
+    A_all = sparse.block_diag([A] * T, format="csr")
+    M = sparse.diags(vs) + A_all @ sparse.diags(vc) @ A_all.T
+    lam = splu(M.tocsc()).solve(ys - A_all @ yc)
+    state_rec = ys - vs * lam
+    county_rec = yc + vc * (A_all.T @ lam)
+    return state_rec.reshape(T, -1).T, county_rec.reshape(T, -1).T
+
+
+def reconcile(base, split_year=2016, population=None):
+    A, weights = summing_weights(base["states"], base["fips"], base["state_of"], population)
+    county_state = pd.Index(base["states"]).get_indexer(base["state_of"])
+    state, county, state_missing, county_missing = fill_missing(A, base["state_base"], base["county_base"], county_state)
+
+    state_var = change_variances(base["state_panel"], split_year)[:, None] * np.where(state_missing, UNKNOWN, 1.0)
+    county_var = change_variances(base["county_panel"], split_year)[:, None] * np.where(county_missing, UNKNOWN, 1.0)
+
+    results = {
+        "base": (state, county),
+        "bottom_up": bottom_up(A, county),
+        "top_down": top_down(A, state, county, county_state),
+        "mint": mint(A, state, county, state_var, county_var),
+    }
+    return A, weights, results
+
+
+def long_frame(level, units, years, actual, base, results, index):
+    unit_idx, t_idx = np.nonzero(~np.isnan(base))
+    frame = pd.DataFrame({
+        "level": level,
+        "unit": units[unit_idx],
+        "YEAR": years[t_idx],
+        "actual": actual[unit_idx, t_idx],
+        "base": base[unit_idx, t_idx],
+    })
+    for method in METHODS:
+        frame[method] = results[method][index][unit_idx, t_idx]
+    return frame
+
+
+def scores(forecasts, incoherence):
+    rows = []
+    for level, group in forecasts.groupby("level", sort=False):
+        group = group.dropna(subset=["actual"])
+        for method in ["base"] + METHODS:
+            err = group[method] - group["actual"]
+            rows.append({
+                "level": level,
+                "method": method,
+                "rows": len(group),
+                "rmse": float(np.sqrt(np.mean(err ** 2))),
+                "mae": float(np.mean(np.abs(err))),
+                "max_state_gap": incoherence[method],
+            })
+    return pd.DataFrame(rows)
+
+
+@instrumented("modeling.reconcile")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split_year", type=int, default=2016,
+                        help="last year used to estimate the base-error variances")
+    args = parser.parse_args(argv)
+
+    with stage("reconcile.load") as rec:
+        base = load_base_forecasts()
+        rec.count(states=len(base["states"]), counties=len(base["fips"]), years=len(base["years"]))
+
+    with stage("reconcile.solve", methods=len(METHODS)):
+        A, weights, results = reconcile(base, args.split_year, geography.county_population())
+    if weights == "equal":
+        print("\n" + "!" * 50)
+        print(f"WARNING: {geography.COUNTY_POPULATION_PATH} not found; counties are")
+        print("weighted equally within their state, so state aggregates (bottom_up,")
+        print("top_down, mint) are not population-weighted and state scores suffer.")
+        print("!" * 50)
+
+    incoherence = {}
+    for method, (state, county) in results.items():
+        incoherence[method] = float(np.max(np.abs(state - A @ county)))
+
+    forecasts = pd.concat([
+        long_frame("state", base["states"], base["years"], base["state_actual"], base["state_base"], results, 0),
+        long_frame("county", base["fips"], base["years"], base["county_actual"], base["county_base"], results, 1),
+    ], ignore_index=True)
+    forecasts["weights"] = weights
+    summary = scores(forecasts, incoherence).assign(weights=weights)
+
+    forecasts.to_csv(os.path.join(OUT, "reconciled_forecasts.csv"), index=False)
+    summary.to_csv(os.path.join(OUT, "reconciliation_scores.csv"), index=False)
+
+    print("\n" + "=" * 50)
+    print(f"RECONCILIATION ({len(base['states'])} states, {len(base['fips'])} counties, "
+          f"{len(base['years'])} target years, {weights} weights)")
+    print("=" * 50)
+    print(summary.round(3).to_string(index=False))
+    print(f"\nSaved reconciled forecasts and scores to {OUT}")
+
+
+if __name__ == "__main__":
+    main()
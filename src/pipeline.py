@@ -0,0 +1,184 @@
+"""
+Single entry point for the pipeline scripts.
+
+Each subcommand imports its module only when it runs, so `pipeline.py lead-lag`
+never loads networkx / sklearn / matplotlib, and `--no-plots` skips matplotlib
+entirely (plot-only steps are dropped, the rest write their CSVs only).
+
+Every run writes a manifest (outputs/manifests/<run_id>.json: inputs,
+outputs, code and package versions, seeds, stage timings; see
+common/manifest.py). --seed sets the run seed, --cached skips steps whose
+recorded inputs, code and outputs are unchanged, and `replay` re-runs a
+manifest and checks that its outputs come out the same.
+
+Usage:
+    python src/pipeline.py list
+    python src/pipeline.py [--no-plots] [--seed N] [--cached] <command> [command options]
+    python src/pipeline.py [--no-plots] [--seed N] [--cached] all
+    python src/pipeline.py replay <manifest|run_id|last> [--stale]
+
+Examples:
+    python src/pipeline.py hazard --level county
+    python src/pipeline.py --no-plots predict-counties
+    python src/pipeline.py --no-plots --cached all
+"""
+
+import os
+import sys
+import argparse
+import importlib
+from collections import namedtuple
+
+SRC = os.path.abspath(os.path.dirname(__file__))
+
+# plots: None = never plots, "optional" = accepts --no-plots, "only" = plotting step
+Command = namedtuple("Command", ["area", "module", "takes_args", "plots", "help"])
+
+COMMANDS = {
+    "prepare": Command("preprocessing", "prepare_data", True, None, "merge raw state / county data"),
+    "validate": Command("preprocessing", "validate_county_data", True, None, "county data-quality scan"),
+    "adoption": Command("state_level", "compute_adoption", False, None, "state adoption years"),
+    "state-network": Command("state_level", "build_influence_network", True, None, "state influence edges"),
+    "rank-states": Command("state_level", "rank_influencers", False, None, "state centrality rankings"),
+    "bootstrap-ranks": Command("state_level", "bootstrap_rankings", True, None, "rank confidence intervals"),
+    "temporal-paths": Command("state_level", "temporal_paths", True, None, "time-respecting reachability + betweenness"),
+    "predict-states": Command("state_level", "predict_continuous", True, "optional", "state spatial regression"),
+    "hazard": Command("state_level", "hazard_model", True, None, "discrete-time adoption hazard"),
+    "nar": Command("state_level", "network_autoregression", True, None, "network autoregression"),
+    "simulate": Command("state_level", "simulate_diffusion", False, None, "diffusion replay"),
+    "counterfactual": Command("state_level", "counterfactual", True, None, "intervention scenarios"),
+    "communities": Command("state_level", "communities", True, None, "influence communities + trajectory clusters"),
+    "county-network": Command("county_level", "build_intra_state_networks", True, None, "county influence edges"),
+    "superspreaders": Command("county_level", "find_superspreaders", False, None, "counties high before their state"),
+    "lead-lag": Command("county_level", "lead_lag", True, None, "county lead-lag correlations"),
+    "rank-counties": Command("county_level", "rank_county_influencers", True, "optional", "county centrality rankings"),
+    "predict-counties": Command("county_level", "predict_county_continuous", True, "optional", "county regression"),
+    "predict-ga": Command("county_level", "predict_ga_county", True, "optional", "Georgia county regression"),
+    "county-plots": Command("county_level", "visualize_state_networks", True, "optional", "per-state networks + top 10"),
+    "export-network": Command("county_level", "export_network_bundle", True, None, "county network bundle for docs/network.html"),
+    "models": Command("modeling", "model_zoo", True, None, "forecasting model zoo + hyperparameter search"),
+    "predict": Command("modeling", "predict", True, None, "batch scoring with saved models"),
+    "reconcile": Command("modeling", "reconcile", True, None, "coherent state / county forecasts"),
+    "plots": Command("visualization", "create_visualizations", False, "only", "network / ranking / adoption charts"),
+    "paper-plots": Command("visualization", "paper_visualizations", False, "only", "paper figures"),
+    "evolution": Command("visualization", "network_evolution", True, "only", "network evolution panels / animation"),
+    "superspreader-plot": Command("visualization", "visualize_superspreaders", False, "only", "superspreader chart"),
+    "serve": Command("serving", "query_server", True, None, "local HTTP query API"),
+    "metrics": Command("common", "instrument", True, None, "summarise stage metrics"),
+    "manifest": Command("common", "manifest", True, None, "list / show / verify / diff run manifests"),
+    "shared": Command("common", "shared_panel", True, None, "list / clean up shared-memory panels"),
+}
+
+# commands that only read or serve; they are not recorded in manifests
+UNRECORDED = {"serve", "metrics", "manifest", "shared"}
+
+PIPELINE = [
+    "prepare", "adoption", "state-network", "rank-states", "predict-states", "hazard", "nar", "simulate",
+    "county-network", "superspreaders", "lead-lag", "rank-counties", "predict-counties", "predict-ga",
+    "county-plots", "plots", "paper-plots", "superspreader-plot",
+]
+
+
+def load(command):
+    """Import a command's module on demand, with its folder importable for sibling imports."""
+    spec = COMMANDS[command]
+    for path in (SRC, os.path.join(SRC, spec.area)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(spec.module)
+
+
+def run(command, argv=(), no_plots=False, manifest=None, cached=False):
+    spec = COMMANDS[command]
+    if no_plots and spec.plots == "only":
+        print(f"[{command}] skipped (--no-plots)")
+        return
+    options = list(argv)
+    argv = list(argv)
+    if no_plots and spec.plots == "optional":
+        argv.append("--no-plots")
+    if argv and not spec.takes_args:
+        raise SystemExit(f"{command} takes no options")
+
+    from common import manifest as manifests
+    seed = manifests.seed_everything(command)
+    if manifest is None or command in UNRECORDED:
+        return call(command, argv)
+    if cached:
+        previous = manifests.find_cached(command, options, no_plots, seed, exclude=manifest.path)
+        if previous is not None:
+            print(f"[{command}] unchanged since {previous['cached_from']}, skipped (--cached)")
+            manifest.reuse(previous)
+            return
+    manifest.record(command, options, no_plots, seed, lambda: call(command, argv))
+
+
+def call(command, argv):
+    main = load(command).main
+    if COMMANDS[command].takes_args:
+        main(argv)
+    else:
+        main()
+
+
+def replay(path, stale_only=False):
+    """Re-run a manifest's steps with their options and seeds, then compare outputs with the recorded ones."""
+    from common import manifest as manifests
+    recorded = manifests.Manifest.load(path)
+    os.environ["EPI_SEED"] = str(recorded.data["seed"])
+    current = manifests.Manifest() if manifests.enabled() else None
+    mismatched = 0
+    for step in recorded.steps:
+        if stale_only and manifests.still_valid(step):
+            print(f"\n===== {step['command']} (up to date) =====")
+            continue
+        print(f"\n===== {step['command']} {' '.join(step['argv'])} =====")
+        run(step["command"], step["argv"], step["no_plots"], manifest=current)
+        for path, status in manifests.check_files(step["outputs"]).items():
+            if status != "ok":
+                mismatched += 1
+                print(f"  {path}: {status} vs {recorded.data['run_id']}")
+    print(f"\nReplayed {recorded.path}: {mismatched} output(s) differ from the recorded hashes")
+    if mismatched:
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Opioid dispensing network pipeline")
+    parser.add_argument("--no-plots", action="store_true", help="skip matplotlib and plot-only steps")
+    parser.add_argument("--seed", type=int, default=None, help="run seed (default EPI_SEED or 0)")
+    parser.add_argument("--cached", action="store_true", help="skip steps whose manifest entry is still valid")
+    parser.add_argument("command", choices=sorted(COMMANDS) + ["all", "list", "replay"])
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="options passed to the command")
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        os.environ["EPI_SEED"] = str(args.seed)
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+
+    if args.command == "list":
+        for name, spec in COMMANDS.items():
+            print(f"  {name:<20} {spec.area}/{spec.module}.py  {spec.help}")
+        return
+
+    if args.command == "replay":
+        if not args.args:
+            raise SystemExit("replay needs a manifest path, run id or 'last'")
+        replay(args.args[0], stale_only="--stale" in args.args[1:])
+        return
+
+    from common import manifest as manifests
+    manifest = manifests.Manifest() if manifests.enabled() and args.command not in UNRECORDED else None
+
+    if args.command == "all":
+        for name in PIPELINE:
+            print(f"\n===== {name} =====")
+            run(name, no_plots=args.no_plots, manifest=manifest, cached=args.cached)
+    else:
+        run(args.command, args.args, no_plots=args.no_plots, manifest=manifest, cached=args.cached)
+    if manifest is not None and manifest.steps:
+        print(f"\nManifest: {manifest.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Out-of-core aggregation of prescriber/ZIP-level extracts to FIPS x period rates.
+
+Extracts are far larger than memory, so they are never loaded whole:
+- chunked: pandas reads only the needed columns in chunks, applies the state /
+           year filters to each chunk as it arrives, reduces it to partial
+           FIPS x period sums and spills those partials to disk once they pass
+           a row budget
+- duckdb:  (optional, if installed) the same query runs inside DuckDB, which
+           pushes the filters into the CSV/Parquet scan and spills to its own
+           temp directory under a memory limit
+
+Both return the schema of data/processed/dispensing_county_year.csv, so the
+result feeds the county network and regression stages unchanged. CSV and
+Parquet extracts are both streamed: Parquet in record batches of the needed
+columns through pyarrow.dataset, with the state / year filters pushed down so
+row groups whose statistics exclude them are never read; CSV in pandas chunks.
+Spilled partials are folded back into one running aggregate a file at a time,
+so peak memory is the result plus one partial.
+
+Expected extract columns (names configurable via EXTRACT_COLUMNS):
+  FIPS, STATE_ABBREV, YEAR, [QUARTER | MONTH], prescriptions, population, [COUNTY_NAME]
+The rate is 100 * sum(prescriptions) / population, i.e. per 100 persons.
+
+`population` says what the population column holds on each row:
+- county  the row's county population, repeated on every row of a FIPS x
+          period (default); it must be constant there, which is checked, since
+          summing it over prescriber rows would deflate the rate and taking
+          the largest of several sub-county values would inflate it
+- sum     a sub-county population (e.g. one row per ZIP code), so the county
+          population is the sum over its rows
+"""
+
+import os
+import shutil
+import tempfile
+import pandas as pd
+import numpy as np
+
+EXTRACT_COLUMNS = {
+    "fips": "FIPS",
+    "state": "STATE_ABBREV",
+    "year": "YEAR",
+    "count": "prescriptions",
+    "population": "population",
+    "name": "COUNTY_NAME",
+}
+CHUNK_ROWS = 1_000_000
+SPILL_ROWS = 2_000_000
+POPULATION_MODES = ("county", "sum")
+# tolerance for "the same county population" on every row of a key
+POPULATION_RTOL = 1e-6
+
+
+def _dataset(path):
+    try:
+        import pyarrow.dataset as ds
+    except ImportError as exc:
+        raise ImportError("Parquet extracts need pyarrow (pip install pyarrow); or convert the extract to CSV") from exc
+    return ds, ds.dataset(path, format="parquet")
+
+
+def _header(path):
+    if path.endswith(".parquet"):
+        return _dataset(path)[1].schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def _predicate(ds, columns, states, start_year, end_year):
+    """The state / year filters as a pyarrow expression (None without filters)."""
+    terms = []
+    if states:
+        terms.append(ds.field(columns["state"]).isin(list(states)))
+    if start_year is not None:
+        terms.append(ds.field(columns["year"]) >= int(start_year))
+    if end_year is not None:
+        terms.append(ds.field(columns["year"]) <= int(end_year))
+    predicate = None
+    for term in terms:
+        predicate = term if predicate is None else predicate & term
+    return predicate
+
+
+def _chunks(path, usecols, chunk_rows, columns, states=None, start_year=None, end_year=None):
+    """
+    The extract's needed columns in chunks of at most `chunk_rows` rows (FIPS
+    as strings); Parquet scans skip row groups and rows outside the filters.
+    """
+    fips_col = columns["fips"]
+    if path.endswith(".parquet"):
+        ds, dataset = _dataset(path)
+        predicate = _predicate(ds, columns, states, start_year, end_year)
+        for batch in dataset.to_batches(columns=usecols, filter=predicate, batch_size=chunk_rows):
+            chunk = batch.to_pandas()
+            fips = chunk[fips_col]
+            if pd.api.types.is_numeric_dtype(fips):
+                fips = fips.astype("Int64")
+            yield chunk.assign(**{fips_col: fips.astype(str)})
+    else:
+        yield from pd.read_csv(path, usecols=usecols, chunksize=chunk_rows, dtype={fips_col: str})
+
+
+def _keys(header, columns):
+    """Group keys present in the extract: FIPS, state and the period columns."""
+    period = [columns["year"]] + [c for c in ("QUARTER", "MONTH") if c in header][:1]
+    return [columns["fips"], columns["state"]] + period
+
+
+def _filter(chunk, columns, states, start_year, end_year):
+    mask = np.ones(len(chunk), dtype=bool)
+    if states:
+        mask &= chunk[columns["state"]].isin(states).to_numpy()
+    year = chunk[columns["year"]]
+    if start_year is not None:
+        mask &= (year >= start_year).to_numpy()
+    if end_year is not None:
+        mask &= (year <= end_year).to_numpy()
+    return chunk[mask]
+
+
+def _reduce(frames, keys, columns, population="county"):
+    """
+    Merge partial aggregates: counts add up; population adds up too in "sum"
+    mode, else its smallest and largest value per key are kept for `_check_population`.
+    """
+    pop = columns["population"]
+    frame = pd.concat(frames, ignore_index=True)
+    agg = {columns["count"]: "sum"}
+    if population == "sum":
+        agg[pop] = "sum"
+    else:
+        if "_population_min" not in frame.columns:
+            frame["_population_min"] = frame[pop]
+        agg[pop] = "max"
+        agg["_population_min"] = "min"
+    if columns["name"] in frame.columns:
+        agg[columns["name"]] = "last"
+    return frame.groupby(keys, as_index=False).agg(agg)
+
+
+def _check_population(agg, keys, columns):
+    """In "county" mode every row of a key must carry the same population; drops the helper column."""
+    pop = columns["population"]
+    low, high = agg.pop("_population_min"), agg[pop]
+    varies = (high - low).abs() > POPULATION_RTOL * high.abs()
+    if varies.any():
+        example = agg.loc[varies.idxmax(), keys].to_dict()
+        raise ValueError(
+            f"{int(varies.sum())} county-periods have rows with different {pop!r} values "
+            f"(e.g. {example}: {low[varies.idxmax()]:g} to {high[varies.idxmax()]:g}); if the column holds "
+            f"sub-county populations, aggregate with population='sum' (--population sum)")
+    return agg
+
+
+def aggregate_chunked(path, states=None, start_year=None, end_year=None, columns=EXTRACT_COLUMNS,
+                      population="county", chunk_rows=CHUNK_ROWS, spill_rows=SPILL_ROWS, spill_dir=None):
+    if population not in POPULATION_MODES:
+        raise ValueError(f"unknown population mode {population!r}; expected one of {POPULATION_MODES}")
+    header = _header(path)
+    keys = _keys(header, columns)
+    usecols = keys + [columns["count"], columns["population"]]
+    if columns["name"] in header:
+        usecols.append(columns["name"])
+
+    owns_spill = spill_dir is None
+    spill_dir = spill_dir or tempfile.mkdtemp(prefix="county_extract_")
+    spilled = []
+    partials = []
+    buffered = 0
+    rows_read = rows_kept = 0
+
+    try:
+        for chunk in _chunks(path, usecols, chunk_rows, columns, states, start_year, end_year):
+            rows_read += len(chunk)
+            chunk = _filter(chunk, columns, states, start_year, end_year)
+            if chunk.empty:
+                continue
+            rows_kept += len(chunk)
+            partials.append(_reduce([chunk], keys, columns, population))
+            buffered += len(partials[-1])
+
+            if buffered >= spill_rows:
+                spill_path = os.path.join(spill_dir, f"partial_{len(spilled):05d}.csv")
+                _reduce(partials, keys, columns, population).to_csv(spill_path, index=False)
+                spilled.append(spill_path)
+                partials, buffered = [], 0
+
+        print(f"  Read {rows_read} rows, kept {rows_kept}, spilled {len(spilled)} partial file(s)")
+        if not partials and not spilled:
+            return pd.DataFrame(columns=keys)
+        # fold the spill files into the running aggregate one at a time
+        agg = _reduce(partials, keys, columns, population) if partials else None
+        for spill_path in spilled:
+            spill = pd.read_csv(spill_path, dtype={columns["fips"]: str})
+            agg = _reduce([spill] if agg is None else [agg, spill], keys, columns, population)
+        return agg if population == "sum" else _check_population(agg, keys, columns)
+    finally:
+        if owns_spill:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def aggregate_duckdb(path, states=None, start_year=None, end_year=None, columns=EXTRACT_COLUMNS,
+                     population="county", memory_limit="2GB", spill_dir=None):
+    import duckdb
+
+    if population not in POPULATION_MODES:
+        raise ValueError(f"unknown population mode {population!r}; expected one of {POPULATION_MODES}")
+    scan = "read_parquet(?)" if path.endswith(".parquet") else "read_csv_auto(?, types={'%s': 'VARCHAR'})" % columns["fips"]
+    con = duckdb.connect()
+    try:
+        # DuckDB reads the header itself, so Parquet does not need pyarrow here
+        header = con.execute(f"SELECT * FROM {scan} LIMIT 0", [path]).df().columns.tolist()
+    except Exception:
+        con.close()
+        raise
+    keys = _keys(header, columns)
+
+    where, params = [], [path]
+    if states:
+        where.append(f"{columns['state']} IN ({', '.join('?' for _ in states)})")
+        params.extend(states)
+    if start_year is not None:
+        where.append(f"{columns['year']} >= ?")
+        params.append(int(start_year))
+    if end_year is not None:
+        where.append(f"{columns['year']} <= ?")
+        params.append(int(end_year))
+
+    pop = columns["population"]
+    select = keys + [f"SUM({columns['count']}) AS {columns['count']}"]
+    if population == "sum":
+        select.append(f"SUM({pop}) AS {pop}")
+    else:
+        select += [f"MAX({pop}) AS {pop}", f"MIN({pop}) AS _population_min"]
+    if columns["name"] in header:
+        select.append(f"LAST({columns['name']}) AS {columns['name']}")
+    query = f"SELECT {', '.join(select)} FROM {scan}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += f" GROUP BY {', '.join(keys)}"
+
+    try:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+        con.execute(f"SET temp_directory = '{spill_dir or tempfile.gettempdir()}'")
+        agg = con.execute(query, params).df()
+    finally:
+        con.close()
+    return agg if population == "sum" else _check_population(agg, keys, columns)
+
+
+def to_county_panel(agg, columns=EXTRACT_COLUMNS):
+    """Rename aggregated extract columns to the processed county panel schema."""
+    df = agg.rename(columns={
+        columns["fips"]: "FIPS",
+        columns["state"]: "STATE_ABBREV",
+        columns["year"]: "YEAR",
+        columns["name"]: "COUNTY_NAME",
+    })
+    pop = df[columns["population"]].astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        df["opioid_dispensing_rate"] = np.where(pop > 0, 100.0 * df[columns["count"]] / pop, np.nan)
+    if "COUNTY_NAME" not in df.columns:
+        df["COUNTY_NAME"] = ""
+    df["FIPS"] = df["FIPS"].astype(str).str.zfill(5)
+    period = ["YEAR"] + [c for c in ("QUARTER", "MONTH") if c in df.columns]
+    return df[period + ["STATE_ABBREV", "COUNTY_NAME", "FIPS", "opioid_dispensing_rate"]]
+
+
+def aggregate_extract(path, engine="chunked", **kwargs):
+    """FIPS x period county panel from a prescriber-level extract."""
+    if engine == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            print("  duckdb is not installed; falling back to the chunked reader.")
+            engine = "chunked"
+            kwargs = {k: v for k, v in kwargs.items() if k != "memory_limit"}
+    if engine == "duckdb":
+        agg = aggregate_duckdb(path, **kwargs)
+    else:
+        agg = aggregate_chunked(path, **kwargs)
+    return to_county_panel(agg, kwargs.get("columns", EXTRACT_COLUMNS))
@@ -1,22 +1,14 @@
+import os
+import sys
 import pandas as pd
 import re
 from pathlib import Path
 
-STATE_NAMES = {
-    'AK': 'Alaska', 'AL': 'Alabama', 'AR': 'Arkansas', 'AZ': 'Arizona',
-    'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DC': 'District of Columbia',
-    'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii',
-    'IA': 'Iowa', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana',
-    'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana', 'MA': 'Massachusetts',
-    'MD': 'Maryland', 'ME': 'Maine', 'MI': 'Michigan', 'MN': 'Minnesota',
-    'MO': 'Missouri', 'MS': 'Mississippi', 'MT': 'Montana', 'NC': 'North Carolina',
-    'ND': 'North Dakota', 'NE': 'Nebraska', 'NH': 'New Hampshire', 'NJ': 'New Jersey',
-    'NM': 'New Mexico', 'NV': 'Nevada', 'NY': 'New York', 'OH': 'Ohio',
-    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island',
-    'SC': 'South Carolina', 'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas',
-    'UT': 'Utah', 'VA': 'Virginia', 'VT': 'Vermont', 'WA': 'Washington',
-    'WI': 'Wisconsin', 'WV': 'West Virginia', 'WY': 'Wyoming'
-}
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import geography
+from common.crosswalk import display_name, title_case
+
+STATE_NAMES = geography.state_names()
 
 def parse_txt_file(filepath, year):
     print(f"Processing {filepath} for year {year}...")
@@ -82,12 +74,8 @@ def parse_txt_file(filepath, year):
             if rate == '–' or rate == '' or rate == 'Data unavailable':
                 rate = 'Data unavailable'
             
-            county_name_parts = county_name.split()
-            county_name_proper = ' '.join(word.capitalize() if word.upper() == word else word for word in county_name_parts)
-            
-            county_full = county_name_proper
-            if not any(suffix in county_full for suffix in ['County', 'Census Area', 'Borough', 'Parish', 'City', 'Municipality']):
-                county_full = f"{county_name_proper} County"
+            county_name_proper = title_case(county_name)
+            county_full = display_name(county_name)
             
             try:
                 fips_int = int(fips_code)
@@ -1,13 +1,29 @@
 import os
+import sys
+import argparse
 import pandas as pd
 import numpy as np
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import crosswalk, geography
+from common.periods import period_columns
+from common.metric_panel import DEFAULT_METRIC, PANELS, is_additive
+from validate_county_data import scan_county_panel, print_summary, write_report
+from aggregate_extract import POPULATION_MODES, aggregate_extract
+from common.instrument import instrumented, stage, current_stage
+
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 DATA = os.path.join(PROJECT_ROOT, "data", "raw")
 PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+METRICS_DIR = os.path.join(DATA, "metrics")
 os.makedirs(PROC, exist_ok=True)
 
+# identifier columns in metric files; every other numeric column is a metric
+ID_COLUMNS = {"STATE_ABBREV", "STATE_NAME", "STATE_FIPS", "COUNTY_NAME", "STATE_COUNTY_FIP_U", "FIPS",
+              "YEAR", "QUARTER", "MONTH"}
+
+@instrumented("prep.process_state_data")
 def process_state_data():
     print("Processing State Data...")
     cdc_early = pd.read_csv(os.path.join(DATA, "State_Opioid_Dispensing_Rates_2006_2018.csv"))
@@ -22,7 +38,8 @@ def process_state_data():
     cdc_late = cdc_late[cdc_late["STATE_NAME"] != "United States"]
     cdc_late["opioid_dispensing_rate"] = pd.to_numeric(cdc_late["opioid_dispensing_rate"], errors="coerce")
 
-    cols = ["YEAR", "STATE_NAME", "STATE_ABBREV", "STATE_FIPS", "opioid_dispensing_rate"]
+    keys = period_columns(cdc_early)
+    cols = keys + ["STATE_NAME", "STATE_ABBREV", "STATE_FIPS", "opioid_dispensing_rate"]
     
     for df in [cdc_early, cdc_late]:
         for c in cols:
@@ -34,17 +51,34 @@ def process_state_data():
     
     cdc_all = pd.concat([cdc_early, cdc_late], ignore_index=True)
     
-    cdc_all = cdc_all.dropna(subset=["YEAR", "STATE_ABBREV", "opioid_dispensing_rate"]).copy()
-    cdc_all["YEAR"] = cdc_all["YEAR"].astype(int)
+    cdc_all = cdc_all.dropna(subset=keys + ["STATE_ABBREV", "opioid_dispensing_rate"]).copy()
+    cdc_all[keys] = cdc_all[keys].astype(int)
     
-    cdc_all = cdc_all.sort_values(["STATE_ABBREV", "YEAR"]).drop_duplicates(["STATE_ABBREV", "YEAR"], keep="last")
+    cdc_all = cdc_all.sort_values(["STATE_ABBREV"] + keys).drop_duplicates(["STATE_ABBREV"] + keys, keep="last")
     
     out_path = os.path.join(PROC, "dispensing_state_year.csv")
     cdc_all.to_csv(out_path, index=False)
+    current_stage().count(rows=len(cdc_all))
     print(f"Saved merged state data to {out_path}")
 
-def process_county_data():
+@instrumented("prep.process_county_data")
+def process_county_data(extract_path=None, engine="chunked", states=None, start_year=None, end_year=None,
+                        population="county"):
     print("Processing County Data...")
+    if extract_path is not None:
+        print(f"Aggregating prescriber extract {extract_path} (engine={engine})...")
+        with stage(f"prep.aggregate_extract_{engine}") as rec:
+            df = aggregate_extract(extract_path, engine=engine, states=states,
+                                   start_year=start_year, end_year=end_year, population=population)
+            rec.count(rows=len(df))
+        keys = period_columns(df)
+        df = canonical_counties(df.dropna(subset=["opioid_dispensing_rate"]), keys).sort_values(["FIPS"] + keys)
+        out_path = os.path.join(PROC, "dispensing_county_year.csv")
+        df.to_csv(out_path, index=False)
+        write_county_units(df)
+        print(f"Saved {len(df)} aggregated county-period rows to {out_path}")
+        return
+
     county_path = os.path.join(DATA, "County Opioid Dispensing Rates_Complete.csv")
     
     if not os.path.exists(county_path):
@@ -53,12 +87,19 @@ def process_county_data():
 
     df = pd.read_csv(county_path)
     
+    with stage("prep.scan_county_panel", rows=len(df)) as rec:
+        report, coverage = scan_county_panel(df)
+        rec.count(flagged=len(report))
+    print_summary(report, coverage)
+    write_report(report, coverage)
+    
     df["opioid_dispensing_rate"] = pd.to_numeric(df["opioid_dispensing_rate"], errors="coerce")
     
     df["STATE_COUNTY_FIP_U"] = pd.to_numeric(df["STATE_COUNTY_FIP_U"], errors='coerce').fillna(0).astype(int)
     df["FIPS"] = df["STATE_COUNTY_FIP_U"].astype(str).str.zfill(5)
     
-    cols = ["YEAR", "STATE_ABBREV", "COUNTY_NAME", "FIPS", "opioid_dispensing_rate"]
+    keys = period_columns(df)
+    cols = keys + ["STATE_ABBREV", "COUNTY_NAME", "FIPS", "opioid_dispensing_rate"]
     
     missing_cols = [c for c in cols if c not in df.columns and c != "FIPS"]
     if missing_cols:
@@ -67,20 +108,139 @@ def process_county_data():
     df = df[cols]
     
     initial_len = len(df)
-    df = df.dropna(subset=["opioid_dispensing_rate", "FIPS", "YEAR"])
+    df = df.dropna(subset=["opioid_dispensing_rate", "FIPS"] + keys)
     dropped_len = initial_len - len(df)
     if dropped_len > 0:
         print(f"Dropped {dropped_len} rows with missing dispensing rates or FIPS.")
 
-    df["YEAR"] = df["YEAR"].astype(int)
-    df = df.sort_values(["FIPS", "YEAR"])
+    df[keys] = df[keys].astype(int)
+    df = canonical_counties(df, keys).sort_values(["FIPS"] + keys)
     
     out_path = os.path.join(PROC, "dispensing_county_year.csv")
     df.to_csv(out_path, index=False)
+    write_county_units(df)
+    current_stage().count(rows=len(df))
     print(f"Saved processed county data to {out_path}")
 
-if __name__ == "__main__":
-    process_state_data()
-    process_county_data()
+def canonical_counties(df, keys, value_cols=("opioid_dispensing_rate",)):
+    """County rows on the canonical geography of data/reference/fips_crosswalk.csv (see common/crosswalk.py)."""
+    additive = [c for c in value_cols if is_additive(c)]
+    df, recoded = crosswalk.canonicalize(df, keys, list(value_cols), weights=population_weights(), additive=additive)
+    if recoded:
+        print(f"Mapped {recoded} rows with retired / superseded FIPS onto their canonical counties.")
+    return df
+
+def population_weights():
+    population = geography.county_population()
+    return pd.Series(population.to_numpy(), index=crosswalk.fips_code(population.index))
+
+def write_county_units(df):
+    """The canonical county registry with dense UNIT_IDs (data/processed/county_units.csv)."""
+    units = crosswalk.unit_registry(df)
+    units.to_csv(crosswalk.COUNTY_UNITS_PATH, index=False)
+    print(f"Saved {len(units)} canonical counties to {crosswalk.COUNTY_UNITS_PATH}")
+
+def read_metric_file(path):
+    """
+    (level, period keys, long frame of unit / period / metric / value) for one
+    metric CSV, or None if it has no unit column.
+
+    Files are either wide (one numeric column per metric, e.g. overdose_deaths,
+    population, mme_per_capita) or long (`metric` and `value` columns), keyed by
+    FIPS (or STATE_COUNTY_FIP_U) for counties or STATE_ABBREV for states, plus
+    YEAR and optionally QUARTER / MONTH.
+    """
+    df = pd.read_csv(path)
+    if "FIPS" not in df.columns and "STATE_COUNTY_FIP_U" in df.columns:
+        df["FIPS"] = df["STATE_COUNTY_FIP_U"]
+    if "FIPS" in df.columns:
+        level = "county"
+        fips = pd.to_numeric(df["FIPS"], errors="coerce")
+        df = df[fips.notna()].assign(FIPS=fips.dropna().astype(int).astype(str).str.zfill(5))
+    elif "STATE_ABBREV" in df.columns:
+        level = "state"
+    else:
+        print(f"Warning: {os.path.basename(path)} has no FIPS / STATE_ABBREV column; skipped")
+        return None
+    keys = [PANELS[level]["unit"]] + period_columns(df)
 
+    if {"metric", "value"} <= set(df.columns):
+        long = df[keys + ["metric", "value"]]
+    else:
+        value_cols = [c for c in df.columns if c not in ID_COLUMNS and pd.api.types.is_numeric_dtype(df[c])]
+        long = df.melt(id_vars=keys, value_vars=value_cols, var_name="metric", value_name="value")
+    long = long.assign(value=pd.to_numeric(long["value"], errors="coerce")).dropna(subset=keys + ["value"])
+    long[keys[1:]] = long[keys[1:]].astype(int)
+    return level, keys, long
 
+
+@instrumented("prep.process_metric_files")
+def process_metric_files(metrics_dir=METRICS_DIR):
+    """Merge every CSV in `metrics_dir` into one wide metrics_{level}_year.csv per level."""
+    if not os.path.isdir(metrics_dir):
+        return
+    files = sorted(f for f in os.listdir(metrics_dir) if f.lower().endswith(".csv"))
+    if not files:
+        return
+    print(f"Processing {len(files)} metric file(s) from {metrics_dir}...")
+
+    by_level = {}
+    for name in files:
+        parsed = read_metric_file(os.path.join(metrics_dir, name))
+        if parsed is None:
+            continue
+        level, keys, long = parsed
+        known_keys, frames = by_level.setdefault(level, (keys, []))
+        if keys != known_keys:
+            print(f"Warning: {name} is keyed by {keys}, other {level} metrics by {known_keys}; skipped")
+            continue
+        frames.append(long)
+
+    for level, (keys, frames) in by_level.items():
+        long = pd.concat(frames, ignore_index=True)
+        if (long["metric"] == DEFAULT_METRIC).any():
+            print(f"Note: {DEFAULT_METRIC} in metric files is ignored; it comes from the dispensing data")
+            long = long[long["metric"] != DEFAULT_METRIC]
+        wide = long.drop_duplicates(keys + ["metric"], keep="last") \
+            .pivot(index=keys, columns="metric", values="value").reset_index().sort_values(keys)
+        wide.columns.name = None
+        if level == "county":
+            # merged units sum count metrics and population-weight the rates (common/crosswalk.py)
+            metrics = [c for c in wide.columns if c not in keys]
+            wide = canonical_counties(wide, keys[1:], metrics).sort_values(keys)
+        out_path = os.path.join(PROC, PANELS[level]["metrics"])
+        wide.to_csv(out_path, index=False)
+        current_stage().count(**{f"{level}_rows": len(wide)})
+        metrics = [c for c in wide.columns if c not in keys]
+        print(f"Saved {len(wide)} {level}-period rows with metrics {metrics} to {out_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--extract", default=None, help="prescriber/ZIP-level extract (CSV or Parquet) to aggregate out of core")
+    parser.add_argument("--engine", choices=["chunked", "duckdb"], default="chunked")
+    parser.add_argument("--states", default=None, help="comma-separated state abbreviations to keep")
+    parser.add_argument("--start_year", type=int, default=None)
+    parser.add_argument("--end_year", type=int, default=None)
+    parser.add_argument("--population", choices=POPULATION_MODES, default="county",
+                        help="extract population per row: the county's (checked constant) or a sub-county share to sum")
+    parser.add_argument("--metrics_dir", default=METRICS_DIR,
+                        help="CSV files with further metrics (overdose deaths, population, MME, ...)")
+    args = parser.parse_args(argv)
+
+    process_state_data()
+    try:
+        process_county_data(
+            extract_path=args.extract,
+            engine=args.engine,
+            states=args.states.split(",") if args.states else None,
+            start_year=args.start_year,
+            end_year=args.end_year,
+            population=args.population,
+        )
+    except ImportError as exc:
+        raise SystemExit(str(exc))
+    process_metric_files(args.metrics_dir)
+
+if __name__ == "__main__":
+    main()
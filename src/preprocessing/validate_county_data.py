@@ -0,0 +1,170 @@
+"""
+Data-quality and anomaly scan over the raw county panel.
+
+Runs on the raw county CSV before prepare_data.py coerces it, so problems that
+are otherwise silently dropped or zero-filled are reported up front:
+- invalid FIPS (non-numeric / zero -> the bogus '00000' key)
+- FIPS collisions (one FIPS used for several states or county names across years)
+- recoded units (one county name that appears under several FIPS)
+- retired FIPS (codes data/reference/fips_crosswalk.csv maps onto another unit;
+  prepare_data.py folds them into the canonical one)
+- duplicated (FIPS, YEAR) keys
+- coverage gaps (years a county is missing from the panel)
+- unparseable rates ('Data unavailable', blanks, dashes)
+- year-over-year rate jumps beyond a robust z-score limit
+
+Outputs:
+- outputs/county_data_quality.csv       - one row per flagged FIPS
+- outputs/county_year_coverage.csv      - per-year row / county / missing-rate counts
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, current_stage
+from common.crosswalk import canonical_fips, name_key, retired
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data", "raw")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+Z_LIMIT = 5.0
+
+
+def robust_jump_z(df):
+    """
+    Robust z-score of the year-over-year log change in rate.
+
+    Each change is compared against the median / MAD of all county changes in the
+    same year, so a nationwide shift does not flag every county.
+    """
+    log_rate = np.log(df["rate"].where(df["rate"] > 0))
+    step = df["YEAR"].diff()
+    same_unit = df["FIPS"].eq(df["FIPS"].shift())
+    change = log_rate.diff().where(same_unit & step.eq(1))
+
+    by_year = change.groupby(df["YEAR"])
+    center = by_year.transform("median")
+    mad = (change - center).abs().groupby(df["YEAR"]).transform("median")
+    return 0.6745 * (change - center) / mad.replace(0, np.nan)
+
+
+def scan_county_panel(raw, z_limit=Z_LIMIT):
+    """
+    Vectorised validation of the raw county panel.
+
+    Returns (report, coverage): report has one row per FIPS with at least one issue,
+    coverage has one row per year.
+    """
+    fips_num = pd.to_numeric(raw["STATE_COUNTY_FIP_U"], errors="coerce")
+    df = pd.DataFrame({
+        "YEAR": pd.to_numeric(raw["YEAR"], errors="coerce"),
+        "STATE_ABBREV": raw["STATE_ABBREV"],
+        "COUNTY_NAME": raw["COUNTY_NAME"],
+        "FIPS": fips_num.fillna(0).astype(int).astype(str).str.zfill(5),
+        "rate": pd.to_numeric(raw["opioid_dispensing_rate"], errors="coerce"),
+    })
+    df["invalid_fips"] = fips_num.isna() | (fips_num <= 0)
+    df["missing_rate"] = df["rate"].isna()
+    df["name_key"] = name_key(df["COUNTY_NAME"])
+    df["retired"] = retired(fips_num)
+
+    df = df.sort_values(["FIPS", "YEAR"], kind="stable").reset_index(drop=True)
+    df["abs_jump_z"] = robust_jump_z(df).abs()
+    df["jump"] = df["abs_jump_z"] > z_limit
+
+    recoded = df.groupby(["STATE_ABBREV", "name_key"])["FIPS"].transform("nunique") > 1
+    df["recoded"] = recoded & ~df["invalid_fips"]
+
+    years = np.sort(df["YEAR"].dropna().unique())
+    report = df.groupby("FIPS").agg(
+        STATE_ABBREV=("STATE_ABBREV", "last"),
+        COUNTY_NAME=("COUNTY_NAME", "last"),
+        n_rows=("YEAR", "size"),
+        n_years=("YEAR", "nunique"),
+        first_year=("YEAR", "min"),
+        last_year=("YEAR", "max"),
+        n_states=("STATE_ABBREV", "nunique"),
+        n_names=("name_key", "nunique"),
+        invalid_fips=("invalid_fips", "any"),
+        recoded=("recoded", "any"),
+        retired=("retired", "any"),
+        missing_rates=("missing_rate", "sum"),
+        rate_jumps=("jump", "sum"),
+        max_jump_z=("abs_jump_z", "max"),
+    )
+    report["duplicate_keys"] = report["n_rows"] - report["n_years"]
+    report["coverage_gaps"] = len(years) - report["n_years"]
+    report["collision"] = (report["n_states"] > 1) | (report["n_names"] > 1)
+
+    checks = {
+        "invalid_fips": report["invalid_fips"],
+        "collision": report["collision"] & ~report["invalid_fips"],
+        "recoded": report["recoded"],
+        "retired_fips": report["retired"],
+        "duplicate_keys": report["duplicate_keys"] > 0,
+        "coverage_gap": report["coverage_gaps"] > 0,
+        "missing_rates": report["missing_rates"] > 0,
+        "rate_jump": report["rate_jumps"] > 0,
+    }
+    flags = pd.DataFrame(checks)
+    report["issues"] = flags.apply(lambda row: ";".join(flags.columns[row.to_numpy()]), axis=1)
+    report = report[flags.any(axis=1)].reset_index()
+    report["canonical_fips"] = pd.Series(canonical_fips(report["FIPS"])).map("{:05d}".format).where(
+        report["retired"].to_numpy(), "").to_numpy()
+
+    coverage = df.groupby("YEAR").agg(
+        rows=("FIPS", "size"),
+        counties=("FIPS", "nunique"),
+        missing_rates=("missing_rate", "sum"),
+        invalid_fips=("invalid_fips", "sum"),
+        rate_jumps=("jump", "sum"),
+    ).reset_index()
+    coverage["YEAR"] = coverage["YEAR"].astype(int)
+    coverage["counties_vs_max"] = coverage["counties"] - coverage["counties"].max()
+    return report, coverage
+
+
+def print_summary(report, coverage):
+    print("-" * 50)
+    print("COUNTY DATA QUALITY")
+    print("-" * 50)
+    counts = report["issues"].str.split(";").explode().value_counts()
+    if counts.empty:
+        print("No issues found.")
+    else:
+        print("Counties flagged per check:")
+        print(counts.to_string())
+    print("\nCoverage by year:")
+    print(coverage.to_string(index=False))
+    print("-" * 50)
+
+
+def write_report(report, coverage):
+    report_path = os.path.join(OUT, "county_data_quality.csv")
+    report.to_csv(report_path, index=False)
+    coverage.to_csv(os.path.join(OUT, "county_year_coverage.csv"), index=False)
+    print(f"Saved data-quality report ({len(report)} flagged counties) to {report_path}")
+
+
+@instrumented("prep.validate_county_data")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--z_limit", type=float, default=Z_LIMIT)
+    args = parser.parse_args(argv)
+
+    raw = pd.read_csv(os.path.join(DATA, "County Opioid Dispensing Rates_Complete.csv"))
+    report, coverage = scan_county_panel(raw, z_limit=args.z_limit)
+    current_stage().count(rows=len(raw), flagged=len(report))
+    print_summary(report, coverage)
+    write_report(report, coverage)
+
+
+if __name__ == "__main__":
+    main()
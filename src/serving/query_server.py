@@ -0,0 +1,344 @@
+"""
+Local HTTP query API over the pipeline outputs.
+
+The ranking, edge and forecast CSVs are loaded once into indexed tables (row
+positions grouped by state / FIPS), so a query is a dictionary lookup and a
+slice instead of a full CSV parse. Encoded responses are cached per artifact
+generation and carry an ETag, so polling dashboards get a 304 when nothing
+changed. A background task watches the artifact files and hot-reloads them
+when the pipeline writes new outputs; a reload that fails (e.g. on a file
+caught mid-write) keeps the previous tables and is retried on the next poll.
+
+Endpoints (GET, JSON):
+- /influencers?state=TX&year=2012&k=10  top-k influential counties in a state,
+                                        restricted to counties already high by
+                                        `year`; without `state`, top-k states
+- /edges?fips=48037                     a county's incoming and outgoing edges
+- /edges?state=TN                       a state's incoming and outgoing edges
+- /forecast?fips=1001[&year=2018]       county next-year forecasts
+- /forecast?state=AL[&year=2018]        state next-year forecasts
+- /status                               loaded artifacts and row counts
+
+Usage:
+    python src/serving/query_server.py [--host 127.0.0.1] [--port 8050] [--poll 2]
+"""
+
+import os
+import json
+import asyncio
+import argparse
+import hashlib
+from urllib.parse import urlsplit, parse_qs
+import pandas as pd
+import numpy as np
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+PROC = os.path.join(PROJECT_ROOT, "data", "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+
+THRESHOLD = 87.35
+DEFAULT_K = 10
+CACHE_SIZE = 1024
+
+ARTIFACTS = {
+    "state_rankings": os.path.join(OUT, "state_influence_rankings.csv"),
+    "state_edges": os.path.join(OUT, "influence_edges.csv"),
+    "state_forecasts": os.path.join(OUT, "continuous_prediction_results.csv"),
+    "state_adoption": os.path.join(PROC, "adoption_year.csv"),
+    "county_rankings": os.path.join(OUT, "county_influence_rankings.csv"),
+    "county_edges": os.path.join(OUT, "county_influence_edges.csv"),
+    "county_forecasts": os.path.join(OUT, "county_prediction_results.csv"),
+    "county_panel": os.path.join(PROC, "dispensing_county_year.csv"),
+}
+
+STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _read(name):
+    path = ARTIFACTS[name]
+    return pd.read_csv(path) if os.path.exists(path) else None
+
+
+def _fips(values):
+    return pd.to_numeric(values, errors="coerce").fillna(-1).astype(int)
+
+
+def _records(frame):
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def artifact_mtimes():
+    return {name: os.path.getmtime(path) if os.path.exists(path) else None for name, path in ARTIFACTS.items()}
+
+
+class ArtifactStore:
+    """Artifact tables plus row-position indices for every query key."""
+
+    def __init__(self):
+        self.mtimes = artifact_mtimes()
+        self.generation = hashlib.sha1(repr(sorted(self.mtimes.items())).encode()).hexdigest()[:12]
+        self.tables = {name: _read(name) for name in ARTIFACTS}
+        self.index = {}
+
+        county_rankings = self.tables["county_rankings"]
+        if county_rankings is not None:
+            county_rankings["FIPS"] = _fips(county_rankings["FIPS"])
+            adoption = self._county_adoption_years()
+            county_rankings["adoption_year"] = county_rankings["FIPS"].map(adoption)
+            county_rankings.sort_values("influence_score", ascending=False, kind="stable", inplace=True)
+            county_rankings.reset_index(drop=True, inplace=True)
+            self.index["county_rankings"] = county_rankings.groupby("STATE_ABBREV").indices
+
+        state_rankings = self.tables["state_rankings"]
+        if state_rankings is not None:
+            adoption = self.tables["state_adoption"]
+            if adoption is not None:
+                state_rankings["adoption_year"] = state_rankings["STATE_ABBREV"].map(
+                    adoption.set_index("STATE_ABBREV")["adoption_year"])
+            state_rankings.sort_values("Out_Degree_Weight", ascending=False, kind="stable", inplace=True)
+            state_rankings.reset_index(drop=True, inplace=True)
+
+        county_edges = self.tables["county_edges"]
+        if county_edges is not None:
+            county_edges["source_fips"] = _fips(county_edges["source_fips"])
+            county_edges["target_fips"] = _fips(county_edges["target_fips"])
+            self.index["county_out"] = county_edges.groupby("source_fips").indices
+            self.index["county_in"] = county_edges.groupby("target_fips").indices
+
+        state_edges = self.tables["state_edges"]
+        if state_edges is not None:
+            self.index["state_out"] = state_edges.groupby("source").indices
+            self.index["state_in"] = state_edges.groupby("target").indices
+
+        county_forecasts = self.tables["county_forecasts"]
+        if county_forecasts is not None:
+            county_forecasts["FIPS"] = _fips(county_forecasts["FIPS"])
+            self.index["county_forecasts"] = county_forecasts.groupby("FIPS").indices
+
+        state_forecasts = self.tables["state_forecasts"]
+        if state_forecasts is not None:
+            self.index["state_forecasts"] = state_forecasts.groupby("STATE_ABBREV").indices
+
+        # The county panel is only needed for adoption years; keep it out of memory.
+        self.tables["county_panel"] = None
+
+    def _county_adoption_years(self):
+        panel = self.tables["county_panel"]
+        if panel is None:
+            return pd.Series(dtype=float)
+        high = panel[pd.to_numeric(panel["opioid_dispensing_rate"], errors="coerce") > THRESHOLD]
+        return high.groupby(_fips(high["FIPS"]))["YEAR"].min()
+
+    def rows(self, table, index, key):
+        frame = self.tables[table]
+        if frame is None:
+            raise QueryError(404, f"{os.path.basename(ARTIFACTS[table])} has not been generated")
+        positions = self.index[index].get(key, np.array([], dtype=int))
+        return frame.iloc[positions]
+
+    def influencers(self, state=None, year=None, k=DEFAULT_K):
+        if state:
+            if self.tables["county_rankings"] is None:
+                raise QueryError(404, "county_influence_rankings.csv has not been generated")
+            ranked = self.rows("county_rankings", "county_rankings", state)
+        else:
+            ranked = self.tables["state_rankings"]
+            if ranked is None:
+                raise QueryError(404, "state_influence_rankings.csv has not been generated")
+        if year is not None and "adoption_year" in ranked.columns:
+            ranked = ranked[ranked["adoption_year"] <= year]
+        return {"state": state, "year": year, "k": k, "results": _records(ranked.head(k))}
+
+    def county_edges(self, fips):
+        return {
+            "fips": fips,
+            "out": _records(self.rows("county_edges", "county_out", fips)),
+            "in": _records(self.rows("county_edges", "county_in", fips)),
+        }
+
+    def state_edges(self, state):
+        return {
+            "state": state,
+            "out": _records(self.rows("state_edges", "state_out", state)),
+            "in": _records(self.rows("state_edges", "state_in", state)),
+        }
+
+    def forecast(self, fips=None, state=None, year=None):
+        if fips is not None:
+            rows = self.rows("county_forecasts", "county_forecasts", fips)
+        else:
+            rows = self.rows("state_forecasts", "state_forecasts", state)
+        if year is not None:
+            rows = rows[rows["YEAR"] == year]
+        if rows.empty:
+            raise QueryError(404, f"no forecast for {fips if fips is not None else state}")
+        return {"fips": fips, "state": state, "results": _records(rows)}
+
+    def status(self):
+        return {
+            "generation": self.generation,
+            "artifacts": {
+                name: {"rows": None if self.tables[name] is None else len(self.tables[name]), "mtime": self.mtimes[name]}
+                for name in ARTIFACTS if name != "county_panel"
+            },
+        }
+
+
+def _param(params, name, cast=str, default=None):
+    values = params.get(name)
+    if not values or values[0] == "":
+        return default
+    try:
+        return cast(values[0])
+    except ValueError:
+        raise QueryError(400, f"invalid value for {name}: {values[0]!r}")
+
+
+def dispatch(store, path, params):
+    """Route a parsed request to the store; returns a JSON-serialisable payload."""
+    if path == "/influencers":
+        k = _param(params, "k", int, DEFAULT_K)
+        state = _param(params, "state", str.upper)
+        return store.influencers(state, _param(params, "year", int), max(k, 0))
+    if path == "/edges":
+        fips = _param(params, "fips", int)
+        if fips is not None:
+            return store.county_edges(fips)
+        state = _param(params, "state", str.upper)
+        if state:
+            return store.state_edges(state)
+        raise QueryError(400, "pass fips= or state=")
+    if path == "/forecast":
+        fips = _param(params, "fips", int)
+        state = _param(params, "state", str.upper)
+        if fips is None and not state:
+            raise QueryError(400, "pass fips= or state=")
+        return store.forecast(fips, state, _param(params, "year", int))
+    if path == "/status":
+        return store.status()
+    raise QueryError(404, f"unknown endpoint {path}")
+
+
+class QueryServer:
+    """asyncio HTTP front end: response cache keyed by (generation, path, query) and a file watcher."""
+
+    def __init__(self, poll_seconds=2.0, cache_size=CACHE_SIZE):
+        self.store = ArtifactStore()
+        self.poll_seconds = poll_seconds
+        self.cache_size = cache_size
+        self.cache = {}
+        self.hits = self.misses = 0
+
+    def respond(self, target):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        key = (self.store.generation, url.path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        try:
+            status, payload = 200, dispatch(self.store, url.path, params)
+        except QueryError as exc:
+            status, payload = exc.status, {"error": str(exc)}
+        body = json.dumps(payload).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = (status, body, etag)
+        return status, body, etag
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if len(parts) != 3:
+            status, body, etag = 400, b'{"error": "malformed request"}', None
+        elif parts[0] != "GET":
+            status, body, etag = 405, b'{"error": "only GET is supported"}', None
+        else:
+            status, body, etag = self.respond(parts[1])
+            if status == 200 and headers.get("if-none-match") == etag:
+                status, body = 304, b""
+
+        head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                "Content-Type: application/json",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        if etag:
+            head.append(f"ETag: {etag}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def watch(self):
+        """Poll artifact mtimes and swap in a freshly loaded store when any of them change."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            if artifact_mtimes() == self.store.mtimes:
+                continue
+            # Let the writer finish before reading, then rebuild off the event loop.
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                store = await loop.run_in_executor(None, ArtifactStore)
+            except Exception as exc:
+                # e.g. a CSV caught mid-write; keep serving the current store and retry next poll
+                print(f"Artifact reload failed ({type(exc).__name__}: {exc}); "
+                      f"still serving generation {self.store.generation}")
+                continue
+            self.store = store
+            self.cache.clear()
+            print(f"Reloaded artifacts (generation {store.generation})")
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        watcher = asyncio.ensure_future(self.watch())
+        print(f"Serving {len(ARTIFACTS)} artifacts on http://{host}:{port} (generation {self.store.generation})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between artifact change checks")
+    args = parser.parse_args(argv)
+
+    print("Loading artifacts...")
+    server = QueryServer(poll_seconds=args.poll)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Bootstrap uncertainty for the influence rankings.
+
+Each replicate resamples calendar years of transitions with replacement (all
+sub-annual transitions of a year move together), rebuilds the decayed influence
+weights and recomputes the centralities behind the ranking files:
+- out_degree:  weighted out-degree (state_ / county_influence_rankings.csv)
+- eigenvector: eigenvector centrality (same power iteration as networkx)
+- betweenness: betweenness centrality (state level only)
+
+Source decay and target transition terms are computed once per panel, so a
+replicate is one reweighted matrix product per state; replicates run in chunks
+on a process pool with independent seeds spawned from --seed. The terms are
+published once in shared memory (--shared shm|mmap, see
+common/shared_panel.py) and every worker attaches to them instead of
+receiving a pickled copy.
+
+Outputs:
+- outputs/{level}_rank_bootstrap.csv: per unit and metric, the point score and
+  rank (method='min'; at state level taken from the same networkx computation
+  as state_influence_rankings.csv), the bootstrap median rank, the rank confidence interval
+  and the probability of being in the top k
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import rankdata
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.partition import Partitioned
+from common.periods import DensePanel, transition_terms
+from common.shared_panel import BACKENDS, SharedArrays, attach
+from common.instrument import instrumented, stage
+from common.manifest import derive_seed
+from common import geography
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+CHUNKS_PER_WORKER = 4
+
+
+class Block:
+    """Precomputed transition terms for one independently built network (a state, or all states)."""
+
+    def __init__(self, dense, high, allowed=None, name=None):
+        self.name = name
+        self.units = dense.units
+        self.decay, new = transition_terms(high, dense.observed, dense.periods_per_year)
+        self.new = new.astype(float)
+        self.years = dense.periods[:-1] // dense.periods_per_year
+        self.labels = dense.labels()
+        self.periods_per_year = dense.periods_per_year
+        self.allowed = allowed
+
+    def arrays(self, prefix):
+        """The arrays a bootstrap worker needs, keyed for a shared store."""
+        units = self.units.astype(str) if self.units.dtype == object else self.units
+        arrays = {f"{prefix}decay": self.decay, f"{prefix}new": self.new, f"{prefix}years": self.years,
+                  f"{prefix}units": units}
+        if self.allowed is not None:
+            arrays[f"{prefix}allowed"] = self.allowed
+        return arrays
+
+    @classmethod
+    def from_store(cls, store, prefix):
+        """A block over the (read-only) arrays of a shared store; no copies."""
+        block = cls.__new__(cls)
+        block.name = block.labels = block.periods_per_year = None
+        block.decay, block.new, block.years = store[f"{prefix}decay"], store[f"{prefix}new"], store[f"{prefix}years"]
+        block.units = store[f"{prefix}units"]
+        block.allowed = store[f"{prefix}allowed"] if f"{prefix}allowed" in store else None
+        return block
+
+    def weights(self, year_counts):
+        """Influence weights with each transition counted as often as its year was drawn."""
+        w = year_counts[self.years]
+        W = (self.decay * w) @ self.new.T
+        np.fill_diagonal(W, 0.0)
+        if self.allowed is not None:
+            W = np.where(self.allowed, W, 0.0)
+        return W
+
+
+def state_blocks():
+    panel = pd.read_csv(os.path.join(PROC, "dispensing_with_is_high.csv"))
+    panel = panel.dropna(subset=["YEAR", "STATE_ABBREV", "is_high"])
+    panel["is_high"] = panel["is_high"].astype(int)
+
+    dense = DensePanel.from_frame(panel, "STATE_ABBREV", "is_high")
+    high = dense.observed & (np.nan_to_num(dense.values) == 1)
+    allowed = geography.states().adjacency_for(dense.units).toarray() > 0
+    return [Block(dense, high, allowed)]
+
+
+def county_blocks():
+    df = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+    blocks = []
+    for state, state_df in Partitioned(df, "STATE_ABBREV").groups():
+        local_threshold = state_df["opioid_dispensing_rate"].quantile(0.75)
+        dense = DensePanel.from_frame(state_df, "FIPS")
+        high = dense.observed & (np.nan_to_num(dense.values) > local_threshold)
+        blocks.append(Block(dense, high, name=state))
+    return blocks
+
+
+def eigenvector_centrality(Ws, max_iter=1000, tol=1e-6):
+    """
+    networkx.eigenvector_centrality over the block-diagonal graph of `Ws`,
+    restricted like networkx to nodes that have at least one edge.
+    """
+    active = [(W != 0).any(axis=0) | (W != 0).any(axis=1) for W in Ws]
+    n = int(sum(a.sum() for a in active))
+    out = [np.zeros(len(a)) for a in active]
+    if n == 0:
+        return np.concatenate(out)
+    Ws = [W[np.ix_(a, a)] for W, a in zip(Ws, active)]
+    x = [np.full(len(W), 1.0 / n) for W in Ws]
+    for _ in range(max_iter):
+        new = [xi + W.T @ xi for W, xi in zip(Ws, x)]
+        norm = np.sqrt(sum((v ** 2).sum() for v in new)) or 1.0
+        new = [v / norm for v in new]
+        delta = sum(np.abs(v - xi).sum() for v, xi in zip(new, x))
+        x = new
+        if delta < n * tol:
+            break
+    for o, a, xi in zip(out, active, x):
+        o[a] = xi
+    return np.concatenate(out)
+
+
+def betweenness_centrality(W, units):
+    import networkx as nx
+
+    G = nx.DiGraph()
+    src, dst = np.nonzero(W)
+    G.add_weighted_edges_from(zip(src.tolist(), dst.tolist(), W[src, dst].tolist()))
+    scores = nx.betweenness_centrality(G, weight="weight")
+    return np.array([scores.get(i, 0.0) for i in range(len(units))])
+
+
+def metrics_for(blocks):
+    return ["out_degree", "eigenvector"] + (["betweenness"] if len(blocks) == 1 else [])
+
+
+def centralities(blocks, year_counts):
+    """{metric: scores over all units of all blocks} for one year weighting."""
+    Ws = [b.weights(year_counts) for b in blocks]
+    scores = {
+        "out_degree": np.concatenate([W.sum(axis=1) for W in Ws]),
+        "eigenvector": eigenvector_centrality(Ws),
+    }
+    if "betweenness" in metrics_for(blocks):
+        scores["betweenness"] = betweenness_centrality(Ws[0], blocks[0].units)
+    return scores
+
+
+def ranks(scores):
+    """Descending ranks with ties at the best rank (method='min'), as in rank_influencers.py."""
+    return rankdata(-scores, method="min").astype(np.int32)
+
+
+def published_point(units):
+    """
+    State point scores exactly as rank_influencers.py computes them (networkx
+    over influence_edges.csv, in its edge order), so the point ranks equal
+    state_influence_rankings.csv even where floating-point noise splits
+    otherwise equal scores; None when the edge file is missing.
+    """
+    from rank_influencers import EDGES_PATH, influence_rankings
+
+    if not os.path.exists(EDGES_PATH):
+        return None
+    table = influence_rankings(pd.read_csv(EDGES_PATH)).set_index("STATE_ABBREV").reindex(units).fillna(0.0)
+    return {"out_degree": table["Out_Degree_Weight"].to_numpy(), "eigenvector": table["Eigenvector"].to_numpy(),
+            "betweenness": table["Betweenness"].to_numpy()}
+
+
+_BLOCKS = None
+
+
+def publish_blocks(blocks, backend="shm"):
+    """One shared store with every block's transition terms."""
+    arrays = {}
+    for i, b in enumerate(blocks):
+        arrays.update(b.arrays(f"{i}/"))
+    return SharedArrays.publish(arrays, {"blocks": len(blocks)}, backend)
+
+
+def _init_worker(handle):
+    global _BLOCKS
+    store = attach(handle)
+    _BLOCKS = [Block.from_store(store, f"{i}/") for i in range(store.meta["blocks"])]
+
+
+def _replicate_chunk(seeds, n_years):
+    """Ranks for one replicate per seed; each draws n_years calendar years with replacement."""
+    out = {m: np.empty((len(seeds), sum(len(b.units) for b in _BLOCKS)), dtype=np.int32)
+           for m in metrics_for(_BLOCKS)}
+    for r, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(n_years, np.full(n_years, 1.0 / n_years))
+        scores = centralities(_BLOCKS, counts)
+        for m in out:
+            out[m][r] = ranks(scores[m])
+    return out
+
+
+def align_years(blocks):
+    """Re-base every block's transition years on a shared 0..n_years-1 calendar; returns n_years."""
+    first = min(b.years.min() for b in blocks)
+    last = max(b.years.max() for b in blocks)
+    for b in blocks:
+        b.years = b.years - first
+    return int(last - first + 1)
+
+
+def bootstrap(blocks, n_years, replicates, seed=0, workers=None, shared="shm"):
+    """{metric: (replicates x units) rank matrix}."""
+    workers = workers or os.cpu_count() or 1
+    # one seed per replicate, so results do not depend on the number of workers
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    n_chunks = min(replicates, workers * CHUNKS_PER_WORKER)
+    chunks = [[seeds[i] for i in c] for c in np.array_split(np.arange(replicates), n_chunks)]
+
+    global _BLOCKS
+    if workers == 1:
+        _BLOCKS = blocks
+        chunks = [_replicate_chunk(c, n_years) for c in chunks]
+    else:
+        with publish_blocks(blocks, shared) as store, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(store.handle,)) as pool:
+            chunks = list(pool.map(_replicate_chunk, chunks, [n_years] * n_chunks))
+    return {m: np.concatenate([c[m] for c in chunks]) for m in chunks[0]}
+
+
+def summarize(units, point, draws, top_k=10, ci=0.95):
+    """Per unit and metric: point rank, bootstrap median and CI, top-k inclusion probability."""
+    lo, hi = (1 - ci) / 2, 1 - (1 - ci) / 2
+    frames = []
+    for metric, R in draws.items():
+        frames.append(pd.DataFrame({
+            "unit": units,
+            "metric": metric,
+            "score": point[metric],
+            "rank": ranks(point[metric]),
+            "rank_median": np.median(R, axis=0),
+            "rank_ci_low": np.quantile(R, lo, axis=0, method="lower"),
+            "rank_ci_high": np.quantile(R, hi, axis=0, method="higher"),
+            f"top{top_k}_prob": (R <= top_k).mean(axis=0),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+@instrumented("state.bootstrap_rankings")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--replicates", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--shared", choices=BACKENDS, default="shm",
+                        help="how workers share the transition terms (mmap where /dev/shm is small)")
+    parser.add_argument("--seed", type=int, default=derive_seed("bootstrap-ranks"),
+                        help="default: this step's seed derived from the run seed (EPI_SEED)")
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--ci", type=float, default=0.95)
+    args = parser.parse_args(argv)
+
+    print(f"Preparing {args.level}-level transition terms...")
+    blocks = state_blocks() if args.level == "state" else county_blocks()
+    units = np.concatenate([b.units for b in blocks])
+    n_years = align_years(blocks)
+
+    full = np.ones(n_years)
+    point = centralities(blocks, full)
+    if args.level == "state":
+        point = published_point(units) or point
+    # the ranking files only list units with at least one edge
+    in_graph = np.concatenate([(W != 0).any(axis=0) | (W != 0).any(axis=1)
+                               for W in (b.weights(full) for b in blocks)])
+
+    with stage(f"{args.level}.bootstrap", units=len(units), replicates=args.replicates):
+        draws = bootstrap(blocks, n_years, args.replicates, seed=args.seed, workers=args.workers,
+                          shared=args.shared)
+    summary = summarize(units, point, draws, args.top_k, args.ci)
+    summary = summary[np.tile(in_graph, len(draws))]
+    unit_col = "STATE_ABBREV" if args.level == "state" else "FIPS"
+    summary = summary.rename(columns={"unit": unit_col}).sort_values(["metric", "rank", unit_col])
+
+    out_path = os.path.join(OUT, f"{args.level}_rank_bootstrap.csv")
+    summary.to_csv(out_path, index=False)
+
+    top = summary[(summary["metric"] == "out_degree") & (summary["rank"] <= args.top_k)]
+    print("\n" + "=" * 50)
+    print(f"OUT-DEGREE RANK STABILITY ({args.replicates} replicates, {args.ci:.0%} CI)")
+    print("=" * 50)
+    print(top[[unit_col, "rank", "rank_median", "rank_ci_low", "rank_ci_high", f"top{args.top_k}_prob"]]
+          .to_string(index=False))
+    print(f"\nSaved {len(summary)} rows to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
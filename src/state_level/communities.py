@@ -0,0 +1,342 @@
+"""
+Community detection on the influence networks and clustering of rate trajectories.
+
+Communities (on the symmetrised influence graph W + W^T, as CSR):
+- louvain:           modularity local moving + aggregation, one CSR row scan
+                     per node move, so the national county graph takes seconds
+- label_propagation: semi-synchronous weighted label propagation, one sparse
+                     product per sweep
+
+Trajectory clusters (on the unit x YEAR rate matrix, gaps interpolated):
+- kmeans: k-means on the rates (or z-scored shapes with --shape)
+- dtw:    k-medoids on dynamic-time-warping distances (Sakoe-Chiba band)
+
+Outputs:
+- outputs/{level}_clusters.csv:            unit, community, trajectory_cluster
+- outputs/{level}_community_summary.csv:   size, members, internal / in / out
+                                           influence, first / last mean rate
+- outputs/{level}_community_flows.csv:     source x target community influence
+- outputs/{level}_trajectory_centroids.csv: mean / median rate per cluster and year
+"""
+
+import os
+import sys
+import argparse
+import warnings
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+from hazard_model import pivot_panel, edge_matrix
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+from common.manifest import derive_seed
+from common import geography
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+MEMBERS_LISTED = 5
+
+
+def _relabel(labels):
+    """Dense 0..k-1 labels, numbered by first appearance."""
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+
+def membership_matrix(labels, k=None):
+    n = len(labels)
+    return sparse.csr_matrix((np.ones(n), (np.arange(n), labels)), shape=(n, k or labels.max() + 1))
+
+
+def modularity(A, labels, resolution=1.0):
+    A = sparse.csr_matrix(A)
+    m2 = A.sum()
+    if m2 == 0:
+        return 0.0
+    P = membership_matrix(labels)
+    internal = (P.T @ A @ P).diagonal()
+    tot = P.T @ np.asarray(A.sum(axis=1)).ravel()
+    return float(np.sum(internal / m2 - resolution * (tot / m2) ** 2))
+
+
+def _local_moving(A, resolution, rng):
+    """One Louvain level: move nodes to the neighbouring community with the best modularity gain."""
+    n = A.shape[0]
+    k = np.asarray(A.sum(axis=1)).ravel()
+    m2 = k.sum()
+    comm = np.arange(n)
+    tot = k.copy()
+    indptr, indices, data = A.indptr, A.indices, A.data
+
+    moved = True
+    while moved:
+        moved = False
+        for i in rng.permutation(n):
+            nbrs = indices[indptr[i]:indptr[i + 1]]
+            w = data[indptr[i]:indptr[i + 1]]
+            keep = nbrs != i
+            nbrs, w = nbrs[keep], w[keep]
+            own = comm[i]
+            tot[own] -= k[i]
+            if len(nbrs):
+                cands, inv = np.unique(comm[nbrs], return_inverse=True)
+                w_c = np.bincount(inv, weights=w)
+                gain = w_c - resolution * tot[cands] * k[i] / m2
+                own_gain = w_c[cands == own].sum() - resolution * tot[own] * k[i] / m2
+                best = int(np.argmax(gain))
+                if gain[best] > own_gain + 1e-12 and cands[best] != own:
+                    own = cands[best]
+                    moved = True
+            comm[i] = own
+            tot[own] += k[i]
+    return _relabel(comm)
+
+
+def louvain(A, resolution=1.0, seed=0, max_levels=20):
+    """Louvain communities of a symmetric weighted CSR matrix."""
+    rng = np.random.default_rng(seed)
+    A = sparse.csr_matrix(A, dtype=float)
+    labels = np.arange(A.shape[0])
+    for _ in range(max_levels):
+        comm = _local_moving(A, resolution, rng)
+        if comm.max() + 1 == A.shape[0]:
+            break
+        labels = comm[labels]
+        P = membership_matrix(comm)
+        A = (P.T @ A @ P).tocsr()
+    return _relabel(labels)
+
+
+def label_propagation(A, seed=0, max_iter=100):
+    """Weighted label propagation; each sweep updates a random half of the nodes."""
+    rng = np.random.default_rng(seed)
+    A = sparse.csr_matrix(A, dtype=float)
+    n = A.shape[0]
+    labels = np.arange(n)
+    has_edges = np.diff(A.indptr) > 0
+    for _ in range(max_iter):
+        L = membership_matrix(labels, n)
+        # a small bonus for the current label keeps ties from flipping back and forth
+        scores = (A @ L + 1e-9 * L).tocsr()
+        best = np.asarray(scores.argmax(axis=1)).ravel()
+        update = has_edges & (rng.random(n) < 0.5) & (best != labels)
+        if not ((best != labels) & has_edges).any():
+            break
+        labels = np.where(update, best, labels)
+    return _relabel(labels)
+
+
+def fill_trajectories(R):
+    """Linear interpolation along time, flat extrapolation at the ends; all-NaN rows stay NaN."""
+    return pd.DataFrame(R).interpolate(axis=1, limit_direction="both").to_numpy()
+
+
+def zscore_rows(X):
+    mean = X.mean(axis=1, keepdims=True)
+    std = X.std(axis=1, keepdims=True)
+    return (X - mean) / np.where(std > 0, std, 1.0)
+
+
+def dtw_distances(X, window=2, block=512):
+    """All-pairs DTW distances, vectorised over blocks of row pairs; only the band cells are kept."""
+    n, T = X.shape
+    D = np.empty((n, n))
+    for lo in range(0, n, block):
+        a = X[lo:lo + block]
+        inf = np.full((len(a), n), np.inf)
+        prev = {0: np.zeros((len(a), n))}
+        for i in range(1, T + 1):
+            cur = {}
+            for j in range(max(1, i - window), min(T, i + window) + 1):
+                best = np.minimum(np.minimum(prev.get(j, inf), cur.get(j - 1, inf)), prev.get(j - 1, inf))
+                cur[j] = np.abs(a[:, None, i - 1] - X[None, :, j - 1]) + best
+            prev = cur
+        D[lo:lo + block] = prev[T]
+    return D
+
+
+def kmedoids(D, k, seed=0, max_iter=100):
+    """Alternating k-medoids on a precomputed distance matrix, k-means++ style seeding."""
+    rng = np.random.default_rng(seed)
+    n = len(D)
+    medoids = [int(rng.integers(n))]
+    for _ in range(1, k):
+        d = D[:, medoids].min(axis=1) ** 2
+        medoids.append(int(rng.choice(n, p=d / d.sum())) if d.sum() > 0 else int(rng.integers(n)))
+    medoids = np.array(medoids)
+    for _ in range(max_iter):
+        labels = np.argmin(D[:, medoids], axis=1)
+        new = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if len(members):
+                new[c] = members[np.argmin(D[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(new, medoids):
+            break
+        medoids = new
+    return np.argmin(D[:, medoids], axis=1)
+
+
+def trajectory_clusters(R, k=4, method="kmeans", shape=False, window=2, seed=0):
+    """Cluster label per unit (-1 for units with no observations)."""
+    from scipy.cluster.vq import kmeans2
+
+    X = fill_trajectories(R)
+    ok = ~np.isnan(X).any(axis=1)
+    Xo = zscore_rows(X[ok]) if shape else X[ok]
+    k = min(k, len(Xo))
+    if method == "dtw":
+        labels = kmedoids(dtw_distances(Xo, window), k, seed=seed)
+    else:
+        _, labels = kmeans2(Xo, k, minit="++", seed=seed)
+    out = np.full(len(R), -1)
+    out[ok] = _relabel(labels)
+    return out
+
+
+def load_level(level):
+    """Units, years, rates, influence matrix W[s, d] and unit metadata for a level."""
+    if level == "state":
+        panel = pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv"))
+        edges = pd.read_csv(os.path.join(OUT, "influence_edges.csv"))
+        units, years, R = pivot_panel(panel, "STATE_ABBREV")
+        W = edge_matrix(units, edges)
+        names = pd.Series(geography.state_names()).reindex(units).fillna("")
+        meta = pd.DataFrame({"STATE_ABBREV": units, "NAME": names.to_numpy()})
+    else:
+        panel = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+        edges = pd.read_csv(os.path.join(OUT, "county_influence_edges.csv"))
+        units, years, R = pivot_panel(panel, "FIPS")
+        W = edge_matrix(units, edges, "source_fips", "target_fips")
+        info = panel.drop_duplicates("FIPS", keep="last").set_index("FIPS").reindex(units)
+        meta = pd.DataFrame({"FIPS": units, "NAME": info["COUNTY_NAME"].to_numpy(),
+                             "STATE_ABBREV": info["STATE_ABBREV"].to_numpy()})
+    return units, years, R, sparse.csr_matrix(W), meta
+
+
+def detect_communities(W, method="louvain", resolution=1.0, seed=0):
+    """Community per unit of the symmetrised graph; units without edges get -1."""
+    A = (W + W.T).tocsr()
+    in_graph = np.diff(A.indptr) > 0
+    Ag = A[in_graph][:, in_graph]
+    if method == "louvain":
+        comm = louvain(Ag, resolution=resolution, seed=seed)
+    else:
+        comm = label_propagation(Ag, seed=seed)
+    labels = np.full(W.shape[0], -1)
+    labels[in_graph] = comm
+    return labels, Ag
+
+
+def community_summary(labels, W, R, years, meta):
+    """Per community: size, listed members, internal / in / out influence, mean rate trajectory ends."""
+    mask = labels >= 0
+    P = membership_matrix(labels[mask])
+    Wg = W[mask][:, mask]
+    flows = (P.T @ Wg @ P).toarray()
+    out_degree = np.asarray(Wg.sum(axis=1)).ravel()
+    names = meta["NAME"].to_numpy()[mask]
+
+    rows = []
+    for c in range(P.shape[1]):
+        idx = np.flatnonzero(labels[mask] == c)
+        lead = idx[np.argsort(-out_degree[idx], kind="stable")][:MEMBERS_LISTED]
+        rates = R[mask][idx]
+        first = np.flatnonzero(~np.isnan(rates).all(axis=0))
+        row = {
+            "community": c,
+            "n_units": len(idx),
+            "top_members": "; ".join(str(n) for n in names[lead]),
+            "internal_weight": flows[c, c],
+            "out_weight": flows[c].sum() - flows[c, c],
+            "in_weight": flows[:, c].sum() - flows[c, c],
+        }
+        if "FIPS" in meta.columns:
+            row["states"] = " ".join(sorted(set(meta["STATE_ABBREV"].to_numpy()[mask][idx])))
+        if len(first):
+            with np.errstate(invalid="ignore"):
+                row[f"mean_rate_{years[first[0]]}"] = np.nanmean(rates[:, first[0]])
+                row[f"mean_rate_{years[first[-1]]}"] = np.nanmean(rates[:, first[-1]])
+        rows.append(row)
+    summary = pd.DataFrame(rows).sort_values(["n_units", "community"], ascending=[False, True])
+    flow_df = pd.DataFrame(flows, index=pd.Index(range(len(flows)), name="source_community"),
+                           columns=[f"to_{c}" for c in range(len(flows))])
+    return summary, flow_df
+
+
+def trajectory_centroids(clusters, R, years):
+    frames = []
+    for c in np.unique(clusters[clusters >= 0]):
+        rates = R[clusters == c]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN years
+            frames.append(pd.DataFrame({
+                "trajectory_cluster": c,
+                "YEAR": years,
+                "n_units": len(rates),
+                "mean_rate": np.nanmean(rates, axis=0),
+                "median_rate": np.nanmedian(rates, axis=0),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+@instrumented("state.communities")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--method", choices=["louvain", "label_propagation"], default="louvain")
+    parser.add_argument("--resolution", type=float, default=1.0, help="Louvain resolution (higher = smaller communities)")
+    parser.add_argument("--trajectory", choices=["kmeans", "dtw"], default="kmeans")
+    parser.add_argument("--k", type=int, default=4, help="number of trajectory clusters")
+    parser.add_argument("--shape", action="store_true", help="cluster z-scored trajectories (shape, not level)")
+    parser.add_argument("--window", type=int, default=2, help="DTW band half-width in years")
+    parser.add_argument("--seed", type=int, default=derive_seed("communities"),
+                        help="default: this step's seed derived from the run seed (EPI_SEED)")
+    args = parser.parse_args(argv)
+
+    units, years, R, W, meta = load_level(args.level)
+    unit_col = "STATE_ABBREV" if args.level == "state" else "FIPS"
+
+    with stage(f"{args.level}.communities_{args.method}", units=len(units), edges=W.nnz) as rec:
+        labels, A = detect_communities(W, args.method, args.resolution, args.seed)
+        rec.count(communities=labels.max() + 1)
+    q = modularity(A, labels[labels >= 0], args.resolution)
+    print(f"{args.method}: {labels.max() + 1} communities over {int((labels >= 0).sum())} connected units "
+          f"(modularity {q:.3f}, {rec.wall_s:.2f}s)")
+
+    with stage(f"{args.level}.trajectory_{args.trajectory}", units=len(units), years=len(years)) as rec:
+        clusters = trajectory_clusters(R, args.k, args.trajectory, args.shape, args.window, args.seed)
+    print(f"{args.trajectory}: {clusters.max() + 1} trajectory clusters ({rec.wall_s:.2f}s)")
+
+    summary, flows = community_summary(labels, W, R, years, meta)
+    centroids = trajectory_centroids(clusters, R, years)
+    assignments = meta.assign(community=labels, trajectory_cluster=clusters)
+
+    assignments.to_csv(os.path.join(OUT, f"{args.level}_clusters.csv"), index=False)
+    summary.to_csv(os.path.join(OUT, f"{args.level}_community_summary.csv"), index=False)
+    flows.to_csv(os.path.join(OUT, f"{args.level}_community_flows.csv"))
+    centroids.to_csv(os.path.join(OUT, f"{args.level}_trajectory_centroids.csv"), index=False)
+
+    print("\n" + "=" * 50)
+    print("LARGEST COMMUNITIES")
+    print("=" * 50)
+    print(summary.head(10).round(2).to_string(index=False))
+    print("\n" + "=" * 50)
+    print(f"TRAJECTORY CLUSTERS ({years[0]} / {years[-1]} mean rate)")
+    print("=" * 50)
+    ends = centroids[centroids["YEAR"].isin([years[0], years[-1]])]
+    print(ends.pivot(index="trajectory_cluster", columns="YEAR", values="mean_rate")
+          .join(centroids.groupby("trajectory_cluster")["n_units"].first()).round(1).to_string())
+    print(f"\nSaved {unit_col} clusters, community summary / flows and trajectory centroids to {OUT}")
+
+
+if __name__ == "__main__":
+    main()
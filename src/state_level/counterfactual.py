@@ -0,0 +1,295 @@
+"""
+Counterfactual interventions: "what if unit X had stayed low from year Y".
+
+A scenario forces a set of states / counties to stay at or below the threshold
+(stay_low), or scales their rate down by a fraction (reduce), from the first
+period of a start year on. The intervention is applied once per period to the
+unit's counterfactual path - a treated unit's own lag term carries its
+untreated path, so a 20% cut stays a 20% cut instead of compounding - and
+rates never go below zero. Its effect is propagated forward through two
+fitted models:
+- rates:   the NAR spatial regression Rate(t+1) = b0 + b_self Rate(t) + b_net (W Rate)(t),
+           with the observed residuals held fixed, so the baseline is the
+           observed history and a scenario differs only by the propagated
+           effect of its intervention
+- cascade: the discrete-time hazard model run as a mean-field cascade on the
+           scenario rates, where exposure comes from expected (not observed)
+           adoption and forced-low units cannot adopt
+
+All scenarios are simulated together as (scenarios x units) arrays stepped
+over the years, so hundreds of scenarios cost about as much as one per year.
+
+Scenarios come from --scenarios <csv> (columns scenario, unit, start_year,
+action [stay_low|reduce], reduction) or from --units / --start_year /
+--action / --reduction, with --each making one scenario per unit.
+
+Outputs:
+- outputs/{level}_counterfactual.csv: per scenario and year, mean rate, units
+  above the threshold and expected adopters, with baseline and differences
+"""
+
+import os
+import sys
+import argparse
+from collections import namedtuple
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+from hazard_model import THRESHOLD, pivot_panel, edge_matrix, neighbor_mean, build_design, fit_hazard, predict_hazard
+from network_autoregression import MIXTURE_GRID, mix_weights, spatial_lag, stack_transitions, fit_ols
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+from common.periods import SUBPERIOD_COLUMNS, infer_granularity, period_label, period_ordinal, period_year
+from common import geography
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+ACTIONS = ("stay_low", "reduce")
+
+# names: (S,), start: (S,) period index, cap: (S, n) stay-low mask, scale: (S, n) rate multiplier
+Scenarios = namedtuple("Scenarios", ["names", "start", "cap", "scale"])
+
+
+class Counterfactual:
+    """Fitted rate and cascade models for one level, ready to simulate scenario batches."""
+
+    def __init__(self, units, years, R, W_edges, A, nar_beta, W_nar, hazard, threshold=THRESHOLD,
+                 granularity="year"):
+        self.units = units
+        self.years = years
+        self.granularity = granularity
+        self.R = R
+        self.W_edges = sparse.csr_matrix(W_edges)
+        self.A = sparse.csr_matrix(A)
+        self.nar_beta = nar_beta
+        self.W_nar = sparse.csr_matrix(W_nar)
+        self.hazard = hazard
+        self.threshold = threshold
+        self._index = pd.Index(units)
+
+    @classmethod
+    def fit(cls, level="state"):
+        if level == "state":
+            panel = pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv"))
+            edges = pd.read_csv(os.path.join(OUT, "influence_edges.csv"))
+            units, years, R = pivot_panel(panel, "STATE_ABBREV")
+            W_edges = edge_matrix(units, edges)
+            A = geography.states().adjacency_for(units)
+        else:
+            panel = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+            edges = pd.read_csv(os.path.join(OUT, "county_influence_edges.csv"))
+            units, years, R = pivot_panel(panel, "FIPS")
+            W_edges = edge_matrix(units, edges, "source_fips", "target_fips")
+            # same-state peer mean stands in for the state rate, so it moves with the scenario
+            state_of = panel.drop_duplicates("FIPS", keep="last").set_index("FIPS")["STATE_ABBREV"].reindex(units)
+            A = geography.same_state_adjacency(state_of.to_numpy())
+
+        W_geo = A if level == "state" else geography.counties().adjacency_for(units)
+        best = None
+        for alpha in MIXTURE_GRID:
+            W = mix_weights(W_edges.T, W_geo, alpha)
+            X, y, _, _ = stack_transitions(R, spatial_lag(R, W), years)
+            ols = fit_ols(X, y)
+            if best is None or ols["sse"] < best[0]:
+                best = (ols["sse"], ols["beta"], W)
+
+        features, at_risk, event = build_design(R, W_edges, neighbor_mean(R, A))
+        hazard = fit_hazard(features[at_risk], event[at_risk])
+        return cls(units, years, R, W_edges, A, best[1], best[2], hazard, granularity=infer_granularity(panel))
+
+    def scenarios(self, table):
+        """Scenarios from rows of (scenario, unit, start_year, action, reduction)."""
+        names = pd.unique(table["scenario"])
+        S, n = len(names), len(self.units)
+        row = pd.Index(names).get_indexer(table["scenario"])
+        col = self._index.get_indexer(table["unit"])
+        if (col < 0).any():
+            raise ValueError(f"unknown units: {sorted(set(table['unit'][col < 0].astype(str)))}")
+
+        start = np.full(S, len(self.years), dtype=int)
+        np.minimum.at(start, row, np.searchsorted(self.years, self.first_period(table["start_year"])))
+        cap = np.zeros((S, n), dtype=bool)
+        scale = np.ones((S, n))
+        low = table["action"].to_numpy() == "stay_low"
+        cap[row[low], col[low]] = True
+        scale[row[~low], col[~low]] = 1.0 - table["reduction"].to_numpy(dtype=float)[~low]
+        return Scenarios(np.asarray(names), start, cap, scale)
+
+    def first_period(self, years):
+        """Ordinal of the first period of each calendar year in the panel's granularity."""
+        years = pd.DataFrame({"YEAR": np.asarray(years, dtype=int)})
+        if self.granularity != "year":
+            years[SUBPERIOD_COLUMNS[self.granularity]] = 1
+        return period_ordinal(years, self.granularity)
+
+    def _intervene(self, rates, scenarios, t):
+        active = (scenarios.start <= t)[:, None]
+        rates = np.where(active, rates * scenarios.scale, rates)
+        return np.where(active & scenarios.cap, np.minimum(rates, self.threshold), rates)
+
+    def simulate_rates(self, scenarios):
+        """
+        (S, n, T) scenario rates: observed before each start, propagated effect after.
+
+        `pre` is every unit's rate before the intervention of its period. It
+        drives the own-lag term, so a treated unit's cut is applied once to its
+        counterfactual path rather than fed back and cut again; neighbours see
+        the intervened rates through the network term.
+        """
+        S = len(scenarios.names)
+        b0, b_self, b_net = self.nar_beta
+        R = self.R
+        Y = np.broadcast_to(R, (S,) + R.shape).copy()
+        t0 = int(scenarios.start.min())
+        if t0 >= R.shape[1]:
+            return Y
+
+        pre = Y[:, :, t0].copy()
+        Y[:, :, t0] = np.maximum(self._intervene(pre, scenarios, t0), 0.0)
+        base_lag = spatial_lag(R, self.W_nar)
+        for t in range(t0, R.shape[1] - 1):
+            lag = spatial_lag(Y[:, :, t].T, self.W_nar).T
+            # a unit missing in year t carries no deviation, so gaps do not poison later years
+            effect = b_self * np.nan_to_num(pre - R[:, t]) + b_net * np.nan_to_num(lag - base_lag[:, t])
+            waiting = (scenarios.start > t + 1)[:, None]
+            pre = np.where(waiting, R[:, t + 1], R[:, t + 1] + effect)
+            rates = np.maximum(self._intervene(pre, scenarios, t + 1), 0.0)
+            Y[:, :, t + 1] = np.where(waiting, R[:, t + 1], rates)
+        return Y
+
+    def simulate_adoption(self, Y, scenarios):
+        """(S, n, T) expected probability of having adopted, from the mean-field hazard cascade."""
+        S, n, T = Y.shape
+        thr = self.threshold
+        valid = ~np.isnan(Y)
+        P = np.maximum.accumulate(np.where(valid, Y, 0.0) > thr, axis=2).astype(float)
+        t0 = int(min(scenarios.start.min(), T - 1))
+
+        def block(t, p):
+            return np.where((scenarios.start <= t)[:, None] & scenarios.cap, 0.0, p)
+
+        P[:, :, t0] = block(t0, P[:, :, t0])
+        for t in range(t0, T - 1):
+            cur, prev = Y[:, :, t], Y[:, :, max(t - 1, 0)]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                momentum = np.where(t > 0, (cur - prev) / prev, 0.0)
+            lag = neighbor_mean(cur.T, self.A).T
+            features = np.stack([
+                np.nan_to_num(cur / thr),
+                np.nan_to_num(momentum, nan=0.0, posinf=0.0, neginf=0.0),
+                (self.W_edges.T @ P[:, :, t].T).T,
+                np.nan_to_num(lag / thr),
+            ], axis=-1)
+            h = predict_hazard(self.hazard, features)
+            at_risk = valid[:, :, t] & valid[:, :, t + 1]
+            p = P[:, :, t] + np.where(at_risk, (1.0 - P[:, :, t]) * h, 0.0)
+            P[:, :, t + 1] = block(t + 1, p)
+        return P
+
+    def run(self, scenarios):
+        """Per scenario and year summary; scenario 0 of the batch is the no-intervention baseline."""
+        S = len(scenarios.names)
+        n = len(self.units)
+        batch = Scenarios(
+            np.concatenate([["baseline"], scenarios.names]),
+            np.concatenate([[scenarios.start.min() if S else len(self.years)], scenarios.start]),
+            np.vstack([np.zeros((1, n), dtype=bool), scenarios.cap]),
+            np.vstack([np.ones((1, n)), scenarios.scale]),
+        )
+        with stage("counterfactual.simulate", scenarios=S, units=n, years=len(self.years)):
+            Y = self.simulate_rates(batch)
+            if not np.allclose(Y[0], self.R, rtol=0.0, atol=1e-9, equal_nan=True):
+                raise RuntimeError("baseline scenario diverged from the observed rates")
+            P = self.simulate_adoption(Y, batch)
+
+        with np.errstate(invalid="ignore"):
+            mean_rate = np.nanmean(Y, axis=1)
+        high = (np.nan_to_num(Y) > self.threshold).sum(axis=1)
+        adopters = P.sum(axis=1)
+
+        frames = []
+        for s, name in enumerate(batch.names[1:], start=1):
+            frames.append(pd.DataFrame({
+                "scenario": name,
+                "YEAR": period_year(self.years, self.granularity),
+                **({"PERIOD": period_label(self.years, self.granularity)} if self.granularity != "year" else {}),
+                "mean_rate": mean_rate[s],
+                "high_units": high[s],
+                "expected_adopters": adopters[s],
+                "baseline_mean_rate": mean_rate[0],
+                "baseline_high_units": high[0],
+                "baseline_expected_adopters": adopters[0],
+            }))
+        if not frames:
+            return pd.DataFrame()
+        out = pd.concat(frames, ignore_index=True)
+        for col in ("mean_rate", "high_units", "expected_adopters"):
+            out[f"delta_{col}"] = out[col] - out[f"baseline_{col}"]
+        return out
+
+
+def scenario_table(args, units):
+    if args.scenarios:
+        table = pd.read_csv(args.scenarios)
+        table["action"] = table.get("action", "stay_low")
+        table["reduction"] = table.get("reduction", 0.0)
+    else:
+        chosen = args.units.split(",") if args.units else list(units)
+        if args.level == "county":
+            chosen = [int(u) for u in chosen]
+        if args.each:
+            names = [f"{u}_{args.action}_{args.start_year}" for u in chosen]
+        else:
+            names = ["+".join(map(str, chosen)) + f"_{args.action}_{args.start_year}"] * len(chosen)
+        table = pd.DataFrame({"scenario": names, "unit": chosen, "start_year": args.start_year,
+                              "action": args.action, "reduction": args.reduction})
+    bad = set(table["action"]) - set(ACTIONS)
+    if bad:
+        raise SystemExit(f"unknown action(s) {sorted(bad)}; expected one of {ACTIONS}")
+    return table
+
+
+@instrumented("state.counterfactual")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--scenarios", default=None, help="CSV of scenario, unit, start_year[, action, reduction]")
+    parser.add_argument("--units", default=None, help="comma-separated states / FIPS (default: every unit)")
+    parser.add_argument("--start_year", type=int, default=2010)
+    parser.add_argument("--action", choices=ACTIONS, default="stay_low")
+    parser.add_argument("--reduction", type=float, default=0.2, help="fractional rate cut for --action reduce")
+    parser.add_argument("--each", action="store_true", help="one scenario per unit instead of one joint scenario")
+    args = parser.parse_args(argv)
+
+    print(f"Fitting {args.level}-level rate and cascade models...")
+    with stage(f"{args.level}.counterfactual_fit"):
+        engine = Counterfactual.fit(args.level)
+    b0, b_self, b_net = engine.nar_beta
+    print(f"Rates: Rate(t+1) = {b0:.2f} + {b_self:.3f} * Rate(t) + {b_net:.3f} * (W Rate)(t)")
+
+    table = scenario_table(args, engine.units)
+    scenarios = engine.scenarios(table)
+    print(f"Simulating {len(scenarios.names)} scenario(s) x {len(engine.units)} units x {len(engine.years)} years...")
+    results = engine.run(scenarios)
+
+    out_path = os.path.join(OUT, f"{args.level}_counterfactual.csv")
+    results.to_csv(out_path, index=False)
+
+    final = results.groupby("scenario", sort=False).tail(1).sort_values("delta_expected_adopters")
+    print("\n" + "=" * 50)
+    print(f"COUNTERFACTUAL EFFECT BY {period_label(engine.years[-1:], engine.granularity)[0]} (vs baseline)")
+    print("=" * 50)
+    print(final[["scenario", "delta_mean_rate", "delta_high_units", "delta_expected_adopters"]]
+          .head(15).round(3).to_string(index=False))
+    print(f"\nSaved {len(results)} rows to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import os
+import sys
+import argparse
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import geography
+from common.periods import infer_granularity, period_year
+from common.instrument import instrumented, stage
+from common.metric_panel import DEFAULT_METRIC, MetricPanel, load_frame, suffix
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -12,108 +17,65 @@ PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 os.makedirs(OUT, exist_ok=True)
 
-NEIGHBORS = {
-    'AL': ['FL', 'GA', 'MS', 'TN'],
-    'AK': [],
-    'AZ': ['CA', 'CO', 'NV', 'NM', 'UT'],
-    'AR': ['LA', 'MS', 'MO', 'OK', 'TN', 'TX'],
-    'CA': ['AZ', 'NV', 'OR'],
-    'CO': ['AZ', 'KS', 'NE', 'NM', 'OK', 'UT', 'WY'],
-    'CT': ['MA', 'NY', 'RI'],
-    'DE': ['MD', 'NJ', 'PA'],
-    'FL': ['AL', 'GA'],
-    'GA': ['AL', 'FL', 'NC', 'SC', 'TN'],
-    'HI': [],
-    'ID': ['MT', 'NV', 'OR', 'UT', 'WA', 'WY'],
-    'IL': ['IN', 'IA', 'KY', 'MO', 'WI'],
-    'IN': ['IL', 'KY', 'MI', 'OH'],
-    'IA': ['IL', 'MN', 'MO', 'NE', 'SD', 'WI'],
-    'KS': ['CO', 'MO', 'NE', 'OK'],
-    'KY': ['IL', 'IN', 'MO', 'OH', 'TN', 'VA', 'WV'],
-    'LA': ['AR', 'MS', 'TX'],
-    'ME': ['NH'],
-    'MD': ['DE', 'PA', 'VA', 'WV'],
-    'MA': ['CT', 'NH', 'NY', 'RI', 'VT'],
-    'MI': ['IN', 'OH', 'WI'],
-    'MN': ['IA', 'ND', 'SD', 'WI'],
-    'MS': ['AL', 'AR', 'LA', 'TN'],
-    'MO': ['AR', 'IL', 'IA', 'KS', 'KY', 'NE', 'OK', 'TN'],
-    'MT': ['ID', 'ND', 'SD', 'WY'],
-    'NE': ['CO', 'IA', 'KS', 'MO', 'SD', 'WY'],
-    'NV': ['AZ', 'CA', 'ID', 'OR', 'UT'],
-    'NH': ['ME', 'MA', 'VT'],
-    'NJ': ['DE', 'NY', 'PA'],
-    'NM': ['AZ', 'CO', 'OK', 'TX', 'UT'],
-    'NY': ['CT', 'MA', 'NJ', 'PA', 'VT'],
-    'NC': ['GA', 'SC', 'TN', 'VA'],
-    'ND': ['MN', 'MT', 'SD'],
-    'OH': ['IN', 'KY', 'MI', 'PA', 'WV'],
-    'OK': ['AR', 'CO', 'KS', 'MO', 'NM', 'TX'],
-    'OR': ['CA', 'ID', 'NV', 'WA'],
-    'PA': ['DE', 'MD', 'NJ', 'NY', 'OH', 'WV'],
-    'RI': ['CT', 'MA'],
-    'SC': ['GA', 'NC'],
-    'SD': ['IA', 'MN', 'MT', 'NE', 'ND', 'WY'],
-    'TN': ['AL', 'AR', 'GA', 'KY', 'MS', 'MO', 'NC', 'VA'],
-    'TX': ['AR', 'LA', 'NM', 'OK'],
-    'UT': ['AZ', 'CO', 'ID', 'NV', 'NM', 'WY'],
-    'VT': ['MA', 'NH', 'NY'],
-    'VA': ['KY', 'MD', 'NC', 'TN', 'WV'],
-    'WA': ['ID', 'OR'],
-    'WV': ['KY', 'MD', 'OH', 'PA', 'VA'],
-    'WI': ['IL', 'IA', 'MI', 'MN'],
-    'WY': ['CO', 'ID', 'MT', 'NE', 'SD', 'UT'],
-    'DC': ['MD', 'VA']
-}
-
-def prepare_regression_data(df):
-    X = []
-    y = []
-    meta = []
-
-    states = df["STATE_ABBREV"].unique()
-    years = sorted(df["YEAR"].unique())
-
-    rate_map = {}
-    for yr in years:
-        rate_map[yr] = df[df["YEAR"] == yr].set_index("STATE_ABBREV")["opioid_dispensing_rate"].to_dict()
-
-    for t in years[:-1]:
-        for s in states:
-            if s not in rate_map[t] or s not in rate_map[t+1]:
-                continue
-            
-            target_val = rate_map[t+1][s]
-            
-            current_val = rate_map[t][s]
-            
-            neighbors = NEIGHBORS.get(s, [])
-            neighbor_vals = [rate_map[t][n] for n in neighbors if n in rate_map[t]]
-            
-            if len(neighbor_vals) > 0:
-                spatial_val = np.mean(neighbor_vals)
-            else:
-                spatial_val = 0
-            
-            X.append([current_val, spatial_val])
-            y.append(target_val)
-            meta.append((t+1, s))
-
-    return np.array(X), np.array(y), meta
-
-def main():
+def prepare_regression_data(df, metric=DEFAULT_METRIC, covariates=()):
+    """
+    Rows (state, t) with the metric at t, its neighbour mean and the
+    covariates at t (gap-filled, see MetricPanel.lagged) against the metric at t+1.
+    """
+    metrics = MetricPanel.from_frame(df, "STATE_ABBREV", [metric] + list(covariates))
+    panel = metrics.panel(metric)
+    R = panel.values
+    observed = panel.observed
+    states = panel.units
+
+    adjacency = geography.states().adjacency_for(states)
+
+    neighbor_sum = adjacency @ np.where(observed, R, 0.0)
+    neighbor_count = adjacency @ observed.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spatial = np.where(neighbor_count > 0, neighbor_sum / neighbor_count, 0.0)
+
+    mask = (observed[:, :-1] & observed[:, 1:]).T
+    t_idx, s_idx = np.nonzero(mask)
+
+    X = np.column_stack([R[s_idx, t_idx], spatial[s_idx, t_idx]])
+    if covariates:
+        _, C = metrics.lagged(covariates, lags=(0,))
+        X = np.column_stack([X, C[s_idx, t_idx]])
+    y = R[s_idx, t_idx + 1]
+    # (calendar year, period label, state) of each target; the label equals the year for annual panels
+    targets = panel.periods[t_idx + 1]
+    years = period_year(targets, panel.granularity)
+    meta = list(zip(years.tolist(), panel.labels(targets).tolist(), states[s_idx].tolist()))
+
+    return X, y, meta
+
+@instrumented("state.predict_continuous")
+def main(argv=None):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error, r2_score
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-plots", dest="plots", action="store_false")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, help="panel metric to forecast")
+    parser.add_argument("--covariates", default="", help="comma-separated other metrics used as predictors at t")
+    args = parser.parse_args(argv)
+    covariates = [c.strip() for c in args.covariates.split(",") if c.strip() and c.strip() != args.metric]
+
     print("Loading Data...")
-    df = pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv"))
+    df = load_frame("state", [args.metric] + covariates)
+    df = df.dropna(subset=[args.metric])
     
     train_df = df[df["YEAR"] <= 2016]
     test_df = df[df["YEAR"] > 2016]
     
     print("Preparing Regression Matrices...")
-    X_train, y_train, meta_train = prepare_regression_data(train_df)
+    with stage("state.regression_features", rows=len(df)):
+        X_train, y_train, meta_train = prepare_regression_data(train_df, args.metric, covariates)
     
-    X_full, y_full, meta_full = prepare_regression_data(df)
+        X_full, y_full, meta_full = prepare_regression_data(df, args.metric, covariates)
     
-    test_indices = [i for i, (yr, st) in enumerate(meta_full) if yr > 2017]
+    test_indices = [i for i, (yr, _, _) in enumerate(meta_full) if yr > 2017]
     X_test = X_full[test_indices]
     y_test = y_full[test_indices]
     meta_test = [meta_full[i] for i in test_indices]
@@ -122,8 +84,9 @@ def main():
     print(f"Testing Samples: {len(X_test)}")
 
     print("Training Spatial Autoregressive Model...")
-    model = LinearRegression()
-    model.fit(X_train, y_train)
+    with stage("state.regression_fit", rows=len(X_train)):
+        model = LinearRegression()
+        model.fit(X_train, y_train)
     
     beta_self = model.coef_[0]
     beta_spatial = model.coef_[1]
@@ -132,7 +95,8 @@ def main():
     print("\n" + "="*40)
     print("MODEL RESULTS")
     print("="*40)
-    print(f"Equation: Rate(t+1) = {intercept:.2f} + {beta_self:.3f} * Rate(t) + {beta_spatial:.3f} * Neighbor_Rate(t)")
+    print(f"Equation: Rate(t+1) = {intercept:.2f} + {beta_self:.3f} * Rate(t) + {beta_spatial:.3f} * Neighbor_Rate(t)"
+          + "".join(f" + {b:.3f} * {c}(t)" for b, c in zip(model.coef_[2:], covariates)))
     print("-" * 40)
     print(f"Interpretation:")
     print(f" - Self-Persistence (Beta): {beta_self:.3f} (Strong history dependence)")
@@ -147,10 +111,12 @@ def main():
     print(f"Test R2 Score: {r2:.3f}")
     print("="*40)
 
+    sub_annual = infer_granularity(df) != "year"
     results = []
-    for i, (yr, st) in enumerate(meta_test):
+    for i, (yr, label, st) in enumerate(meta_test):
         results.append({
             "YEAR": yr,
+            **({"PERIOD": label} if sub_annual else {}),
             "STATE_ABBREV": st,
             "Actual_Rate": y_test[i],
             "Predicted_Rate": y_pred[i],
@@ -158,20 +124,27 @@ def main():
         })
     
     res_df = pd.DataFrame(results)
-    res_path = os.path.join(OUT, "continuous_prediction_results.csv")
+    res_path = os.path.join(OUT, f"continuous_prediction_results{suffix(args.metric)}.csv")
     res_df.to_csv(res_path, index=False)
     print(f"\nDetailed predictions saved to {res_path}")
 
-    plt.figure(figsize=(10, 6))
-    plt.scatter(y_test, y_pred, alpha=0.5, color='blue')
-    plt.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2)
-    plt.xlabel("Actual Dispensing Rate")
-    plt.ylabel("Predicted Dispensing Rate")
-    plt.title(f"Spatial Autoregressive Model: Actual vs Predicted (R2={r2:.2f})")
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUT, "continuous_prediction_scatter.png"), dpi=300)
-    print(f"Scatter plot saved to {os.path.join(OUT, 'continuous_prediction_scatter.png')}")
+    if not args.plots:
+        return
+
+    import matplotlib.pyplot as plt
+    label = "Dispensing Rate" if args.metric == DEFAULT_METRIC else args.metric
+    plot_path = os.path.join(OUT, f"continuous_prediction_scatter{suffix(args.metric)}.png")
+    with stage("state.prediction_plot", points=len(y_test)):
+        plt.figure(figsize=(10, 6))
+        plt.scatter(y_test, y_pred, alpha=0.5, color='blue')
+        plt.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2)
+        plt.xlabel(f"Actual {label}")
+        plt.ylabel(f"Predicted {label}")
+        plt.title(f"Spatial Autoregressive Model: Actual vs Predicted (R2={r2:.2f})")
+        plt.grid(True, alpha=0.3)
+        plt.tight_layout()
+        plt.savefig(plot_path, dpi=300)
+    print(f"Scatter plot saved to {plot_path}")
 
 if __name__ == "__main__":
     main()
@@ -1,21 +1,20 @@
 import os
+import sys
 import pandas as pd
-import networkx as nx
 import numpy as np
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 EDGES_PATH = os.path.join(OUT, "influence_edges.csv")
 
-def main():
-    if not os.path.exists(EDGES_PATH):
-        print(f"Error: {EDGES_PATH} not found. Please run build_influence_network.py first.")
-        return
+def influence_rankings(edges_df):
+    """Out-degree weight, eigenvector and betweenness centrality per state, with their ranks (method='min')."""
+    import networkx as nx
 
-    print(f"Loading edges from {EDGES_PATH}...")
-    edges_df = pd.read_csv(EDGES_PATH)
-    
     G = nx.DiGraph()
     
     for _, row in edges_df.iterrows():
@@ -28,13 +27,16 @@ def main():
         weight_sum = sum(data['weight'] for _, _, data in G.out_edges(node, data=True))
         out_degree_centrality[node] = weight_sum
 
-    try:
-        eigen_centrality = nx.eigenvector_centrality(G, weight='weight', max_iter=1000)
-    except nx.PowerIterationFailedConvergence:
-        print("Warning: Eigenvector centrality did not converge. Using unweighted fallback or partial results.")
-        eigen_centrality = nx.eigenvector_centrality(G, max_iter=1000)
+    size = dict(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    with stage("state.eigenvector_centrality", **size):
+        try:
+            eigen_centrality = nx.eigenvector_centrality(G, weight='weight', max_iter=1000)
+        except nx.PowerIterationFailedConvergence:
+            print("Warning: Eigenvector centrality did not converge. Using unweighted fallback or partial results.")
+            eigen_centrality = nx.eigenvector_centrality(G, max_iter=1000)
 
-    betweenness_centrality = nx.betweenness_centrality(G, weight='weight')
+    with stage("state.betweenness_centrality", **size):
+        betweenness_centrality = nx.betweenness_centrality(G, weight='weight')
 
     nodes = list(G.nodes())
     rank_df = pd.DataFrame({
@@ -54,7 +56,17 @@ def main():
             'Rank_OutDegree', 'Out_Degree_Weight', 
             'Rank_Eigenvector', 'Eigenvector', 
             'Rank_Betweenness', 'Betweenness']
-    rank_df = rank_df[cols]
+    return rank_df[cols]
+
+
+@instrumented("state.rank_influencers")
+def main():
+    if not os.path.exists(EDGES_PATH):
+        print(f"Error: {EDGES_PATH} not found. Please run build_influence_network.py first.")
+        return
+
+    print(f"Loading edges from {EDGES_PATH}...")
+    rank_df = influence_rankings(pd.read_csv(EDGES_PATH))
 
     out_path = os.path.join(OUT, "state_influence_rankings.csv")
     rank_df.to_csv(out_path, index=False)
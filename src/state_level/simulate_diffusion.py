@@ -1,8 +1,13 @@
 import os
+import sys
 import pandas as pd
-import networkx as nx
 import numpy as np
-import random
+
+from hazard_model import load_state_inputs, build_design, fit_hazard, predict_hazard
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.periods import DensePanel
+from common.instrument import instrumented, stage
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -13,6 +18,7 @@ OUT = os.path.join(PROJECT_ROOT, "outputs")
 EDGES_PATH = os.path.join(OUT, "influence_edges.csv")
 PANEL_PATH = os.path.join(PROC, "dispensing_with_is_high.csv")
 
+@instrumented("state.simulate_diffusion")
 def main():
     print("--- LOADING DATA ---")
     if not os.path.exists(EDGES_PATH):
@@ -22,13 +28,20 @@ def main():
     edges_df = pd.read_csv(EDGES_PATH)
     panel_df = pd.read_csv(PANEL_PATH)
     
-    G = nx.DiGraph()
-    for _, row in edges_df.iterrows():
-        G.add_edge(row['source'], row['target'], weight=row['weight'])
+    print(f"Edges loaded: {len(edges_df)} influence edges.")
     
-    print(f"Graph loaded: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges.")
+    print("\n--- FITTING DISCRETE-TIME HAZARD MODEL ---")
+    with stage("state.simulate_hazard_fit", edges=len(edges_df)) as rec:
+        units, hazard_years, R, W, spatial = load_state_inputs()
+        features, at_risk, event = build_design(R, W, spatial)
+        model = fit_hazard(features[at_risk], event[at_risk])
+        hazard = predict_hazard(model, features)
+        rec.count(units=len(units), rows=int(at_risk.sum()))
+    print(f"Fitted on {int(at_risk.sum())} at-risk state-years ({int(event.sum())} adoptions).")
     
-    years = sorted(panel_df["YEAR"].unique())
+    dense = DensePanel.from_frame(panel_df, "STATE_ABBREV", "is_high", units=units, periods=hazard_years)
+    high = np.nan_to_num(dense.values) == 1
+    labels = dense.labels()
     
     results = []
     
@@ -38,55 +51,22 @@ def main():
     total_correct = 0
     total_predicted = 0
     
-    for i in range(len(years) - 1):
-        t = years[i]
-        next_t = years[i+1]
-        
-        current_high = set(panel_df[(panel_df["YEAR"] == t) & (panel_df["is_high"] == 1)]["STATE_ABBREV"])
+    for j in range(len(labels) - 1):
+        t = labels[j]
+        next_t = labels[j + 1]
         
-        next_high = set(panel_df[(panel_df["YEAR"] == next_t) & (panel_df["is_high"] == 1)]["STATE_ABBREV"])
-        
-        actual_new = next_high - current_high
+        new_mask = high[:, j + 1] & ~high[:, j]
+        actual_new = set(units[new_mask])
         
         if not actual_new:
             continue
             
         k = len(actual_new)
         
-        candidates = []
-        all_states = set(panel_df["STATE_ABBREV"].unique())
-        potential_targets = all_states - current_high
+        potential_targets = units[~high[:, j]]
+        candidate_scores = list(zip(potential_targets, hazard[~high[:, j], j]))
         
-        candidate_scores = []
-        for state in potential_targets:
-            net_score = 0
-            if G.has_node(state):
-                for source, _, data in G.in_edges(state, data=True):
-                    if source in current_high:
-                        net_score += data['weight']
-            
-            try:
-                current_rate = panel_df[(panel_df["YEAR"] == t) & (panel_df["STATE_ABBREV"] == state)]["opioid_dispensing_rate"].values[0]
-            except IndexError:
-                current_rate = 0.0
-                
-            try:
-                prev_rate = panel_df[(panel_df["YEAR"] == t-1) & (panel_df["STATE_ABBREV"] == state)]["opioid_dispensing_rate"].values[0]
-            except IndexError:
-                prev_rate = current_rate
-            
-            susceptibility = current_rate / 87.35
-            
-            if prev_rate > 0:
-                momentum = (current_rate - prev_rate) / prev_rate
-            else:
-                momentum = 0.0
-            
-            epsilon = 0.05
-            
-            final_score = (net_score + epsilon) * (susceptibility ** 2) * (1.0 + max(0, momentum))
-            
-            candidate_scores.append((state, final_score))
+        expected_new = sum(p for _, p in candidate_scores)
         
         candidate_scores.sort(key=lambda x: x[1], reverse=True)
         
@@ -107,13 +87,15 @@ def main():
         print(f"  Predicted Top-{k}: {sorted(list(predicted_new))}")
         print(f"  Correct: {sorted(list(correct_hits))} (Count: {num_correct})")
         print(f"  Accuracy: {precision:.2%} (vs Random Exp: {expected_random:.2f})")
+        print(f"  Expected New Adopters (sum of hazards): {expected_new:.2f}")
         
         results.append({
             "Year": next_t,
             "Actual_Count": k,
             "Correct_Count": num_correct,
             "Accuracy": precision,
-            "Random_Exp": expected_random
+            "Random_Exp": expected_random,
+            "Expected_Count": expected_new
         })
         
         total_correct += num_correct
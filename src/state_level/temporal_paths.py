@@ -0,0 +1,213 @@
+"""
+Time-respecting paths on the temporal influence network.
+
+The influence edges aggregate every transition into one static graph, so its
+paths (and the betweenness in rank_influencers.py) can chain an edge from 2012
+into one from 2008. Here transition t (period t -> t+1) contributes the edges
+E_t[s, d] = s high in t, d going low -> high (the same events as
+common/periods.transition_terms, within the same geographic / state mask), and
+a path must use strictly increasing transitions. A target of E_t is low in t,
+so it cannot also be a source of E_t and one step per period is exact.
+
+Every quantity is a forward sweep over the periods for all sources at once,
+i.e. one (units x units) matrix product per period:
+- reachability / foremost arrival: R <- R | R @ E_t
+- hops:     the same sweep with reach limited to k hops, k = 1, 2, ... until
+            nothing changes (fewest-hop time-respecting path)
+- fastest:  one sweep per departure period; min(arrival - departure)
+- betweenness: counts of foremost (earliest-arrival) paths, F_t = paths
+            arriving at exactly t, combined with backward counts of paths that
+            leave w at or after t and arrive at v exactly at its earliest
+            arrival; normalised like networkx by (n - 1)(n - 2)
+Counties are handled per state (their networks are intra-state).
+
+Outputs:
+- outputs/{level}_temporal_centrality.csv:  per unit temporal / static reach,
+                                            mean hops, mean fastest time and
+                                            temporal betweenness
+- outputs/{level}_temporal_reachability.csv: every reachable (source, target)
+                                            pair with earliest arrival, hops
+                                            and fastest time in years
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+from scipy.sparse.csgraph import shortest_path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+from bootstrap_rankings import state_blocks, county_blocks
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+
+def snapshots(block):
+    """Boolean (transitions x units x units) edges E[t, s, d] of one block."""
+    src = (block.decay > 0).T
+    dst = (block.new > 0).T
+    E = src[:, :, None] & dst[:, None, :]
+    if block.allowed is not None:
+        E &= block.allowed[None]
+    idx = np.arange(E.shape[1])
+    E[:, idx, idx] = False
+    return E
+
+
+def foremost(E):
+    """
+    Earliest arrival period index (-1 if never, 0 for the source itself) and
+    per-period exact-arrival path counts F[t, s, v].
+    """
+    T, n, _ = E.shape
+    A = E.astype(float)
+    F = np.zeros((T + 1, n, n))
+    F[0] = np.eye(n)
+    cumulative = F[0].copy()
+    arrival = np.where(np.eye(n, dtype=bool), 0, -1)
+    for t in range(T):
+        F[t + 1] = cumulative @ A[t]
+        arrival[(F[t + 1] > 0) & (arrival < 0)] = t + 1
+        cumulative += F[t + 1]
+    return arrival, F
+
+
+def fewest_hops(E, reach):
+    """Minimum hops over time-respecting paths (inf where unreachable)."""
+    n = E.shape[1]
+    hops = np.where(np.eye(n, dtype=bool), 0.0, np.inf)
+    # reach within k hops by period t+1 = reach within k hops by t, or within k-1 hops by t plus one edge
+    prev = np.repeat(np.eye(n, dtype=bool)[None], len(E) + 1, axis=0)
+    k = 0
+    while True:
+        k += 1
+        cur = np.empty_like(prev)
+        cur[0] = np.eye(n, dtype=bool)
+        for t in range(len(E)):
+            step = (prev[t].astype(np.float32) @ E[t].astype(np.float32)) > 0
+            cur[t + 1] = cur[t] | step
+        final = cur[-1]
+        hops[final & np.isinf(hops)] = k
+        if (final == prev[-1]).all() or (final == reach).all():
+            break
+        prev = cur
+    return hops
+
+
+def fastest(E, periods_per_year=1):
+    """Minimum (arrival - departure) in years over all departure periods (inf where unreachable)."""
+    T, n, _ = E.shape
+    best = np.where(np.eye(n, dtype=bool), 0.0, np.inf)
+    for start in range(T):
+        R = np.eye(n, dtype=bool)
+        for t in range(start, T):
+            new = ((R.astype(np.float32) @ E[t].astype(np.float32)) > 0) & ~R
+            if new.any():
+                best[new] = np.minimum(best[new], (t + 1 - start) / periods_per_year)
+                R |= new
+    return best
+
+
+def temporal_betweenness(E, arrival, F):
+    """
+    Foremost-path betweenness: for every pair (s, v), the share of s -> v paths
+    arriving at v's earliest arrival that pass through w, summed over pairs.
+    """
+    T, n, _ = E.shape
+    A = E.astype(float)
+    sigma = np.take_along_axis(F, np.maximum(arrival, 0)[None], axis=0)[0]
+    off = ~np.eye(n, dtype=bool)
+    B = np.zeros(n)
+    for t in range(2, T + 1):
+        target = (arrival == t) & off
+        if not target.any():
+            continue
+        Z = np.where(target, 1.0 / np.where(target, sigma, 1.0), 0.0)
+        # K: paths using transitions tau..t-1 that end at their target at exactly t
+        K = A[t - 1].copy()
+        for tau in range(t - 1, 0, -1):
+            through = F[tau] * (Z @ (K * off).T)
+            B += through.sum(axis=0) - np.diag(through)
+            K = K + A[tau - 1] @ K
+    scale = (n - 1) * (n - 2)
+    return B / scale if scale > 0 else B
+
+
+def static_reach(E):
+    """Reach on the aggregated (time-ignoring) graph, for comparison."""
+    dist = shortest_path(E.any(axis=0).astype(float), unweighted=True)
+    return np.isfinite(dist)
+
+
+def analyse(block):
+    E = snapshots(block)
+    n = E.shape[1]
+    arrival, F = foremost(E)
+    reach = arrival >= 0
+    hops = fewest_hops(E, reach)
+    speed = fastest(E, block.periods_per_year)
+    off = ~np.eye(n, dtype=bool)
+    reached = reach & off
+    n_reached = reached.sum(axis=1)
+    per_source = np.where(n_reached > 0, n_reached, 1)
+    centrality = pd.DataFrame({
+        "unit": block.units,
+        "temporal_reach_out": n_reached,
+        "temporal_reach_in": reached.sum(axis=0),
+        "static_reach_out": (static_reach(E) & off).sum(axis=1),
+        "mean_hops": np.where(n_reached > 0, np.where(reached, hops, 0).sum(axis=1) / per_source, np.nan),
+        "mean_fastest_years": np.where(n_reached > 0, np.where(reached, speed, 0).sum(axis=1) / per_source, np.nan),
+        "temporal_betweenness": temporal_betweenness(E, arrival, F),
+    })
+    s, v = np.nonzero(reached)
+    pairs = pd.DataFrame({
+        "source": block.units[s],
+        "target": block.units[v],
+        "earliest_arrival": block.labels[arrival[s, v]],
+        "hops": hops[s, v].astype(int),
+        "fastest_years": speed[s, v],
+    })
+    return centrality, pairs
+
+
+@instrumented("state.temporal_paths")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    args = parser.parse_args(argv)
+
+    print(f"Preparing {args.level}-level transition snapshots...")
+    blocks = state_blocks() if args.level == "state" else county_blocks()
+    unit_col = "STATE_ABBREV" if args.level == "state" else "FIPS"
+
+    with stage(f"{args.level}.temporal_paths", blocks=len(blocks)) as rec:
+        results = [analyse(b) for b in blocks]
+        rec.count(units=sum(len(b.units) for b in blocks))
+    centrality = pd.concat([c for c, _ in results], ignore_index=True)
+    pairs = pd.concat([p for _, p in results], ignore_index=True)
+    if args.level == "county":
+        centrality.insert(1, "STATE_ABBREV", np.repeat([b.name for b in blocks], [len(b.units) for b in blocks]))
+        pairs = pairs.rename(columns={"source": "source_fips", "target": "target_fips"})
+    centrality = centrality.rename(columns={"unit": unit_col}) \
+        .sort_values(["temporal_betweenness", "temporal_reach_out"], ascending=False)
+
+    centrality.to_csv(os.path.join(OUT, f"{args.level}_temporal_centrality.csv"), index=False)
+    pairs.to_csv(os.path.join(OUT, f"{args.level}_temporal_reachability.csv"), index=False)
+
+    total_static = int(centrality["static_reach_out"].sum())
+    total_temporal = int(centrality["temporal_reach_out"].sum())
+    print("\n" + "=" * 50)
+    print(f"TIME-RESPECTING REACHABILITY ({args.level})")
+    print("=" * 50)
+    print(f"Reachable pairs: {total_temporal} time-respecting vs {total_static} on the static graph")
+    print(centrality.head(10).round(4).to_string(index=False))
+    print(f"\nSaved centrality and {len(pairs)} reachable pairs to {OUT}")
+
+
+if __name__ == "__main__":
+    main()
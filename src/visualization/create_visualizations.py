@@ -1,14 +1,19 @@
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 PROC = os.path.join(PROJECT_ROOT, "data", "processed")
 
+@instrumented("viz.plot_network")
 def plot_network():
     print("Generating Network Graph...")
     edges_path = os.path.join(OUT, "influence_edges.csv")
@@ -26,7 +31,8 @@ def plot_network():
     d = dict(G.degree(weight='weight'))
     node_sizes = [v * 100 + 300 for v in d.values()]
     
-    pos = nx.spring_layout(G, k=0.5, iterations=50, seed=42)
+    with stage("viz.spring_layout", nodes=G.number_of_nodes(), edges=G.number_of_edges()):
+        pos = nx.spring_layout(G, k=0.5, iterations=50, seed=42)
     
     nx.draw_networkx_nodes(G, pos, node_size=node_sizes, node_color='skyblue', alpha=0.9)
     nx.draw_networkx_edges(G, pos, width=[d['weight'] for u, v, d in G.edges(data=True)], 
@@ -39,6 +45,7 @@ def plot_network():
     plt.savefig(os.path.join(OUT, "influence_network_graph.png"), dpi=300)
     plt.close()
 
+@instrumented("viz.plot_rankings")
 def plot_rankings():
     print("Generating Rankings Chart...")
     rank_path = os.path.join(OUT, "state_influence_rankings.csv")
@@ -57,6 +64,7 @@ def plot_rankings():
     plt.savefig(os.path.join(OUT, "top_influencers_bar.png"), dpi=300)
     plt.close()
 
+@instrumented("viz.plot_adoption_timeline")
 def plot_adoption_timeline():
     print("Generating Adoption Timeline...")
     adopt_path = os.path.join(PROC, "adoption_year.csv")
@@ -81,8 +89,11 @@ def plot_adoption_timeline():
     plt.savefig(os.path.join(OUT, "historical_adoption_curve.png"), dpi=300)
     plt.close()
 
-if __name__ == "__main__":
+def main():
     plot_network()
     plot_rankings()
     plot_adoption_timeline()
     print("All visualizations generated in 'outputs/' folder.")
+
+if __name__ == "__main__":
+    main()
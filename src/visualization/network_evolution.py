@@ -0,0 +1,307 @@
+"""
+Network evolution renderer: influence edges appearing as targets turn high.
+
+Every edge's activation year (the year its target first crossed the threshold:
+87.35 for states, the state's 75th percentile for counties, the cut-offs the
+edges were built with) and every node's first high year are computed once, so a panel for any year is
+two boolean masks. Each panel is drawn with one scatter for the nodes and one
+LineCollection each for the (arc-shaped) edges and their arrowheads, instead of
+a networkx graph and per-edge patches per year; an animation only updates
+those artists' colours and segments, which keeps county-scale networks
+(tens of thousands of edges) tractable.
+
+Node positions: states use the schematic map positions; counties use their
+centroids when data/reference/counties.csv is present, otherwise a small
+spiral around their state's position.
+
+Usage:
+    python src/visualization/network_evolution.py [--level county]
+        [--years 2006,2008,2010,2012] [--animate gif|mp4] [--fps 2]
+
+Outputs:
+- outputs/{prefix}network_evolution.png:      one panel per --years entry
+- outputs/{prefix}network_evolution.gif/.mp4: with --animate, one frame per year
+(prefix is "" for states and "county_" for counties)
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented, stage
+from common import geography
+from common.metric_panel import NEVER
+
+CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
+DATA = os.path.join(PROJECT_ROOT, "data")
+PROC = os.path.join(DATA, "processed")
+OUT = os.path.join(PROJECT_ROOT, "outputs")
+os.makedirs(OUT, exist_ok=True)
+
+STATE_QUANTILE = 0.75
+HIGH_COLOR = "#e74c3c"
+LOW_COLOR = "#3498db"
+EDGE_COLOR = "#2c3e50"
+DEFAULT_YEARS = [2006, 2008, 2010, 2012]
+ARC_RAD = 0.1
+ARC_POINTS = 12
+
+
+class Evolution:
+    """Nodes (positions, first high year) and edges (endpoints, weight, activation year) of one level."""
+
+    def __init__(self, level, units, positions, high_year, src, dst, weight, active_year, years, labels=None):
+        self.level = level
+        self.units = np.asarray(units)
+        self.positions = np.asarray(positions, dtype=float)
+        self.high_year = np.asarray(high_year)
+        self.src = np.asarray(src)
+        self.dst = np.asarray(dst)
+        self.weight = np.asarray(weight, dtype=float)
+        self.active_year = np.asarray(active_year)
+        self.years = np.asarray(years)
+        self.labels = labels
+        self._arcs = None
+
+    def high(self, year):
+        return self.high_year <= year
+
+    def active(self, year):
+        return self.active_year <= year
+
+    @property
+    def scale(self):
+        """Typical node spacing, used to size arrowheads and shrink arcs off the nodes."""
+        span = np.ptp(self.positions, axis=0).max() if len(self.positions) else 1.0
+        return span / max(np.sqrt(len(self.positions)), 1.0)
+
+    def arcs(self):
+        """(edges x ARC_POINTS x 2) arc polylines and (2 * edges x 2 x 2) arrowhead barbs, built once."""
+        if self._arcs is None:
+            self._arcs = arc_segments(self.positions[self.src], self.positions[self.dst], shrink=0.3 * self.scale)
+        return self._arcs
+
+
+def arc_segments(start, end, rad=ARC_RAD, shrink=0.0, points=ARC_POINTS, head=None):
+    """
+    Quadratic Bezier arcs (matplotlib's arc3 connection style) from `start` to
+    `end`, stopped `shrink` short of the end, plus two arrowhead barbs per arc.
+    """
+    d = end - start
+    length = np.hypot(d[:, 0], d[:, 1])
+    control = (start + end) / 2 + rad * np.column_stack([d[:, 1], -d[:, 0]])
+    t_end = np.clip(1.0 - shrink / np.where(length > 0, length, 1.0), 0.5, 1.0)
+    t = t_end[:, None] * np.linspace(0.0, 1.0, points)[None, :]
+    a, b, c = (1 - t) ** 2, 2 * (1 - t) * t, t ** 2
+    curve = a[..., None] * start[:, None] + b[..., None] * control[:, None] + c[..., None] * end[:, None]
+
+    tip = curve[:, -1]
+    direction = tip - curve[:, -2]
+    direction /= np.maximum(np.hypot(direction[:, 0], direction[:, 1]), 1e-12)[:, None]
+    if head is None:
+        head = 0.4 * shrink
+    barbs = []
+    for angle in (np.pi - 0.45, np.pi + 0.45):
+        cos, sin = np.cos(angle), np.sin(angle)
+        rotated = np.column_stack([cos * direction[:, 0] - sin * direction[:, 1],
+                                   sin * direction[:, 0] + cos * direction[:, 1]])
+        barbs.append(np.stack([tip, tip + head * rotated], axis=1))
+    return curve, np.concatenate(barbs)
+
+
+def _first_year(units, df, unit_col, flag):
+    """First YEAR a unit is flagged, NEVER if it never is."""
+    first = df.loc[flag, [unit_col, "YEAR"]].groupby(unit_col)["YEAR"].min()
+    return first.reindex(units).fillna(NEVER).to_numpy(dtype=np.int64)
+
+
+def load_state_evolution():
+    panel = pd.read_csv(os.path.join(PROC, "dispensing_with_is_high.csv"))
+    edges = pd.read_csv(os.path.join(OUT, "influence_edges.csv"))
+    adoption = pd.read_csv(os.path.join(PROC, "adoption_year.csv"))
+
+    units = np.array(sorted(panel["STATE_ABBREV"].dropna().unique()))
+    positions = geography.state_positions()
+    xy = np.array([positions.get(u, (0.5, 0.5)) for u in units])
+    high_year = _first_year(units, panel, "STATE_ABBREV", panel["is_high"] == 1)
+
+    index = pd.Index(units)
+    src, dst = index.get_indexer(edges["source"]), index.get_indexer(edges["target"])
+    adoption_year = adoption.set_index("STATE_ABBREV")["adoption_year"]
+    active_year = adoption_year.reindex(edges["target"]).fillna(NEVER).to_numpy(dtype=np.int64)
+    keep = (src >= 0) & (dst >= 0)
+    return Evolution("state", units, xy, high_year, src[keep], dst[keep], edges["weight"].to_numpy()[keep],
+                     active_year[keep], np.sort(panel["YEAR"].unique()), labels=units)
+
+
+def load_county_evolution():
+    panel = pd.read_csv(os.path.join(PROC, "dispensing_county_year.csv"))
+    edges_path = os.path.join(OUT, "county_influence_edges.csv")
+    if not os.path.exists(edges_path):
+        raise SystemExit(f"{edges_path} not found; build the county influence network first.")
+    edges = pd.read_csv(edges_path)
+
+    hierarchy = panel.drop_duplicates("FIPS", keep="last").sort_values("FIPS")
+    units = hierarchy["FIPS"].to_numpy()
+    # county edges were built against each state's own 75th percentile (build_intra_state_networks.py),
+    # so a county turns high, and its incoming edges activate, when it crosses that cut-off
+    rate = panel["opioid_dispensing_rate"]
+    local_threshold = rate.groupby(panel["STATE_ABBREV"]).transform("quantile", STATE_QUANTILE)
+    high_year = _first_year(units, panel, "FIPS", rate > local_threshold)
+
+    index = pd.Index(units)
+    src, dst = index.get_indexer(edges["source_fips"]), index.get_indexer(edges["target_fips"])
+    keep = (src >= 0) & (dst >= 0)
+    src, dst = src[keep], dst[keep]
+    positions = geography.county_layout(units, hierarchy["STATE_ABBREV"].to_numpy())
+    return Evolution("county", units, positions, high_year,
+                     src, dst, edges["weight"].to_numpy()[keep], high_year[dst], np.sort(panel["YEAR"].unique()))
+
+
+def load_evolution(level="state"):
+    return load_state_evolution() if level == "state" else load_county_evolution()
+
+
+class PanelArtists:
+    """The three batched artists of one panel, updatable per year."""
+
+    def __init__(self, ax, evo, node_size=None, width_scale=None):
+        from matplotlib.collections import LineCollection
+
+        self.ax = ax
+        self.evo = evo
+        county = evo.level == "county"
+        self.width_scale = width_scale or (0.5 if county else 2.0)
+        self.curves, self.barbs = evo.arcs()
+        self.edges = LineCollection([], colors=EDGE_COLOR, alpha=0.25 if county else 0.6, zorder=1)
+        self.heads = LineCollection([], colors=EDGE_COLOR, alpha=0.25 if county else 0.6, zorder=1)
+        ax.add_collection(self.edges)
+        ax.add_collection(self.heads)
+        size = node_size or (12 if county else 300)
+        self.nodes = ax.scatter(evo.positions[:, 0], evo.positions[:, 1], s=size, c=LOW_COLOR,
+                                alpha=0.8, linewidths=0, zorder=2)
+        if evo.labels is not None:
+            for (x, y), label in zip(evo.positions, evo.labels):
+                ax.text(x, y, label, ha="center", va="center", fontsize=7, fontweight="bold", zorder=3)
+        pad = 0.05 * np.ptp(evo.positions, axis=0).max()
+        ax.set_xlim(evo.positions[:, 0].min() - pad, evo.positions[:, 0].max() + pad)
+        ax.set_ylim(evo.positions[:, 1].min() - pad, evo.positions[:, 1].max() + pad)
+        ax.axis("off")
+
+    def update(self, year):
+        """Show the network as of `year`; returns (high nodes, active edges)."""
+        high = self.evo.high(year)
+        active = self.evo.active(year)
+        self.nodes.set_color(np.where(high, HIGH_COLOR, LOW_COLOR))
+        widths = self.evo.weight[active] * self.width_scale
+        self.edges.set_segments(self.curves[active])
+        self.edges.set_linewidths(widths)
+        self.heads.set_segments(self.barbs[np.concatenate([active, active])])
+        self.heads.set_linewidths(np.concatenate([widths, widths]))
+        return int(high.sum()), int(active.sum())
+
+
+def _title(evo, year, high, active):
+    unit = "States" if evo.level == "state" else "Counties"
+    return f"Year {year}\n{high} High-Prescribing {unit}, {active} Influence Events"
+
+
+def _legend(fig, evo):
+    import matplotlib.patches as mpatches
+    from matplotlib.lines import Line2D
+
+    unit = "State" if evo.level == "state" else "County"
+    fig.legend(handles=[
+        mpatches.Patch(color=HIGH_COLOR, label=f"High-Prescribing {unit}"),
+        mpatches.Patch(color=LOW_COLOR, label=f"Low-Prescribing {unit}"),
+        Line2D([0], [0], color=EDGE_COLOR, linewidth=2, label="Influence Edge"),
+    ], loc="lower center", ncol=3, fontsize=11, bbox_to_anchor=(0.5, 0.02))
+
+
+def render_panels(evo, years, path, ncols=2, dpi=300):
+    """One panel per year in a grid, saved to `path`."""
+    import matplotlib.pyplot as plt
+
+    years = list(years)
+    ncols = min(ncols, len(years))
+    nrows = -(-len(years) // ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(8 * ncols, 7 * nrows), squeeze=False)
+    axes = axes.flatten()
+    for ax, year in zip(axes, years):
+        artists = PanelArtists(ax, evo)
+        high, active = artists.update(year)
+        ax.set_title(_title(evo, year, high, active), fontsize=12, fontweight="bold")
+    for ax in axes[len(years):]:
+        ax.axis("off")
+
+    _legend(fig, evo)
+    level = "" if evo.level == "state" else "County "
+    plt.suptitle(f"Evolution of Opioid Prescribing {level}Influence Network ({years[0]}-{years[-1]})",
+                 fontsize=16, fontweight="bold", y=0.98)
+    plt.tight_layout(rect=[0, 0.05, 1, 0.95])
+    plt.savefig(path, dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+def animate(evo, path, years=None, fps=2, dpi=100):
+    """One frame per year; the artists are created once and only updated per frame."""
+    import matplotlib.pyplot as plt
+    from matplotlib import animation
+
+    years = list(evo.years if years is None else years)
+    fig, ax = plt.subplots(figsize=(12, 9))
+    artists = PanelArtists(ax, evo)
+    title = ax.set_title("", fontsize=13, fontweight="bold")
+    _legend(fig, evo)
+
+    def frame(year):
+        title.set_text(_title(evo, year, *artists.update(year)))
+        return artists.nodes, artists.edges, artists.heads, title
+
+    if path.endswith(".mp4"):
+        if not animation.writers.is_available("ffmpeg"):
+            plt.close(fig)
+            raise SystemExit("MP4 output needs ffmpeg on PATH; use --animate gif instead.")
+        writer = animation.FFMpegWriter(fps=fps)
+    else:
+        writer = animation.PillowWriter(fps=fps)
+    anim = animation.FuncAnimation(fig, frame, frames=years, blit=False)
+    anim.save(path, writer=writer, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+@instrumented("viz.network_evolution")
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", choices=["state", "county"], default="state")
+    parser.add_argument("--years", default=",".join(map(str, DEFAULT_YEARS)),
+                        help="comma-separated panel years, or 'all'")
+    parser.add_argument("--animate", choices=["gif", "mp4"], default=None,
+                        help="also write an animation over every panel year")
+    parser.add_argument("--fps", type=float, default=2)
+    args = parser.parse_args(argv)
+
+    with stage(f"{args.level}.evolution_load") as rec:
+        evo = load_evolution(args.level)
+        rec.count(nodes=len(evo.units), edges=len(evo.src))
+    years = evo.years.tolist() if args.years == "all" else [int(y) for y in args.years.split(",") if y.strip()]
+    prefix = "" if args.level == "state" else "county_"
+
+    with stage(f"{args.level}.evolution_panels", panels=len(years)):
+        path = render_panels(evo, years, os.path.join(OUT, f"{prefix}network_evolution.png"))
+    print(f"  Saved: {os.path.basename(path)}")
+
+    if args.animate:
+        with stage(f"{args.level}.evolution_animation", frames=len(evo.years)):
+            path = animate(evo, os.path.join(OUT, f"{prefix}network_evolution.{args.animate}"), fps=args.fps)
+        print(f"  Saved: {os.path.basename(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,16 @@ Generates:
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import networkx as nx
-from matplotlib.lines import Line2D
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented
+from common.partition import Partitioned
+from common import geography
+from network_evolution import load_state_evolution, render_panels
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
@@ -23,121 +27,27 @@ PROC = os.path.join(DATA, "processed")
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 os.makedirs(OUT, exist_ok=True)
 
-STATE_POSITIONS = {
-    'WA': (0.12, 0.92), 'OR': (0.10, 0.78), 'CA': (0.08, 0.55), 'NV': (0.15, 0.60),
-    'ID': (0.22, 0.78), 'MT': (0.30, 0.90), 'WY': (0.32, 0.72), 'UT': (0.23, 0.58),
-    'AZ': (0.20, 0.40), 'CO': (0.35, 0.55), 'NM': (0.30, 0.38), 'ND': (0.45, 0.90),
-    'SD': (0.45, 0.78), 'NE': (0.45, 0.65), 'KS': (0.47, 0.52), 'OK': (0.48, 0.42),
-    'TX': (0.45, 0.28), 'MN': (0.55, 0.82), 'IA': (0.55, 0.65), 'MO': (0.58, 0.52),
-    'AR': (0.58, 0.42), 'LA': (0.58, 0.28), 'WI': (0.62, 0.78), 'IL': (0.62, 0.62),
-    'MI': (0.72, 0.75), 'IN': (0.70, 0.58), 'OH': (0.78, 0.58), 'KY': (0.75, 0.48),
-    'TN': (0.72, 0.42), 'MS': (0.62, 0.35), 'AL': (0.68, 0.35), 'GA': (0.78, 0.35),
-    'FL': (0.82, 0.20), 'SC': (0.82, 0.38), 'NC': (0.85, 0.45), 'VA': (0.85, 0.52),
-    'WV': (0.80, 0.52), 'PA': (0.85, 0.62), 'NY': (0.88, 0.72), 'NJ': (0.92, 0.60),
-    'DE': (0.92, 0.55), 'MD': (0.88, 0.52), 'CT': (0.95, 0.68), 'RI': (0.97, 0.68),
-    'MA': (0.97, 0.72), 'VT': (0.92, 0.82), 'NH': (0.95, 0.80), 'ME': (0.98, 0.88),
-    'AK': (0.15, 0.15), 'HI': (0.25, 0.15), 'DC': (0.90, 0.50)
-}
+STATE_POSITIONS = geography.state_positions()
 
-NEIGHBORS = {
-    'AL': ['FL', 'GA', 'MS', 'TN'], 'AK': [], 'AZ': ['CA', 'CO', 'NV', 'NM', 'UT'],
-    'AR': ['LA', 'MS', 'MO', 'OK', 'TN', 'TX'], 'CA': ['AZ', 'NV', 'OR'],
-    'CO': ['AZ', 'KS', 'NE', 'NM', 'OK', 'UT', 'WY'], 'CT': ['MA', 'NY', 'RI'],
-    'DE': ['MD', 'NJ', 'PA'], 'FL': ['AL', 'GA'], 'GA': ['AL', 'FL', 'NC', 'SC', 'TN'],
-    'HI': [], 'ID': ['MT', 'NV', 'OR', 'UT', 'WA', 'WY'], 'IL': ['IN', 'IA', 'KY', 'MO', 'WI'],
-    'IN': ['IL', 'KY', 'MI', 'OH'], 'IA': ['IL', 'MN', 'MO', 'NE', 'SD', 'WI'],
-    'KS': ['CO', 'MO', 'NE', 'OK'], 'KY': ['IL', 'IN', 'MO', 'OH', 'TN', 'VA', 'WV'],
-    'LA': ['AR', 'MS', 'TX'], 'ME': ['NH'], 'MD': ['DE', 'PA', 'VA', 'WV'],
-    'MA': ['CT', 'NH', 'NY', 'RI', 'VT'], 'MI': ['IN', 'OH', 'WI'],
-    'MN': ['IA', 'ND', 'SD', 'WI'], 'MS': ['AL', 'AR', 'LA', 'TN'],
-    'MO': ['AR', 'IL', 'IA', 'KS', 'KY', 'NE', 'OK', 'TN'], 'MT': ['ID', 'ND', 'SD', 'WY'],
-    'NE': ['CO', 'IA', 'KS', 'MO', 'SD', 'WY'], 'NV': ['AZ', 'CA', 'ID', 'OR', 'UT'],
-    'NH': ['ME', 'MA', 'VT'], 'NJ': ['DE', 'NY', 'PA'], 'NM': ['AZ', 'CO', 'OK', 'TX', 'UT'],
-    'NY': ['CT', 'MA', 'NJ', 'PA', 'VT'], 'NC': ['GA', 'SC', 'TN', 'VA'],
-    'ND': ['MN', 'MT', 'SD'], 'OH': ['IN', 'KY', 'MI', 'PA', 'WV'],
-    'OK': ['AR', 'CO', 'KS', 'MO', 'NM', 'TX'], 'OR': ['CA', 'ID', 'NV', 'WA'],
-    'PA': ['DE', 'MD', 'NJ', 'NY', 'OH', 'WV'], 'RI': ['CT', 'MA'], 'SC': ['GA', 'NC'],
-    'SD': ['IA', 'MN', 'MT', 'NE', 'ND', 'WY'], 'TN': ['AL', 'AR', 'GA', 'KY', 'MS', 'MO', 'NC', 'VA'],
-    'TX': ['AR', 'LA', 'NM', 'OK'], 'UT': ['AZ', 'CO', 'ID', 'NV', 'NM', 'WY'],
-    'VT': ['MA', 'NH', 'NY'], 'VA': ['KY', 'MD', 'NC', 'TN', 'WV'], 'WA': ['ID', 'OR'],
-    'WV': ['KY', 'MD', 'OH', 'PA', 'VA'], 'WI': ['IL', 'IA', 'MI', 'MN'],
-    'WY': ['CO', 'ID', 'MT', 'NE', 'SD', 'UT'], 'DC': ['MD', 'VA']
-}
+NEIGHBORS = geography.state_neighbors()
 
 
+@instrumented("viz.plot_network_evolution")
 def plot_network_evolution():
     """Create multi-panel showing network growth over key years."""
     print("Generating Network Evolution Plot...")
     
-    panel_df = pd.read_csv(os.path.join(PROC, "dispensing_with_is_high.csv"))
-    edges_df = pd.read_csv(os.path.join(OUT, "influence_edges.csv"))
-    adoption_df = pd.read_csv(os.path.join(PROC, "adoption_year.csv"))
-    
-    adoption_map = dict(zip(adoption_df["STATE_ABBREV"], adoption_df["adoption_year"]))
-    
-    years = [2006, 2008, 2010, 2012]
-    
-    fig, axes = plt.subplots(2, 2, figsize=(16, 14))
-    axes = axes.flatten()
-    
-    for idx, year in enumerate(years):
-        ax = axes[idx]
-        
-        high_states = set(panel_df[(panel_df["YEAR"] <= year) & (panel_df["is_high"] == 1)]["STATE_ABBREV"].unique())
-        
-        active_edges = []
-        for _, row in edges_df.iterrows():
-            target_adopt = adoption_map.get(row['target'], 9999)
-            if target_adopt <= year:
-                active_edges.append((row['source'], row['target'], row['weight']))
-        
-        G = nx.DiGraph()
-        for s, t, w in active_edges:
-            G.add_edge(s, t, weight=w)
-        
-        all_states = set(panel_df["STATE_ABBREV"].unique())
-        for state in all_states:
-            if state not in G:
-                G.add_node(state)
-        
-        pos = {s: STATE_POSITIONS.get(s, (0.5, 0.5)) for s in G.nodes()}
-        node_colors = ['#e74c3c' if s in high_states else '#3498db' for s in G.nodes()]
-        
-        nx.draw_networkx_nodes(G, pos, ax=ax, node_size=300, node_color=node_colors, alpha=0.8)
-        
-        if active_edges:
-            edge_weights = [G[u][v]['weight'] * 2 for u, v in G.edges()]
-            nx.draw_networkx_edges(G, pos, ax=ax, width=edge_weights, alpha=0.6, 
-                                   edge_color='#2c3e50', arrows=True, arrowsize=15,
-                                   connectionstyle="arc3,rad=0.1")
-        
-        nx.draw_networkx_labels(G, pos, ax=ax, font_size=7, font_weight='bold')
-        
-        ax.set_title(f"Year {year}\n{len(high_states)} High-Prescribing States, {len(active_edges)} Influence Events", 
-                     fontsize=12, fontweight='bold')
-        ax.axis('off')
-    
-    legend_elements = [
-        mpatches.Patch(color='#e74c3c', label='High-Prescribing State'),
-        mpatches.Patch(color='#3498db', label='Low-Prescribing State'),
-        Line2D([0], [0], color='#2c3e50', linewidth=2, label='Influence Edge')
-    ]
-    fig.legend(handles=legend_elements, loc='lower center', ncol=3, fontsize=11, 
-               bbox_to_anchor=(0.5, 0.02))
-    
-    plt.suptitle("Evolution of Opioid Prescribing Influence Network (2006-2012)", 
-                 fontsize=16, fontweight='bold', y=0.98)
-    plt.tight_layout(rect=[0, 0.05, 1, 0.95])
-    plt.savefig(os.path.join(OUT, "network_evolution.png"), dpi=300, bbox_inches='tight')
-    plt.close()
+    evo = load_state_evolution()
+    render_panels(evo, [2006, 2008, 2010, 2012], os.path.join(OUT, "network_evolution.png"))
     print("  Saved: network_evolution.png")
 
 
+@instrumented("viz.plot_rate_trajectories")
 def plot_rate_trajectories():
     """Show rate trajectories for key states over time."""
     print("Generating Rate Trajectories Plot...")
     
-    df = pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv"))
+    by_state = Partitioned(pd.read_csv(os.path.join(PROC, "dispensing_state_year.csv")), "STATE_ABBREV", within="YEAR")
     rankings = pd.read_csv(os.path.join(OUT, "state_influence_rankings.csv"))
     
     top_states = rankings.head(5)["STATE_ABBREV"].tolist()
@@ -146,12 +56,12 @@ def plot_rate_trajectories():
     fig, ax = plt.subplots(figsize=(14, 8))
     
     for state in top_states:
-        state_data = df[df["STATE_ABBREV"] == state].sort_values("YEAR")
+        state_data = by_state[state]
         ax.plot(state_data["YEAR"], state_data["opioid_dispensing_rate"], 
                 marker='o', linewidth=2.5, markersize=5, label=f"{state} (Influencer)")
     
     for state in low_states:
-        state_data = df[df["STATE_ABBREV"] == state].sort_values("YEAR")
+        state_data = by_state[state]
         ax.plot(state_data["YEAR"], state_data["opioid_dispensing_rate"], 
                 linestyle='--', linewidth=1.5, alpha=0.7, label=f"{state} (Low)")
     
@@ -170,6 +80,7 @@ def plot_rate_trajectories():
     print("  Saved: rate_trajectories.png")
 
 
+@instrumented("viz.plot_geographic_map")
 def plot_geographic_map():
     """Create a simplified geographic visualization showing clusters."""
     print("Generating Geographic Cluster Map...")
@@ -220,6 +131,7 @@ def plot_geographic_map():
     print("  Saved: geographic_clusters.png")
 
 
+@instrumented("viz.plot_model_performance")
 def plot_model_performance():
     """Detailed model performance visualization."""
     print("Generating Model Performance Plot...")
@@ -291,6 +203,7 @@ def plot_model_performance():
     print("  Saved: model_performance_detailed.png")
 
 
+@instrumented("viz.paper_visualizations")
 def main():
     print("="*60)
     print("GENERATING VISUALIZATIONS FOR PAPER")
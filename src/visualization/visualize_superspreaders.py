@@ -1,11 +1,16 @@
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.instrument import instrumented
+
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 OUT = os.path.join(PROJECT_ROOT, "outputs")
 
+@instrumented("viz.visualize_superspreaders")
 def main():
     csv_path = os.path.join(OUT, "county_superspreaders.csv")
     if not os.path.exists(csv_path):